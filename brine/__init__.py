@@ -28,34 +28,64 @@ In order to mark a function, method, or partial for storage, use the
 unpickling the wrapper, call `unbrine` to get a new copy of the
 original function.
 
+Alternatively, the `BrinePickler` and `BrineUnpickler` classes (and
+the `dumps` and `loads` helpers) will serialize functions, methods,
+and partials directly, without the need to brine and unbrine.
+
 Loading this module has the side effect of registering a pickle
 handler for the `CellType` and `CodeType` types. This should be of low
 impact, as the only place these types are used is within function
-instances, and are typically unexposed.
+instances, and are typically unexposed. Code objects recreated while
+unpickling or unbrining are interned in `code_interns`, a bounded
+`brine.cache.LRUCache`, so identical code is only held once.
 
 :author: Christopher O'Brien  <obriencj@gmail.com>
 :license: LGPL v.3
 """
 
 
-from ._cellwork import CellType, cell_get_value, cell_from_value
+from .cache import IdentityMap, LRUCache
+from ._cellwork import CellType
+from ._cellwork import cell_get_value, cell_set_value, cell_from_value
+from ._cellwork import cells_get_values, walk
+from ._cellwork import code_unnew, function_unnew, function_new
 from abc import ABCMeta, abstractmethod
+from cStringIO import StringIO
+from collections import OrderedDict, defaultdict, deque
 from functools import partial
-from types import BuiltinFunctionType, BuiltinMethodType
+from inspect import getmro
+from itertools import islice, izip
+from pickle import Pickler, UnpicklingError, POP
+from threading import Lock
 from types import FunctionType, MethodType, CodeType
+from weakref import WeakKeyDictionary, ref
 
 import copy_reg
+import cPickle
+import imp
+import marshal
 import new
+import sys
 
 
-__all__ = ("brine", "unbrine",
+__all__ = ("brine", "unbrine", "brine_many", "unbrine_many",
+           "reg_container", "TypeDispatch", "walk",
+           "BrineMemo", "LazyFunction",
            "BrinedObject",
            "BrinedFunction", "BrinedMethod", "BrinedPartial",
-           "code_unnew", "code_new",
+           "BrinePickler", "BrineUnpickler",
+           "dump", "dumps", "load", "loads",
+           "code_unnew", "code_new", "code_interns",
            "function_unnew", "function_new", )
 
 
-def brine(value):
+# Code objects recreated while unpickling or unbrining are interned
+# here, keyed by their marshaled fields, so that the same code
+# arriving many times results in a single shared code object.
+code_interns = LRUCache(1024)
+
+
+def brine(value, memo=None):
     """
     Wrap an object so that it may be pickled. Behavior by type of
     `value` is as follows:
@@ -64,10 +94,21 @@ def brine(value):
     * `partial` is wrapped as a `BrinedPartial`
     * `instancemethod` is wrapped as a `BrinedMethod`
     * `function` is wrapped as a `BrinedFunction`
-    * `list` and `tuple` are duplicated and contents are brined
-    * `dict` is duplicated and its values are brined
+    * `list`, `tuple`, `set`, `frozenset`, and `deque` are
+      duplicated and contents are brined
+    * `dict` is duplicated and its keys and values are brined
+    * `OrderedDict` is duplicated in order, and its keys and values
+      are brined
+    * `defaultdict` is duplicated with its `default_factory` brined
+      along with its keys and values
+    * other types registered via `reg_container` are duplicated and
+      contents are brined
     * all other types are returned unchanged
 
+    Containers are only duplicated if something inside of them needed
+    to be brined. Function-free data is returned as-is, rather than as
+    a copy.
+
     This function provides neither caching nor preservation of
     uniqueness -- if the same function is in a list multiple times,
     each will be wrapped individually and as a result will be
@@ -85,41 +126,134 @@ def brine(value):
     value : `object`
       object to be brined for pickling
 
+    memo : `BrineMemo` or `None`
+      if given, functions are wrapped via the memo, so that brining
+      the same unchanged function again returns the same wrapper
+
     Returns
     -------
     wrapped : `object`
       as defined by the `value` parameter
     """
 
-    if isinstance(value, (BuiltinFunctionType, BuiltinMethodType)):
-        return value
-    elif isinstance(value, partial):
-        return BrinedPartial(value)
-    elif isinstance(value, MethodType):
-        return BrinedMethod(value)
-    elif isinstance(value, FunctionType):
-        return BrinedFunction(value)
-    elif isinstance(value, (list, tuple)):
-        # create a duplicate of the collection with brined internals
-        ty = type(value)
-        return ty(brine(i) for i in iter(value))
-    elif isinstance(value, dict):
-        items = value.items()
-        return dict((key, brine(val)) for key, val in items)
+    if memo is None:
+        return walk(_brine_member, value)
     else:
-        return value
+        return walk(partial(_brine_member, memo=memo), value)
+
+
+def _brine_member(value, memo=None):
+    # called by walk for any value which isn't a plain list, tuple,
+    # dict, or leaf value
+
+    cls = type(value)
+
+    wrapper = _brine_wrappers.lookup(cls)
+    if wrapper is not None:
+        if memo is not None and wrapper is BrinedFunction:
+            return memo.wrap(value)
+        return wrapper(value)
+
+    # duplicate the container only if it has brined internals
+    mapper = _containers.lookup(cls)
+    if mapper is not None:
+        if memo is None:
+            return mapper(brine, value)
+        else:
+            return mapper(partial(brine, memo=memo), value)
 
+    return value
 
-def unbrine(value, with_globals=None):
+
+def brine_many(values, memo=None):
+    """
+    Brine each of `values`, as per `brine`, as a single batch. Within
+    the batch, each function, method, partial, or container is only
+    brined once no matter how many of the values refer to it, and
+    functions sharing the same code share its brined form. Pickling
+    the batch together therefore writes each of them only once.
+
+    Parameters
+    ----------
+    values : iterable
+      objects to be brined for pickling
+
+    memo : `BrineMemo` or `None`
+      if given, functions are wrapped via the memo, so that brining
+      the same unchanged function in a later batch returns the same
+      wrapper
+
+    Returns
+    -------
+    wrapped : `list`
+      the brined form of each of `values`, in order
+    """
+
+    return map(_batch_briner(memo, dict()), values)
+
+
+def _batch_briner(memo, codes):
+    # a function which brines values as a single batch, as per
+    # brine_many. Everything brined is kept by the value it was
+    # brined from, and the brined code of functions is shared via
+    # codes, a dict of _code_key(ucode) to ucode.
+
+    cache = IdentityMap()
+
+    def brine_member(value):
+        cls = type(value)
+
+        wrapper = _brine_wrappers.lookup(cls)
+        if wrapper is not None:
+            if memo is not None and wrapper is BrinedFunction:
+                ret = memo.wrap(value)
+            elif wrapper is BrinedPartial:
+                # the partial's members are brined within the batch
+                ret = BrinedPartial.__new__(BrinedPartial)
+                ret._brine_parts(value, brine_value)
+            else:
+                ret = wrapper(value)
+            if isinstance(ret, BrinedFunction):
+                _share_code(ret, codes)
+
+        else:
+            mapper = _containers.lookup(cls)
+            if mapper is None:
+                return value
+            ret = mapper(brine_value, value)
+
+        cache.put(value, ret)
+        return ret
+
+    def brine_value(value):
+        return walk(brine_member, value, cache)
+
+    return brine_value
+
+
+def _share_code(wrapper, codes):
+    # have wrapper use the brined code in codes which is identical to
+    # its own, or add its own if there is none
+    unfunc = wrapper._unfunc
+    key = _code_key(unfunc[0])
+    if key is not None:
+        unfunc[0] = codes.setdefault(key, unfunc[0])
+
+
+def unbrine(value, with_globals=None, lazy=False, functions=None):
     """
     Unwrap a `value` previously wrapped with the `brine`
     function. Behavior by type of `value` is as follows:
 
     * `BrinedPartial` unwraps to a `partial`
     * `BrinedMethod` unwraps to a `instancemethod`
-    * `BrinedFunction` unwraps to a `function`
-    * `list` and `tuple` are duplicated and contents unbrined
-    * `dict` is duplicated and its values are unbrined
+    * `BrinedFunction` unwraps to a `function`, or to a `LazyFunction`
+      if `lazy` is True
+    * registered containers are duplicated and their contents are
+      unbrined
+
+    As with `brine`, containers are only duplicated when something
+    inside of them was unbrined.
 
     Parameters
     ----------
@@ -130,50 +264,293 @@ def unbrine(value, with_globals=None):
       globals dictionary to use when recreating functions. `None` is
       the same as `globals()`
 
+    lazy : `bool`
+      if True, functions are unbrined as `LazyFunction` proxies,
+      which only recreate the function when first used
+
+    functions : `brine.cache.LRUCache` or `None`
+      if given, functions are looked up in this cache by the content
+      of their brined form, and are only recreated if not found. A
+      function found there is shared with every other unbrining
+      which found it, so it must not be modified. Only functions
+      whose defaults and closure hold immutable values, and which
+      have no `__dict__` entries, are cached.
+
     Returns
     -------
     unwrapped : `object`
       as defined by the type of `value`
     """
 
+    return _unbriner(with_globals, lazy, functions=functions)(value)
+
+
+def unbrine_many(values, with_globals=None, lazy=False, functions=None):
+    """
+    Unbrine each of `values`, as per `unbrine`, as a single batch.
+    Within the batch, each brined wrapper or container is only
+    unbrined once no matter how many of the values refer to it, so
+    values which shared a function when they were brined with
+    `brine_many` share it again once unbrined.
+
+    Parameters
+    ----------
+    values : iterable
+      values to be unbrined
+
+    with_globals : `dict` or `None`
+      globals dictionary to use when recreating functions. `None` is
+      the same as `globals()`
+
+    lazy : `bool`
+      if True, functions are unbrined as `LazyFunction` proxies,
+      which only recreate the function when first used
+
+    functions : `brine.cache.LRUCache` or `None`
+      cache of functions by content, as per `unbrine`
+
+    Returns
+    -------
+    unwrapped : `list`
+      the unbrined form of each of `values`, in order
+    """
+
+    unbriner = _unbriner(with_globals, lazy, IdentityMap(), functions)
+    return map(unbriner, values)
+
+
+def _unbriner(with_globals, lazy, cache=None, functions=None):
+    # a function which unbrines a value. If cache is given, what it
+    # unbrines is kept there, and reused rather than unbrined again.
+    # If functions is given, it is the LRUCache of functions by
+    # content, as per unbrine.
+
     glbls = globals() if with_globals is None else with_globals
 
-    if isinstance(value, BrinedObject):
-        return value.get(glbls)
-    elif isinstance(value, (list, tuple)):
-        ty = type(value)
-        return ty(unbrine(i, glbls) for i in iter(value))
-    elif isinstance(value, dict):
-        items = value.items()
-        return dict((key, unbrine(val, glbls)) for key, val in items)
+    def unbrine_member(value):
+        cls = type(value)
+
+        if _unbrine_wrappers.lookup(cls) is not None:
+            if functions is not None and cls is BrinedFunction:
+                build = partial(_cached_function, functions, value, glbls)
+                ret = LazyFunction(build) if lazy else build()
+            elif lazy and isinstance(value, BrinedFunction):
+                ret = LazyFunction(partial(value.get, glbls))
+            elif cache is not None and cls is BrinedPartial:
+                # the partial's members are unbrined within the batch
+                ret = value._unbrine_parts(unbrine_value)
+            else:
+                ret = value.get(glbls)
+
+        else:
+            mapper = _containers.lookup(cls)
+            if mapper is None:
+                return value
+            ret = mapper(unbrine_value, value)
+
+        if cache is not None:
+            cache.put(value, ret)
+        return ret
+
+    def unbrine_value(value):
+        return walk(unbrine_member, value, cache)
+
+    return unbrine_value
+
+
+class TypeDispatch(object):
+    """
+    A registry of handlers by type. Looking up a type which has no
+    handler of its own resolves to the handler of the nearest class
+    in its MRO which does, or `None`. Lookups are cached per type, so
+    only the first lookup for any given type needs to walk the MRO.
+    """
+
+    def __init__(self, table=None):
+        self._table = dict(table or ())
+        self._cache = dict()
+
+
+    def register(self, cls, handler):
+        """
+        Associate `handler` with the type `cls` and its subclasses
+        """
+
+        self._table[cls] = handler
+        self._cache.clear()
+
+
+    def lookup(self, cls):
+        """
+        The handler for the type `cls`, or `None`
+        """
+
+        try:
+            return self._cache[cls]
+        except KeyError:
+            pass
+
+        table = self._table
+        handler = None
+        for base in getmro(cls):
+            if base in table:
+                handler = table[base]
+                break
+
+        self._cache[cls] = handler
+        return handler
+
+
+def _mapped_items(func, value):
+    # Apply func to each item of value. If func returned every item
+    # unchanged the result is None, otherwise it is a list of the
+    # mapped items. Nothing is allocated until the first changed item
+    # is found.
+
+    result = None
+    for index, item in enumerate(value):
+        mapped = func(item)
+        if result is not None:
+            result.append(mapped)
+        elif mapped is not item:
+            result = list(islice(value, index))
+            result.append(mapped)
+
+    return result
+
+
+def _map_sequence(func, value):
+    """
+    Apply `func` to each item of the list or tuple `value`. If `func`
+    returned every item unchanged then `value` itself is the result,
+    otherwise a new instance of the same type is created.
+    """
+
+    result = _mapped_items(func, value)
+
+    if result is None:
+        return value
+    elif type(value) is list:
+        return result
     else:
+        return type(value)(result)
+
+
+def _map_deque(func, value):
+    """
+    As `_map_sequence`, preserving the `maxlen` of a `deque`
+    """
+
+    result = _mapped_items(func, value)
+    return value if result is None else type(value)(result, value.maxlen)
+
+
+def _map_mapping(func, value):
+    """
+    Apply `func` to each key and value of the dict `value`. If `func`
+    returned everything unchanged then `value` itself is the result,
+    otherwise a copy with the changed entries replaced is created.
+
+    The copy is made via the `copy` method, so a subclass which
+    doesn't override it is copied as a plain `dict`. `OrderedDict`
+    and `defaultdict` have mappers of their own.
+    """
+
+    result = None
+    for key, val in value.iteritems():
+        mkey = func(key)
+        mapped = func(val)
+        if mkey is not key:
+            if result is None:
+                result = value.copy()
+            del result[key]
+            result[mkey] = mapped
+        elif mapped is not val:
+            if result is None:
+                result = value.copy()
+            result[key] = mapped
+
+    return value if result is None else result
+
+
+def _map_ordered(func, value):
+    """
+    As `_map_mapping`, for an `OrderedDict`. Replacing a changed key
+    in a copy would move it to the end, so the copy is instead built
+    anew with the entries in their original order.
+    """
+
+    result = None
+    for index, (key, val) in enumerate(value.iteritems()):
+        mkey = func(key)
+        mapped = func(val)
+        if result is not None:
+            result.append((mkey, mapped))
+        elif mkey is not key or mapped is not val:
+            result = list(islice(value.iteritems(), index))
+            result.append((mkey, mapped))
+
+    return value if result is None else type(value)(result)
+
+
+def _map_defaultdict(func, value):
+    """
+    As `_map_mapping`, for a `defaultdict` or its brined form. The
+    `default_factory` is mapped along with the entries. A factory
+    which is no longer callable, such as a brined function, is held
+    by a `_BrinedDefaults` in place of the `defaultdict`, which is
+    recreated once its factory is callable again.
+    """
+
+    factory = value.default_factory
+    mfactory = func(factory)
+    result = _map_mapping(func, value)
+
+    if mfactory is factory and result is value:
         return value
+    elif mfactory is None or callable(mfactory):
+        return defaultdict(mfactory, result)
+    else:
+        return _BrinedDefaults(mfactory, result)
 
 
-def code_unnew(code):
+class _BrinedDefaults(dict):
+    """
+    The entries of a brined `defaultdict`, along with its brined
+    `default_factory`
     """
-    The necessary arguments for use in :func:`code_new` to create an
-    identical but distinct :data:`~types.CodeType` instance.
 
-    :param code: code object for inspection
-    :type code: :data:`~types.CodeType`
-    :return: :class:`list` of member values of `code`
+    __slots__ = ("default_factory", )
+
+
+    def __init__(self, default_factory, *args, **kwds):
+        super(_BrinedDefaults, self).__init__(*args, **kwds)
+        self.default_factory = default_factory
+
+
+    def __reduce__(self):
+        return (_BrinedDefaults, (self.default_factory, ),
+                None, None, self.iteritems())
+
+
+def reg_container(cls, mapper):
+    """
+    Register a `mapper` which `brine`, `unbrine`, and `Barrel` will
+    use to walk the members of instances of the type `cls`. This also
+    applies to subclasses of `cls`, unless they have a mapper
+    registered of their own.
+
+    `mapper` will be called as ``mapper(func, value)`` and must return
+    `value` with `func` applied to each of its members. It should
+    return `value` itself if `func` left every member unchanged.
+
+    By default mappers are registered for `list`, `tuple`, `dict`,
+    `set`, `frozenset`, and `deque`. Instances of exactly `list`,
+    `tuple`, and `dict` are always walked natively by `walk`, so only
+    their subclasses are affected by registering those types.
     """
 
-    return [code.co_argcount,
-            code.co_nlocals,
-            code.co_stacksize,
-            code.co_flags,
-            code.co_code,
-            code.co_consts,
-            code.co_names,
-            code.co_varnames,
-            code.co_filename,
-            code.co_name,
-            code.co_firstlineno,
-            code.co_lnotab,
-            code.co_freevars,
-            code.co_cellvars, ]
+    _containers.register(cls, mapper)
 
 
 def code_new(argcount, nlocals, stacksize, flags, code, consts,
@@ -190,40 +567,89 @@ def code_new(argcount, nlocals, stacksize, flags, code, consts,
                     firstlineno, lnotab, freevars, cellvars)
 
 
-def function_unnew(func):
-    """
-    The necessary arguments for use in :func:`function_new` to create
-    an identical but distinct :data:`~types.FunctionType` instance.
+def _code_intern(code_val):
+    # code objects are immutable, so a single instance may be shared
+    # by every function built from the same fields
 
-    :param func: function object for inspection
-    :type func: :data:`~types.FunctionType`
-    :return: :class:`list` of member values of `func`
-    """
+    if code_interns.maxsize == 0:
+        return code_new(*code_val)
 
-    return [func.func_code,
-            func.func_globals,
-            func.func_name,
-            func.func_defaults,
-            func.func_closure, ]
+    key = _code_key(code_val)
+    if key is None:
+        return code_new(*code_val)
 
+    code = code_interns.get(key)
+    if code is None:
+        code = code_new(*code_val)
+        code_interns.put(key, code)
+    return code
 
-def function_new(code, with_globals, name, defaults, closure):
-    """
-    Creates a new function. Identical to :func:`new.function`
 
-    :param code: code object for the function to execute when called
-    :type code: :data:`~types.CodeType`
-    :param with_globals:
-    :type with_globals: :class:`dict` often the result of :func:`globals`
-    :param name: name for the function
-    :type name: :class:`str`
-    :param defaults: defaults for the function
-    :param closure: captured :class:`CellType` cells defining the closure
-    :type closure: :class:`tuple`
-    :return: new :data:`~types.FunctionType` instance
-    """
+def _code_key(code_val):
+    # the fields of a code object as a string, for finding code with
+    # exactly the same fields. The fields themselves can't be compared
+    # as 1 == 1.0 and "a" == u"a", which would have different code
+    # share consts. None if the consts contain something which marshal
+    # doesn't support, and hence can't be safely compared.
+    try:
+        return marshal.dumps(tuple(code_val))
+    except ValueError:
+        return None
+
+
+def _cached_function(functions, wrapper, with_globals):
+    # the function recreated from wrapper, looked up in the LRUCache
+    # functions by the content of wrapper. It is only recreated and
+    # put there if it isn't found. Wrappers whose content can't be
+    # safely compared always recreate their function.
+
+    key = _function_key(wrapper)
+    if key is None:
+        return wrapper.get(with_globals)
+
+    # the cached function holds on to its globals, so their id cannot
+    # be reused while it is in the cache
+    key = (id(with_globals), key)
+    func = functions.get(key)
+    if func is None:
+        func = wrapper.get(with_globals)
+        functions.put(key, func)
+    return func
+
+
+def _function_key(wrapper):
+    # the content of a brined function as a string, or None if it
+    # holds anything which is mutable or not marshalable. A function
+    # with an empty cell is never shared either.
+
+    ucode, _glbls, name, defaults, cells = wrapper._unfunc
+    if wrapper._fdict:
+        return None
+
+    try:
+        vals = None if cells is None else cells_get_values(cells)
+    except ValueError:
+        return None
+
+    if not (_frozen(defaults) and _frozen(vals)):
+        return None
+
+    try:
+        return marshal.dumps((tuple(ucode), name, defaults, vals))
+    except ValueError:
+        return None
 
-    return new.function(code, with_globals, name, defaults, closure)
+
+def _frozen(value):
+    # whether value is made up only of immutable builtin types
+    cls = type(value)
+    if cls is tuple or cls is frozenset:
+        return all(_frozen(item) for item in value)
+    return cls in _frozen_types
+
+
+_frozen_types = frozenset((type(None), bool, int, long, float, complex,
+                           str, unicode, CodeType))
 
 
 class BrinedObject(object):  # pragma: no cover
@@ -235,10 +661,17 @@ class BrinedObject(object):  # pragma: no cover
     * The `get` method should return a new copy of the wrapped `value`
     * Must define the `__getstate__` and `__setstate__` methods for
       `pickle` support.
+
+    The wrappers in this module declare `__slots__`, so that they
+    don't each carry an instance dict. They are pickled by way of
+    `__reduce_ex__`, which saves only their class and the state from
+    `__getstate__`.
     """
 
     __metaclass__ = ABCMeta
 
+    __slots__ = ()
+
     @abstractmethod
     def __init__(self, value):
         """
@@ -298,6 +731,25 @@ class BrinedObject(object):  # pragma: no cover
         """
         pass
 
+    def __reduce_ex__(self, protocol):
+        # protocol 2 has NEWOBJ, which creates the instance without
+        # calling __init__. Earlier protocols call a constructor here
+        # instead of copy_reg's more verbose _reconstructor.
+        if protocol >= 2:
+            return (copy_reg.__newobj__, (type(self), ), self.__getstate__())
+        else:
+            return (_brined_new, (type(self), self.__getstate__()))
+
+    def __reduce__(self):
+        return self.__reduce_ex__(0)
+
+
+def _brined_new(cls, state):
+    # recreates a wrapper pickled with protocol 0 or 1
+    obj = cls.__new__(cls)
+    obj.__setstate__(state)
+    return obj
+
 
 # A function object needs to be brined before it can be pickled, and
 # unbrined after it's unpickled. We need to do this because pickle has
@@ -314,6 +766,9 @@ class BrinedFunction(BrinedObject):
     module rather than instantiating or accessing this class directly
     """
 
+    __slots__ = ("_unfunc", "_fdict", "__weakref__", )
+
+
     def __init__(self, function):
         self._unfunc = self._function_unnew(function)
         self._fdict = dict(function.__dict__)
@@ -359,7 +814,7 @@ class BrinedFunction(BrinedObject):
 
 
     def _code_new(self, with_globals, uncode):
-        return code_new(*uncode)
+        return _code_intern(uncode)
 
 
 class BrinedMethod(BrinedObject):
@@ -373,6 +828,9 @@ class BrinedMethod(BrinedObject):
     instance of this class directly.
     """
 
+    __slots__ = ("_im_self", "_funcname", )
+
+
     def __init__(self, boundmethod):
         self._im_self = boundmethod.im_self
         self._funcname = boundmethod.im_func.__name__
@@ -397,17 +855,28 @@ class BrinedPartial(BrinedObject):
     function or method that is otherwise unsupported by pickle.
     """
 
+    __slots__ = ("_func", "_args", "_keywords", )
+
+
     def __init__(self, part):
-        self._func = brine(part.func)
-        self._args = brine(part.args or None)
-        self._keywords = brine(part.keywords or None)
+        self._brine_parts(part, brine)
+
+
+    def _brine_parts(self, part, brine_value):
+        self._func = brine_value(part.func)
+        self._args = brine_value(part.args or None)
+        self._keywords = brine_value(part.keywords or None)
 
 
     def get(self, with_globals):
+        return self._unbrine_parts(partial(unbrine,
+                                           with_globals=with_globals))
+
 
-        func = unbrine(self._func, with_globals)
-        args = unbrine(self._args or tuple(), with_globals)
-        kwds = unbrine(self._keywords or dict(), with_globals)
+    def _unbrine_parts(self, unbrine_value):
+        func = unbrine_value(self._func)
+        args = unbrine_value(self._args) if self._args else ()
+        kwds = unbrine_value(self._keywords) if self._keywords else {}
         return partial(func, *args, **kwds)
 
 
@@ -419,6 +888,261 @@ class BrinedPartial(BrinedObject):
         self._func, self._args, self._keywords = data
 
 
+# guards the resolution of every LazyFunction, rather than giving
+# each proxy a lock of its own
+_lazy_lock = Lock()
+
+
+class LazyFunction(object):
+    """
+    Stands in for a function which has not been recreated yet. The
+    function is built by calling `build` when the proxy is first
+    called, or when one of its attributes is first used, and all
+    further use is forwarded to it.
+
+    Threads which resolve the proxy at the same time may each call
+    `build`, but only the first function to be finished is kept, and
+    every thread is given that one.
+
+    `unbrine` and `Barrel` create these in place of functions when
+    asked to, so that only the functions which are actually used pay
+    the cost of recreating their code and closure.
+    """
+
+    __slots__ = ("_build", "_function", "__weakref__", )
+
+
+    def __init__(self, build):
+        object.__setattr__(self, "_build", build)
+        object.__setattr__(self, "_function", None)
+
+
+    def resolve(self):
+        """
+        The real function, which is built if it hasn't been yet
+        """
+
+        func = self._function
+        if func is None:
+            build = self._build
+            if build is None:
+                # resolved by another thread since we checked
+                return self._function
+
+            # build is not called under the lock, as it may take a
+            # while or resolve other proxies
+            func = build()
+            with _lazy_lock:
+                if self._function is None:
+                    object.__setattr__(self, "_function", func)
+                    object.__setattr__(self, "_build", None)
+                else:
+                    # another thread built it first
+                    func = self._function
+        return func
+
+
+    def is_resolved(self):
+        """
+        True if the real function has been built
+        """
+
+        return self._function is not None
+
+
+    def __call__(self, *args, **kwds):
+        return self.resolve()(*args, **kwds)
+
+
+    def __get__(self, obj, objtype=None):
+        return self.resolve().__get__(obj, objtype)
+
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+
+    def __setattr__(self, name, value):
+        setattr(self.resolve(), name, value)
+
+
+    def __delattr__(self, name):
+        delattr(self.resolve(), name)
+
+
+    def __repr__(self):
+        if self._function is None:
+            return "<LazyFunction at 0x%x>" % id(self)
+        else:
+            return "<LazyFunction of %r>" % self._function
+
+
+def _brine_lazy(proxy):
+    return BrinedFunction(proxy.resolve())
+
+
+class BrineMemo(object):
+    """
+    Weak memo of `BrinedFunction` wrappers, for use with `brine`.
+    Brining the same function again returns the wrapper created the
+    first time, rather than extracting the function's code and cells
+    again.
+
+    A wrapper is created anew if the function's code, name, defaults,
+    `__dict__`, or closure cell contents no longer match those it was
+    created from. Those are compared by identity.
+
+    The memo holds nothing which could refer back to a function, so
+    functions are collected as usual, and their entries with them,
+    even if their closure refers to an object which refers to them.
+    The wrappers are only held weakly, so once a wrapper has been
+    collected the next one shares its brined code rather than
+    extracting it again.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._entries = WeakKeyDictionary()
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def __contains__(self, function):
+        return function in self._entries
+
+
+    def wrap(self, function):
+        """
+        A `BrinedFunction` wrapping `function`, reused from an earlier
+        call if `function` has not changed since.
+        """
+
+        state = _function_ids(function)
+
+        with self._lock:
+            entry = self._entries.get(function)
+
+        ucode = None
+        if entry is not None:
+            wrapper, known, ucode = entry
+            brined = wrapper()
+            if known[0] is not state[0]:
+                # the code itself was replaced
+                ucode = None
+            elif brined is not None and known == state:
+                if _same_fdict(brined._fdict, function.__dict__):
+                    return brined
+
+        if ucode is None:
+            brined = BrinedFunction(function)
+        else:
+            brined = _brined_with_code(function, ucode)
+
+        with self._lock:
+            self._entries[function] = (ref(brined), state,
+                                       brined._unfunc[0])
+        return brined
+
+
+    def discard(self, function):
+        """
+        Forget any wrapper created for `function`
+        """
+
+        with self._lock:
+            self._entries.pop(function, None)
+
+
+    def clear(self):
+        """
+        Forget all wrappers
+        """
+
+        with self._lock:
+            self._entries.clear()
+
+
+def _function_state(function):
+    closure = function.func_closure
+    if closure is not None:
+        closure = cells_get_values(closure)
+
+    return (function.func_code, function.func_name,
+            function.func_defaults, closure)
+
+
+def _function_ids(function):
+    # the state of function as per _function_state, but with the
+    # defaults and cell contents by id, so that holding it keeps none
+    # of them alive. The ids can only be reused once those are gone,
+    # which they aren't while a wrapper of the function refers to
+    # them -- the wrapper pickles the cells as they are, and holds
+    # the defaults.
+
+    code, name, defaults, closure = _function_state(function)
+    if closure is not None:
+        closure = tuple(map(id, closure))
+    return (code, name, id(defaults), closure)
+
+
+def _brined_with_code(function, ucode):
+    # a BrinedFunction of function, whose code was already brined as
+    # ucode by an earlier wrapper
+    unfunc = function_unnew(function)
+    unfunc[0] = ucode
+    unfunc[1] = dict()
+
+    brined = BrinedFunction.__new__(BrinedFunction)
+    brined.__setstate__((unfunc, dict(function.__dict__)))
+    return brined
+
+
+# marks a missing entry, as distinct from one whose value is None
+_NO_KEY = object()
+
+
+def _same_fdict(known, fdict):
+    if len(known) != len(fdict):
+        return False
+
+    for key, val in fdict.iteritems():
+        if known.get(key, _NO_KEY) is not val:
+            return False
+    return True
+
+
+# The dispatch tables used by brine and unbrine. Types are resolved by
+# exact type first, and then by walking the MRO.
+
+
+_brine_wrappers = TypeDispatch({
+    partial: BrinedPartial,
+    MethodType: BrinedMethod,
+    FunctionType: BrinedFunction,
+    LazyFunction: _brine_lazy,
+})
+
+
+_unbrine_wrappers = TypeDispatch({
+    BrinedObject: BrinedObject,
+})
+
+
+_containers = TypeDispatch({
+    list: _map_sequence,
+    tuple: _map_sequence,
+    set: _map_sequence,
+    frozenset: _map_sequence,
+    deque: _map_deque,
+    dict: _map_mapping,
+    OrderedDict: _map_ordered,
+    defaultdict: _map_defaultdict,
+    _BrinedDefaults: _map_defaultdict,
+})
+
+
 # let's give the pickle module knowledge of how to load and dump Cell
 # and Code objects
 
@@ -450,17 +1174,55 @@ def _pickle_code(code):
 
 
 def _unpickle_code(*code_val):
-    return code_new(*code_val)
+    return _code_intern(code_val)
+
+
+# marshal's encoding of code objects is only good for interpreters
+# sharing the same bytecode magic and marshal version, so each blob
+# is tagged with both
+_MARSHAL_TAG = (imp.get_magic(), marshal.version)
 
 
-def reg_code_pickler():
+def _marshal_code(code):
+    try:
+        data = marshal.dumps(code)
+    except ValueError:
+        # something in the consts that marshal cannot handle, so
+        # fall back to pickling the fields
+        return _pickle_code(code)
+    else:
+        return _unmarshal_code, (_MARSHAL_TAG, data)
+
+
+def _unmarshal_code(tag, data):
+    if tag != _MARSHAL_TAG:
+        raise UnpicklingError("code object was marshaled by an"
+                              " incompatible interpreter")
+
+    # the blob is itself a marshaled code object, which cannot be
+    # confused with the marshaled fields used as keys by _code_intern
+    code = code_interns.get(data)
+    if code is None:
+        code = marshal.loads(data)
+        code_interns.put(data, code)
+    return code
+
+
+def reg_code_pickler(use_marshal=False):
     """
     Called automatically when the module is loaded, this function will
     ensure that the CodeType has pickle/unpickle functions registered
     with copy_reg
+
+    If `use_marshal` is True, code objects will instead be stored as
+    a single `marshal` blob. This is considerably faster to load, but
+    the blob may only be loaded by an interpreter with the same
+    bytecode version as the one which dumped it. Streams written with
+    the field-wise encoding remain loadable either way.
     """
 
-    copy_reg.pickle(CodeType, _pickle_code, _unpickle_code)
+    reduction = _marshal_code if use_marshal else _pickle_code
+    copy_reg.pickle(CodeType, reduction, _unpickle_code)
 
 
 # Register when the module is loaded. Note, we do this to support
@@ -469,5 +1231,351 @@ def reg_code_pickler():
 reg_code_pickler()
 
 
+# The single-pass pickler. Rather than duplicating the value with
+# brine and then having pickle walk the duplicate, BrinePickler
+# serializes functions directly as it encounters them.
+
+
+_GLOBALS = object()
+_GLOBALS_PID = "brine.globals"
+
+
+def _cell_empty():
+    return cell_from_value(None)
+
+
+def _cell_fill(cell, cell_val):
+    cell_set_value(cell, cell_val)
+    return cell
+
+
+def _function_skel(code, with_globals, name, closure):
+    return function_new(code, with_globals, name, None, closure)
+
+
+def _function_fill(func, defaults, fdict, cells, cell_vals):
+    func.func_defaults = defaults
+    if fdict:
+        func.__dict__.update(fdict)
+    for cell, cell_val in izip(cells, cell_vals):
+        cell_set_value(cell, cell_val)
+    return func
+
+
+def _is_importable(func):
+    # functions which can be found again by their module and name
+    # are saved by reference, as pickle would normally do
+
+    module = func.__module__
+    if module is None:
+        return False
+
+    try:
+        __import__(module)
+    except ImportError:
+        return False
+
+    found = getattr(sys.modules[module], func.__name__, None)
+    return found is func
+
+
+def _partial_new(func, args, keywords):
+    return partial(func, *args, **(keywords or {}))
+
+
+class _Reduce(object):
+    # pickled as a call to func(*args), whose result is what loads
+
+    __slots__ = ("_func", "_args", )
+
+
+    def __init__(self, func, *args):
+        self._func = func
+        self._args = args
+
+
+    def __reduce__(self):
+        return self._func, self._args
+
+
+class BrinePickler(object):
+    """
+    A pickler which knows how to serialize functions, bound methods,
+    partials, code and cells. Values do not need to be brined before
+    being dumped, and the stream is produced by `cPickle` in a single
+    traversal. `protocol` defaults to the highest available.
+
+    Functions which can be imported by their module and name are
+    saved by reference, as `pickle` would normally do. All other
+    functions (lambdas and inner functions) have their code and
+    closure saved.
+
+    Uniqueness is preserved by the pickle memo, so functions sharing
+    closure cells, or referring to themselves through their closure,
+    come back out sharing the same cells. As with `brine`, the
+    function's globals are not stored; they are provided to the
+    `BrineUnpickler` instead.
+    """
+
+    def __init__(self, file, protocol=None):
+        if protocol is None:
+            protocol = cPickle.HIGHEST_PROTOCOL
+
+        if protocol == 0:
+            # the text protocol only permits string persistent ids
+            self._pickler = _TextPickler(file, protocol)
+        else:
+            self._pickler = cPickle.Pickler(file, protocol)
+            self._pickler.inst_persistent_id = self._persistent_id
+
+        # the persistent id of everything saved so far which pickle
+        # couldn't save itself, by that object. Each is a tuple whose
+        # first item loads as the object.
+        self._pids = IdentityMap()
+
+
+    def dump(self, value):
+        """
+        Write a pickled representation of `value` to the file
+        """
+
+        self._pickler.dump(value)
+
+
+    def _persistent_id(self, obj):
+        # called by cPickle for each object which isn't of a type it
+        # handles itself, including functions which it couldn't save
+        # by reference. Objects it can't save are given a persistent
+        # id which it can.
+        save = self._savers.get(type(obj))
+        if save is None:
+            return None
+        return save(self, obj)
+
+
+    _savers = dict()
+
+
+    def _save_function(self, func):
+        pid = self._pids.get(func)
+        if pid is not None:
+            return pid
+
+        # the cells of the closure are created empty when the function
+        # is, and are only filled once the function is in the memo.
+        # This permits the cells to refer back to the function.
+        cells, refs = list(), list()
+        for cell in func.func_closure or ():
+            ref = self._pids.get(cell)
+            if ref is None:
+                ref = (_Reduce(_cell_empty), )
+                self._pids.put(cell, ref)
+                cells.append(cell)
+            refs.append(ref[0])
+
+        skel = _Reduce(_function_skel, func.func_code, _GLOBALS,
+                       func.func_name, tuple(refs) if refs else None)
+        self._pids.put(func, (skel, ))
+
+        fill = _Reduce(_function_fill, skel, func.func_defaults,
+                       func.__dict__ or None,
+                       tuple(self._pids.get(cell)[0] for cell in cells),
+                       tuple(cell_get_value(cell) for cell in cells))
+        return (skel, fill)
+
+    _savers[FunctionType] = _save_function
+
+
+    def _save_method(self, method):
+        pid = self._pids.get(method)
+        if pid is None:
+            im_self = method.im_self
+            if im_self is None:
+                im_self = method.im_class
+
+            pid = (_Reduce(getattr, im_self, method.im_func.__name__), )
+            self._pids.put(method, pid)
+        return pid
+
+    _savers[MethodType] = _save_method
+
+
+    def _save_cell(self, cell):
+        pid = self._pids.get(cell)
+        if pid is not None:
+            return pid
+
+        pid = (_Reduce(_cell_empty), )
+        self._pids.put(cell, pid)
+        return (pid[0], _Reduce(_cell_fill, pid[0], cell_get_value(cell)))
+
+    _savers[CellType] = _save_cell
+
+
+    def _save_lazy(self, proxy):
+        # proxies are saved as the function they stand in for
+        return self._save_function(proxy.resolve())
+
+    _savers[LazyFunction] = _save_lazy
+
+
+    def _save_globals(self, obj):
+        return _GLOBALS_PID if obj is _GLOBALS else None
+
+    _savers[object] = _save_globals
+
+
+class _TextPickler(Pickler):
+    # BrinePickler for protocol 0, which only permits string persistent
+    # ids. Functions are written via the dispatch table of the pure
+    # python Pickler instead.
+
+    dispatch = Pickler.dispatch.copy()
+
+
+    def persistent_id(self, obj):
+        if obj is _GLOBALS:
+            return _GLOBALS_PID
+        else:
+            return None
+
+
+    def save_function(self, func):
+        if _is_importable(func):
+            self.save_global(func)
+            return
+
+        write = self.write
+        memo = self.memo
+
+        # the cells of the closure are created empty and memoized
+        # before the function itself, and are only filled once the
+        # function is in the memo. This permits the cells to refer
+        # back to the function.
+        closure = func.func_closure or ()
+        cells = []
+        for cell in closure:
+            if id(cell) not in memo:
+                self.save_reduce(_cell_empty, (), obj=cell)
+                write(POP)
+                cells.append(cell)
+
+        self.save_reduce(_function_skel,
+                         (func.func_code, _GLOBALS,
+                          func.func_name, func.func_closure),
+                         obj=func)
+        write(POP)
+
+        cell_vals = tuple(cell_get_value(cell) for cell in cells)
+        self.save_reduce(_function_fill,
+                         (func, func.func_defaults, func.__dict__ or None,
+                          tuple(cells), cell_vals))
+
+    dispatch[FunctionType] = save_function
+
+
+    def save_method(self, method):
+        im_self = method.im_self
+        if im_self is None:
+            im_self = method.im_class
+
+        self.save_reduce(getattr, (im_self, method.im_func.__name__),
+                         obj=method)
+
+    dispatch[MethodType] = save_method
+
+
+    def save_partial(self, part):
+        self.save_reduce(_partial_new,
+                         (part.func, part.args, part.keywords or None),
+                         obj=part)
+
+    dispatch[partial] = save_partial
+
+
+    def save_cell(self, cell):
+        self.save_reduce(_cell_empty, (), obj=cell)
+        self.write(POP)
+        self.save_reduce(_cell_fill, (cell, cell_get_value(cell)))
+
+    dispatch[CellType] = save_cell
+
+
+    def save_lazy(self, proxy):
+        # proxies are saved as the function they stand in for
+        self.save(proxy.resolve())
+
+    dispatch[LazyFunction] = save_lazy
+
+
+class BrineUnpickler(object):
+    """
+    An unpickler for loading streams written by a `BrinePickler`.
+    Functions are recreated using `with_globals` as their globals,
+    and there is no need to `unbrine` the loaded value.
+    """
+
+    def __init__(self, file, with_globals=None):
+        self._glbls = globals() if with_globals is None else with_globals
+        self._unpickler = cPickle.Unpickler(file)
+        self._unpickler.persistent_load = self._persistent_load
+
+
+    def load(self):
+        """
+        Read and return a value from the file
+        """
+
+        return self._unpickler.load()
+
+
+    def _persistent_load(self, pid):
+        if type(pid) is tuple:
+            # the rest of the tuple was only needed while loading
+            return pid[0]
+        elif pid == _GLOBALS_PID:
+            return self._glbls
+        else:
+            raise UnpicklingError("unsupported persistent id: %r" % pid)
+
+
+def dump(value, file, protocol=None):
+    """
+    Write a pickled representation of `value` to the open `file`,
+    using a `BrinePickler`
+    """
+
+    BrinePickler(file, protocol).dump(value)
+
+
+def dumps(value, protocol=None):
+    """
+    The pickled representation of `value` as a string, as written by
+    a `BrinePickler`
+    """
+
+    buffer = StringIO()
+    BrinePickler(buffer, protocol).dump(value)
+    return buffer.getvalue()
+
+
+def load(file, with_globals=None):
+    """
+    Read and return a value from the open `file`, using a
+    `BrineUnpickler`
+    """
+
+    return BrineUnpickler(file, with_globals).load()
+
+
+def loads(data, with_globals=None):
+    """
+    Read and return a value from the pickled representation `data`,
+    using a `BrineUnpickler`
+    """
+
+    return BrineUnpickler(StringIO(data), with_globals).load()
+
+
 #
 # The end.
@@ -24,14 +24,20 @@ preserving uniqueness.
 
 from abc import ABCMeta
 from . import BrinedObject, BrinedFunction, BrinedMethod, BrinedPartial
-from ._cellwork import cell_get_value, cell_set_value, cell_from_value
+from . import LazyFunction, TypeDispatch, walk
+from . import _cached_function, _code_key, _containers, _unbrine_wrappers
+from . import _same_fdict
+from .cache import IdentityMap
+from ._cellwork import cells_get_values, cells_set_values, cells_from_values
 from functools import partial
-from itertools import imap
-from types import BuiltinFunctionType, BuiltinMethodType
+from itertools import izip
+from threading import RLock
 from types import FunctionType, MethodType
 
+import cPickle
 
-__all__ = ("Barrel", "BarreledObject",
+
+__all__ = ("Barrel", "BarrelGroup", "BarreledObject",
            "BarreledFunction", "BarreledMethod", "BarreledPartial", )
 
 
@@ -48,6 +54,10 @@ class BarreledObject(BrinedObject):
 
     __metaclass__ = ABCMeta
 
+    # subclasses each declare the _barrel slot, as only one of their
+    # bases may have a non-empty __slots__
+    __slots__ = ()
+
 
     def __init__(self, barrel, value):
         """
@@ -83,6 +93,19 @@ class BarreledObject(BrinedObject):
         return self._barrel._unbrine(brined_value)
 
 
+    def defer_related(self, work, *args):
+        """
+        Utility method for implementations to request that the parent
+        barrel call `work(*args)` later in the current brining or
+        unbrining pass, rather than immediately. Wrappers which brine
+        or unbrine their related values from deferred work do not
+        recurse into one another, so long chains of them (such as
+        closures referring to closures) may be of any length.
+        """
+
+        self._barrel._defer(work, args)
+
+
     def __getstate__(self):
         return (self._barrel, ) + super(BarreledObject, self).__getstate__()
 
@@ -99,26 +122,21 @@ class BarreledFunction(BarreledObject, BrinedFunction):
     pickled.
     """
 
-    def _brine_cell(self, cell):
-        val = cell_get_value(cell)
-        bval = self.brine_related(val)
-        return cell_from_value(bval)
-
-
-    def _unbrine_cell(self, with_globals, cell):
-        val = cell_get_value(cell)
-        ubval = self.unbrine_related(val)
-        cell_set_value(cell, ubval)
+    __slots__ = ("_barrel", )
 
 
     def _code_unnew(self, code):
         uncode = super(BarreledFunction, self)._code_unnew(code)
-        uncode[5] = tuple(imap(self.brine_related, uncode[5]))
+
+        # the consts are a tuple, and so are walked as a whole. This
+        # usually results in the same tuple, as consts are rarely
+        # anything other than leaf values
+        uncode[5] = self.brine_related(uncode[5])
         return uncode
 
 
     def _code_new(self, with_globals, ucode):
-        ucode[5] = tuple(imap(self.unbrine_related, ucode[5]))
+        ucode[5] = self.unbrine_related(ucode[5])
         return super(BarreledFunction, self)._code_new(with_globals, ucode)
 
 
@@ -126,12 +144,31 @@ class BarreledFunction(BarreledObject, BrinedFunction):
         self._barrel._putcache(function, self)
 
         ufunc = super(BarreledFunction, self)._function_unnew(function)
-        if ufunc[4] is not None:
-            ufunc[4] = tuple(imap(self._brine_cell, ufunc[4]))
+        cells = ufunc[4]
+        if cells is not None:
+            # new cells are created holding the original values, and
+            # are filled with the brined values later in the pass
+            cells = cells_from_values(cells_get_values(cells))
+            self.defer_related(self._brine_cells, cells)
+            ufunc[4] = cells
         return ufunc
 
 
+    def _brine_cells(self, cells):
+        # the tuple of values is transient, so it is not given to the
+        # barrel as a whole, where it would be cached by id
+        vals = map(self.brine_related, cells_get_values(cells))
+        cells_set_values(cells, vals)
+
+
     def _function_new(self, with_globals, ufunc):
+        # the new function gets its own cells, so that unbrining them
+        # below leaves this wrapper's brined cells untouched
+        cells = ufunc[4]
+        if cells is not None:
+            cells = cells_from_values(cells_get_values(cells))
+            ufunc[4] = cells
+
         func = super(BarreledFunction, self)._function_new(with_globals, ufunc)
 
         # make sure the barrel only attempts to unbrine this function
@@ -143,14 +180,42 @@ class BarreledFunction(BarreledObject, BrinedFunction):
         # newly generated function and will unbrine any cells. We need
         # to do this in a second pass because it's possible that one
         # of the cells will want to be the same function that we've
-        # just unbrined
-        if ufunc[4] is not None:
-            ub = partial(self._unbrine_cell, with_globals)
-            ufunc[4] = tuple(imap(ub, ufunc[4]))
+        # just unbrined. It is deferred so that functions whose cells
+        # refer to further functions do not recurse.
+        if cells is not None:
+            self.defer_related(self._unbrine_cells, cells)
 
         return func
 
 
+    def _unbrine_cells(self, cells):
+        vals = map(self.unbrine_related, cells_get_values(cells))
+        cells_set_values(cells, vals)
+
+
+    def _table_entry(self, barrel):
+        ucode, _glbls, name, defaults, cells = self._unfunc
+        if cells is not None:
+            cells = tuple(map(barrel._tabulate, cells_get_values(cells)))
+
+        return (_FUNCTION, barrel._code_index(ucode), name, defaults,
+                cells, self._fdict)
+
+
+    @classmethod
+    def _from_table_entry(cls, barrel, entry):
+        _kind, code_index, name, defaults, cells, fdict = entry
+        if cells is not None:
+            cells = cells_from_values(cells)
+
+        wrapper = cls.__new__(cls)
+        wrapper._barrel = barrel
+        wrapper._unfunc = [barrel._codes[code_index], dict(), name,
+                           defaults, cells]
+        wrapper._fdict = fdict
+        return wrapper
+
+
 class BarreledMethod(BarreledObject, BrinedMethod):
     """
     A brined bound method in a barrel.  This wrapper is created
@@ -158,7 +223,19 @@ class BarreledMethod(BarreledObject, BrinedMethod):
     it is pickled.
     """
 
-    pass
+    __slots__ = ("_barrel", )
+
+
+    def _table_entry(self, barrel):
+        return (_METHOD, self._im_self, self._funcname)
+
+
+    @classmethod
+    def _from_table_entry(cls, barrel, entry):
+        wrapper = cls.__new__(cls)
+        wrapper._barrel = barrel
+        _kind, wrapper._im_self, wrapper._funcname = entry
+        return wrapper
 
 
 class BarreledPartial(BarreledObject, BrinedPartial):
@@ -168,27 +245,126 @@ class BarreledPartial(BarreledObject, BrinedPartial):
     pickled.
     """
 
+    __slots__ = ("_barrel", )
+
+
     def __init__(self, barrel, part):
         self._barrel = barrel
+        self._func = None
+        self._args = None
+        self._keywords = None
+        self.defer_related(self._brine_partial, part)
+
 
-        brine = self.brine_related
-        self._func = brine(part.func)
-        self._args = brine(part.args or None)
-        self._keywords = brine(part.keywords or None)
+    def _brine_partial(self, part):
+        self._brine_parts(part, self.brine_related)
 
 
     def get(self, with_globals):
-        unbrine = self.unbrine_related
-        func = unbrine(self._func)
-        args = unbrine(self._args or tuple())
-        kwds = unbrine(self._keywords or dict())
-        return partial(func, *args, **kwds)
+        return self._unbrine_parts(self.unbrine_related)
+
+
+    def _table_entry(self, barrel):
+        tabulate = barrel._tabulate
+        return (_PARTIAL, tabulate(self._func), tabulate(self._args),
+                tabulate(self._keywords))
+
+
+    @classmethod
+    def _from_table_entry(cls, barrel, entry):
+        wrapper = cls.__new__(cls)
+        wrapper._barrel = barrel
+        _kind, wrapper._func, wrapper._args, wrapper._keywords = entry
+        return wrapper
+
+
+class _BarrelRef(object):
+    # stands in for the wrapper at index in the table of a barrel's
+    # pickled state
+
+    __slots__ = ("index", )
+
+
+    def __init__(self, index):
+        self.index = index
+
+
+    def __eq__(self, other):
+        return type(other) is _BarrelRef and other.index == self.index
+
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+
+    def __hash__(self):
+        return hash(self.index)
+
+
+    def __reduce__(self):
+        return (_BarrelRef, (self.index, ))
+
+
+    def __repr__(self):
+        return "<barrel ref %i>" % self.index
+
+
+class _StaleMemo(Exception):
+    # raised by a dirty pass which finds a function that has changed
+    # since its wrapper in the memo was made
+    pass
 
 
 class Barrel(object):
     """
     Mapping supporting automatic brining of contained values when
     pickled. Provides the `dict` interface special methods.
+
+    An unpickled Barrel unbrines its values on demand. Getting a
+    single value only rebuilds that value and whatever it refers to,
+    and values gotten at different times still share any references
+    they had in common when the Barrel was pickled. Iterating over
+    keys only unbrines the keys. Operations which need every value,
+    or which modify the Barrel, unbrine everything at once.
+
+    Once a Barrel has been brined, setting or deleting keys marks them
+    as dirty, and only the dirty keys are brined again when it is next
+    pickled. Functions, methods, and partials which were brined or
+    unbrined before keep their existing wrappers, so values set later
+    still share them with the rest of the Barrel. If one of those
+    functions has since been changed, or a container which was brined
+    before would now be brined differently, everything is brined again
+    instead. Modifying a value in place does not mark its key as
+    dirty.
+
+    After `use_proxies()`, functions are unbrined as `LazyFunction`
+    proxies, which only recreate their function when first used.
+    After `use_function_cache()`, functions are looked up by content
+    in a cache shared with other Barrels, and only recreated if they
+    aren't found there.
+
+    A Barrel may be pickled, and have its values gotten on demand, by
+    many threads at once. Each Barrel has its own lock, which is held
+    while it brines or unbrines, but not while its state is pickled.
+    The state is never changed in place once it has been returned, so
+    a Barrel may be modified and brined again while an earlier state
+    is still being written.
+
+    A Barrel which will be pickled many times without changing, eg. to
+    send it to many workers, may be sealed. A sealed Barrel keeps the
+    pickled bytes made when it was sealed, and is pickled as just
+    those bytes. It may not be modified until it is unsealed.
+
+    When pickled, the state of a Barrel is a table of code, a table of
+    the functions, methods, and partials it contains, and its brined
+    values in which each of those is replaced by a small reference
+    into the table. Code shared by many functions is only written
+    once. Loading reads that state as-is, and the wrappers in the
+    table are only recreated when a value refers to them. Keys which
+    are brined again append to the existing tables, leaving unused
+    entries behind. Once the dirty keys brined since the tables were
+    made add up to as much as the whole Barrel did, everything is
+    brined again, and the tables are made anew.
     """
 
     def __init__(self, *pairs, **values):
@@ -202,43 +378,69 @@ class Barrel(object):
         self._brined = None
         self._unbrined = dict(*pairs, **values)
         self._glbls = globals()
+        self._proxies = False
+        self._functions = None
+        self._sealed = None
+        self._lock = RLock()
         self._cache = None
+        self._pending = None
+        self._clear_lazy()
+        self._clear_memo()
+        self._clear_table()
 
 
     # == dict API ==
 
     def __setitem__(self, key, val):
-        if self._unbrined is None:
-            self._unbrine_all()
-        self._unbrined[key] = val
+        with self._lock:
+            self._check_unsealed()
+            if self._unbrined is None:
+                self._unbrine_all()
+            self._unbrined[key] = val
+            self._dirty.add(key)
 
 
     def __getitem__(self, key):
         if self._unbrined is None:
-            self._unbrine_all()
+            return self._unbrine_key(key)
         return self._unbrined[key]
 
 
     def __delitem__(self, key):
-        if self._unbrined is not None:
+        with self._lock:
+            self._check_unsealed()
+            if self._unbrined is None:
+                self._unbrine_all()
             del self._unbrined[key]
+            self._dirty.add(key)
 
 
     def __iter__(self):
         if self._unbrined is None:
-            self._unbrine_all()
+            return iter(self._unbrine_keys())
         return iter(self._unbrined)
 
 
+    def __contains__(self, key):
+        with self._lock:
+            if self._unbrined is None:
+                # the key may itself have been brined, eg. a function
+                return key in self._brined or key in self._unbrine_keys()
+            return key in self._unbrined
+
+
     def get(self, key, default_value=None):
         """
         An unbrined copy of the value assodicated with `key` if `key` is
         in this Barrel, else `default_value`.
         """
 
-        if self._unbrined is None:
-            self._unbrine_all()
-        return self._unbrined.get(key, default_value)
+        with self._lock:
+            if self._unbrined is None:
+                if key not in self:
+                    return default_value
+                return self._unbrine_key(key)
+            return self._unbrined.get(key, default_value)
 
 
     def iteritems(self):
@@ -255,13 +457,13 @@ class Barrel(object):
 
     def iterkeys(self):
         if self._unbrined is None:
-            self._unbrine_all()
+            return iter(self._unbrine_keys())
         return self._unbrined.iterkeys()
 
 
     def keys(self):
         if self._unbrined is None:
-            self._unbrine_all()
+            return list(self._unbrine_keys())
         return self._unbrined.keys()
 
 
@@ -283,9 +485,14 @@ class Barrel(object):
         `from_dict`
         """
 
-        if self._unbrined is None:
-            self._unbrine_all()
-        return self._unbrined.update(from_dict)
+        from_dict = dict(from_dict)
+
+        with self._lock:
+            self._check_unsealed()
+            if self._unbrined is None:
+                self._unbrine_all()
+            self._unbrined.update(from_dict)
+            self._dirty.update(from_dict)
 
 
     def clear(self):
@@ -294,26 +501,63 @@ class Barrel(object):
         cache.
         """
 
-        self._brined = None
-        self._unbrined = dict()
+        with self._lock:
+            self._check_unsealed()
+            self._brined = None
+            self._unbrined = dict()
+            self._clear_lazy()
+            self._clear_memo()
+            self._clear_table()
 
 
     # == pickle API ==
 
+    def __reduce_ex__(self, protocol):
+        data = self._sealed
+        if data is None:
+            return object.__reduce_ex__(self, protocol)
+
+        # rather than walking its state again, a sealed barrel is
+        # pickled as the bytes it was sealed with
+        return (_sealed_barrel, (data, ))
+
+
     def __getstate__(self):
-        if self._unbrined is None:
-            return self._brined or dict()
-        else:
-            if self._brined is None:
-                self._brine_all()
-            return self._brined
+        with self._lock:
+            if self._unbrined is not None:
+                if self._brined is None:
+                    self._brine_all()
+                elif self._dirty:
+                    self._brine_dirty()
 
+            return (_BARREL_FORMAT, self._codes, self._entries,
+                    self._brined or dict())
+
+
+    def __setstate__(self, state):
+        self._clear_table()
+
+        if type(state) is tuple and state[0] == _BARREL_FORMAT:
+            _format, codes, entries, data = state
+            self._codes = codes
+            self._code_indexes = None
+            self._entries = entries
+            self._wrappers = [None] * len(entries)
+        else:
+            # a plain dict of wrappers, from before the tables
+            data = state
 
-    def __setstate__(self, data):
         self._brined = data
         self._unbrined = None
         self._glbls = globals()
+        self._proxies = False
+        self._functions = None
+        self._sealed = None
+        self._lock = RLock()
         self._cache = None
+        self._pending = None
+        self._clear_lazy()
+        self._clear_memo()
 
 
     # == Barrel API ==
@@ -327,6 +571,87 @@ class Barrel(object):
         self._glbls = globals() if glbls is None else glbls
 
 
+    def use_proxies(self, proxies=True):
+        """
+        If `proxies` is True, functions unbrined from now on are
+        `LazyFunction` proxies rather than functions. Each function is
+        then only recreated when its proxy is first called or has an
+        attribute used.
+        """
+
+        self._proxies = proxies
+
+
+    def use_function_cache(self, functions=None):
+        """
+        If `functions` is a `brine.cache.LRUCache`, functions unbrined
+        from now on are looked up in it by their content, and are only
+        recreated if not found, as per the `functions` parameter of
+        `brine.unbrine`. `None` stops using a cache.
+        """
+
+        self._functions = functions
+
+
+    def seal(self, protocol=cPickle.HIGHEST_PROTOCOL):
+        """
+        Pickle this Barrel with `protocol`, and keep the resulting
+        bytes. Until `unseal` is called, pickling this Barrel again
+        writes those same bytes, and attempting to modify it raises a
+        `TypeError`.
+
+        Returns the bytes, which `Barrel.from_bytes` will load. If this
+        Barrel is already sealed, the bytes from then are returned.
+        """
+
+        with self._lock:
+            data = self._sealed
+            if data is None:
+                data = cPickle.dumps(self, protocol)
+                self._sealed = data
+            return data
+
+
+    def unseal(self):
+        """
+        Discard the bytes kept by `seal`, allowing this Barrel to be
+        modified again.
+        """
+
+        with self._lock:
+            self._sealed = None
+
+
+    def is_sealed(self):
+        """
+        True if this Barrel has been sealed, and not since unsealed
+        """
+
+        return self._sealed is not None
+
+
+    @classmethod
+    def from_bytes(cls, data, with_globals=None):
+        """
+        Load a Barrel from the bytes returned by `seal`. The loaded
+        Barrel is sealed with those same bytes, so it can be sent on
+        without pickling it again.
+
+        If `with_globals` is given, it is used as the globals of any
+        functions unbrined from the Barrel, as per `use_globals`.
+        """
+
+        barrel = cPickle.loads(data)
+        if not isinstance(barrel, cls):
+            raise TypeError("expected pickled %s, not %s" %
+                            (cls.__name__, type(barrel).__name__))
+
+        barrel._sealed = data
+        if with_globals is not None:
+            barrel.use_globals(with_globals)
+        return barrel
+
+
     def reset(self):
         """
         Clears the internal cache. Any future sets or gets from this
@@ -336,108 +661,684 @@ class Barrel(object):
         If you retrieved a value from this barrel and want to load a
         new copy (possibly with different globals), calling `reset()`
         is a way to achieve such.
+
+        If this Barrel has already been brined, any keys which were
+        set or deleted since are discarded rather than brined.
         """
 
-        if self._brined is None:
-            self._brine_all()
-        self._unbrined = None
+        with self._lock:
+            if self._brined is None:
+                self._brine_all()
+            self._unbrined = None
+            self._clear_lazy()
+            self._clear_memo()
+
+
+    def _check_unsealed(self):
+        if self._sealed is not None:
+            raise TypeError("cannot modify a sealed Barrel")
 
 
     def _brine_all(self):
-        oldcache = self._cache
-        self._cache = dict()
-        self._brined = self._brine(self._unbrined)
-        self._cache = oldcache
+        self._clear_memo()
+        self._clear_table()
+
+        # the wrappers must be complete before they can be put into
+        # the table, so that is a second pass
+        memo = self._memo
+        brined = self._pass(partial(self._brine, self._unbrined),
+                            cache=memo)
+        brined = self._pass(partial(self._tabulate, brined))
+        self._baseline = len(memo)
+
+        # containers without functions come back unchanged, but the
+        # barrel needs to keep its own brined and unbrined mappings
+        if brined is self._unbrined:
+            brined = dict(brined)
+        self._brined = brined
+
+
+    def _brine_dirty(self):
+        # brine only the keys which were set or deleted since the last
+        # pass. Their values get a cache of their own, so that they
+        # are brined as they are now, but they keep the wrappers in
+        # the memo so that they still share those with the rest of
+        # the barrel. Where that isn't possible, or once the tables
+        # have grown enough, everything is brined again instead. The
+        # state returned by earlier calls to __getstate__ may still be
+        # being pickled by another thread, so it is copied rather than
+        # updated in place.
+
+        cache = IdentityMap()
+        try:
+            changes = self._pass(self._brine_changes, self._dirty,
+                                 cache=cache)
+        except _StaleMemo:
+            changes = None
+
+        if changes is None or not self._merge_memo(cache):
+            self._brine_all()
+            return
+
+        self._brined = dict(self._brined)
+        self._codes = list(self._codes)
+        self._entries = list(self._entries)
+
+        self._pass(self._tabulate_changes, changes)
+        self._dirty = set()
+
+
+    def _merge_memo(self, cache):
+        # adds what a dirty pass brined to the memo. False if anything
+        # in it was brined differently by an earlier pass, as a
+        # container with a new copy would no longer be shared, or if
+        # the passes since the tables were made have brined as much
+        # as the pass which made them did.
+
+        self._growth += len(cache)
+        if self._growth > max(self._baseline, _MIN_GROWTH):
+            return False
+
+        loaded = self._loaded
+        if loaded is not None:
+            self._loaded = None
+            self._memoize_loaded(loaded)
+
+        memo = self._memo
+        for original in cache:
+            brined = cache.get(original)
+            if memo.get(original, brined) is not brined:
+                return False
+
+        for original in cache:
+            memo.put(original, cache.get(original))
+        return True
+
+
+    def _brine_changes(self, keys):
+        brine = self._brine
+        unbrined = self._unbrined
+
+        changes = list()
+        for key in keys:
+            if key in unbrined:
+                changes.append((brine(key), brine(unbrined[key])))
+            else:
+                changes.append((brine(key), _REMOVED))
+        return changes
+
+
+    def _tabulate_changes(self, changes):
+        tabulate = self._tabulate
+        brined = self._brined
+
+        for key, val in changes:
+            key = tabulate(key)
+            brined.pop(key, None)
+            if val is not _REMOVED:
+                brined[key] = tabulate(val)
+
+
+    def _clear_table(self):
+        # the code and wrapper tables of the pickled state. Wrappers
+        # loaded from the table are only recreated when needed, and
+        # the index of each recreated or newly tabulated wrapper is
+        # kept by its id. The wrappers table keeps them alive.
+        self._codes = list()
+        self._code_indexes = dict()
+        self._entries = list()
+        self._wrappers = list()
+        self._indexes = dict()
+
+        # how much the dirty passes since have brined, and how much
+        # the pass which made the tables did
+        self._growth = 0
+        self._baseline = 0
+
+
+    def _code_index(self, ucode):
+        codes = self._codes
+        indexes = self._code_indexes
+        if indexes is None:
+            # the index of loaded code is only needed once something
+            # new is added to the table
+            indexes = dict()
+            for index, code in enumerate(codes):
+                key = _code_key(code)
+                if key is not None:
+                    indexes.setdefault(key, index)
+            self._code_indexes = indexes
+
+        key = _code_key(ucode)
+        index = None if key is None else indexes.get(key)
+        if index is None:
+            # code which can't be compared is never shared
+            index = len(codes)
+            codes.append(tuple(ucode))
+            if key is not None:
+                indexes[key] = index
+        return index
+
+
+    def _tabulate(self, value):
+        assert(self._cache is not None)
+        return walk(self._tabulate_member, value, self._cache)
+
+
+    def _tabulate_member(self, value):
+        cls = type(value)
+
+        kind = _table_kinds.get(cls)
+        if kind is not None:
+            index = self._indexes.get(id(value))
+            if index is None:
+                index = len(self._entries)
+                self._entries.append(None)
+                self._wrappers.append(value)
+                self._indexes[id(value)] = index
+                self._defer(self._tabulate_entry, (value, index))
+
+            ret = _BarrelRef(index)
+            self._putcache(value, ret)
+            return ret
+
+        mapper = _containers.lookup(cls)
+        if mapper is not None:
+            ret = mapper(self._tabulate, value)
+            self._putcache(value, ret)
+            return ret
+
+        return value
+
+
+    def _tabulate_entry(self, wrapper, index):
+        self._entries[index] = wrapper._table_entry(self)
+
+
+    def _wrapper_at(self, ref):
+        index = ref.index
+        wrapper = self._wrappers[index]
+        if wrapper is None:
+            entry = self._entries[index]
+            wrapper = _table_types[entry[0]]._from_table_entry(self, entry)
+            self._wrappers[index] = wrapper
+            self._indexes[id(wrapper)] = index
+        return wrapper
+
+
+    def _clear_memo(self):
+        # the wrappers and brined containers made by past passes, by
+        # the value which they were made from or unbrined as, and the
+        # state of each function when its wrapper was made. The value
+        # is kept alive by the memo, so that its id is not reused
+        # while it remains there.
+        self._memo = IdentityMap()
+        self._states = IdentityMap()
+        self._loaded = None
+        self._dirty = set()
+
+
+    def _memoize(self, original, wrapper, cells=True):
+        self._memo.put(original, wrapper)
+        if type(original) is FunctionType:
+            state = _memo_state(original, cells)
+            self._states.put(original, (state, dict(original.__dict__)))
+
+
+    def _memoize_loaded(self, cache):
+        # the containers unbrined by the pass with cache are memoized
+        # by their unbrined copies, so that dirty passes know which
+        # they must share. This is only needed once a dirty pass is.
+        memo = self._memo
+        for brined in cache:
+            value = cache.get(brined)
+            if _containers.lookup(type(value)) is not None:
+                memo.put(value, brined)
+
+
+    def _memoized(self, value):
+        # the wrapper which an earlier pass made from or unbrined as
+        # value, or None. Raises _StaleMemo if value is a function
+        # which has changed since, as that wrapper no longer fits it.
+
+        wrapper = self._memo.get(value)
+        if wrapper is not None:
+            if type(value) is LazyFunction and value.is_resolved():
+                # a proxy is changed by way of its function
+                value = value.resolve()
+
+            state = self._states.get(value)
+            if state is not None and not _is_current(state, value):
+                raise _StaleMemo()
+        return wrapper
 
 
     def _unbrine_all(self):
-        oldcache = self._cache
-        self._cache = dict()
-        self._unbrined = self._unbrine(self._brined)
-        self._cache = oldcache
+        with self._lock:
+            if self._unbrined is not None:
+                # another thread got here first
+                return
+
+            # any values already unbrined on demand are found in the
+            # lazy cache, so they are kept rather than unbrined again
+            cache = self._lazy_cache
+            if cache is None:
+                cache = IdentityMap()
+            unbrined = self._unbrine_pass(self._brined, cache)
+            self._clear_lazy()
+            self._loaded = cache
+            self._baseline = len(cache)
+
+            if unbrined is self._brined:
+                unbrined = dict(unbrined)
+            self._unbrined = unbrined
+
+
+    def _unbrine_pass(self, value, cache=None):
+        return self._pass(partial(self._unbrine, value), cache=cache)
+
+
+    def _pass(self, work, *args, **kwds):
+        # call work(*args) as a single brining or unbrining pass, with
+        # its own pending work list and a cache shared by everything
+        # in the pass. The cache is new unless one is given. Passes
+        # share the memo and tables, so only one thread may run them
+        # at a time.
+
+        cache = kwds.get("cache")
+
+        with self._lock:
+            oldcache, oldpending = self._cache, self._pending
+            self._cache = IdentityMap() if cache is None else cache
+            self._pending = list()
+            try:
+                result = work(*args)
+                self._drain()
+            finally:
+                self._cache, self._pending = oldcache, oldpending
+        return result
+
+
+    def _clear_lazy(self):
+        # the values unbrined on demand, by key, and the cache of the
+        # passes which unbrined them. The cache is kept between keys
+        # so that references shared between their values stay shared.
+        self._lazy = None
+        self._lazy_cache = None
+        self._lazy_keys = None
+
+
+    def _unbrine_key(self, key):
+        with self._lock:
+            if self._unbrined is not None:
+                # another thread unbrined everything
+                return self._unbrined[key]
+
+            lazy = self._lazy
+            if lazy is None:
+                self._lazy = lazy = dict()
+                self._lazy_cache = IdentityMap()
+            elif key in lazy:
+                return lazy[key]
+
+            brined = self._brined
+            if key in brined:
+                brined_key = key
+            else:
+                # the key may itself have been brined, eg. a function
+                brined_key = self._unbrine_keys()[key]
+
+            value = self._unbrine_pass(brined[brined_key], self._lazy_cache)
+            lazy[key] = value
+            return value
+
+
+    def _unbrine_keys(self):
+        # mapping of unbrined keys to their brined originals
+        with self._lock:
+            keys = self._lazy_keys
+            if keys is None:
+                if self._lazy_cache is None:
+                    self._lazy = dict()
+                    self._lazy_cache = IdentityMap()
+
+                # each key is unbrined individually, so that the lazy
+                # cache doesn't keep a transient list of them alive
+                cache = self._lazy_cache
+                unbrine = self._unbrine_pass
+                keys = dict((unbrine(key, cache), key)
+                            for key in self._brined)
+                self._lazy_keys = keys
+            return keys
+
+
+    def _defer(self, work, args):
+        assert(self._pending is not None)
+        self._pending.append((work, args))
+
+
+    def _drain(self):
+        # run the deferred work, which may itself defer further work,
+        # until there is nothing left to do
+        pending = self._pending
+        while pending:
+            work, args = pending.pop()
+            work(*args)
 
 
     def _putcache(self, original, brined):
-        self._cache[id(original)] = brined
+        # the cache keeps original alive until the end of the pass, so
+        # its id can't be reused by a transient value and mistaken
+        # for it
+        self._cache.put(original, brined)
 
 
     def _getcache(self, original):
-        return self._cache.get(id(original))
+        return self._cache.get(original)
 
 
     def _unbrine(self, value):
         assert(self._cache is not None)
+        return walk(self._unbrine_member, value, self._cache)
 
-        if isinstance(value, BrinedObject):
-            ret = self._getcache(value)
-            if not ret:
-                ret = value.get(self._glbls)
-                self._putcache(value, ret)
-            value = ret
 
-        elif isinstance(value, (tuple, list)):
-            ret = self._getcache(value)
-            if ret is None:
-                vt = type(value)
-                ret = vt(imap(self._unbrine, iter(value)))
-                self._putcache(value, ret)
-            value = ret
+    def _unbrine_member(self, value):
+        # called by walk for members which were not in the cache, and
+        # which are neither leaf values nor plain containers
+
+        cls = type(value)
 
-        elif isinstance(value, dict):
-            ret = self._getcache(value)
+        if cls is _BarrelRef:
+            wrapper = self._wrapper_at(value)
+            ret = self._getcache(wrapper)
             if ret is None:
-                ret = dict(self._unbrine(value.items()))
-                self._putcache(value, ret)
-            value = ret
+                ret = self._unbrine_member(wrapper)
+            self._putcache(value, ret)
+            return ret
+
+        if _unbrine_wrappers.lookup(cls) is not None:
+            if self._proxies and isinstance(value, BarreledFunction):
+                # the proxy holds on to this pass's cache, so that the
+                # function is built sharing references with the rest
+                # of the values from this pass
+                build = partial(self._build_function, value, self._cache)
+                ret = LazyFunction(build)
+            else:
+                ret = self._get_wrapped(value)
+            self._putcache(value, ret)
+
+            # the cells of a function are filled later in the pass
+            self._memoize(ret, value, False)
+            return ret
+
+        mapper = _containers.lookup(cls)
+        if mapper is not None:
+            ret = mapper(self._unbrine, value)
+            self._putcache(value, ret)
+            return ret
 
         return value
 
 
+    def _build_function(self, wrapper, cache):
+        # called by a LazyFunction to create its function, in a pass
+        # using the cache of the pass which created the proxy. Threads
+        # may resolve the same proxy at once, so the function is also
+        # cached by its proxy, and is only created once.
+        with self._lock:
+            proxy = cache.get(wrapper)
+            func = cache.get(proxy)
+            if func is None:
+                func = self._pass(self._get_wrapped, wrapper, cache=cache)
+                self._memoize(func, wrapper, False)
+                cache.put(proxy, func)
+
+                # further passes should still find the proxy, so that
+                # values unbrined later refer to the same object
+                cache.put(wrapper, proxy)
+            return func
+
+
+    def _get_wrapped(self, wrapper):
+        functions = self._functions
+        if functions is not None and type(wrapper) is BarreledFunction:
+            return _cached_function(functions, wrapper, self._glbls)
+        return wrapper.get(self._glbls)
+
+
     def _brine(self, value):
         assert(self._cache is not None)
+        return walk(self._brine_member, value, self._cache)
 
-        if isinstance(value, (BuiltinFunctionType, BuiltinMethodType)):
-            # don't touch builtins
-            pass
-
-        elif isinstance(value, partial):
-            ret = self._getcache(value)
-            if not ret:
-                ret = BarreledPartial(self, value)
-                self._putcache(value, ret)
-            value = ret
-
-        elif isinstance(value, MethodType):
-            ret = self._getcache(value)
-            if not ret:
-                ret = BarreledMethod(self, value)
-                self._putcache(value, ret)
-            value = ret
-
-        elif isinstance(value, FunctionType):
-            ret = self._getcache(value)
-            if not ret:
-                ret = BarreledFunction(self, value)
-                self._putcache(value, ret)
-            value = ret
-
-        elif isinstance(value, (tuple, list)):
-            ret = self._getcache(value)
-            if ret is None:
-                vt = type(value)
-                ret = vt(imap(self._brine, iter(value)))
-                self._putcache(value, ret)
-            value = ret
 
-        elif isinstance(value, dict):
-            ret = self._getcache(value)
+    def _brine_member(self, value):
+        cls = type(value)
+
+        wrapper = _barrel_wrappers.lookup(cls)
+        if wrapper is not None:
+            ret = self._memoized(value)
             if ret is None:
-                ret = dict(self._brine(value.items()))
-                self._putcache(value, ret)
-            value = ret
+                ret = wrapper(self, value)
+                self._memoize(value, ret)
+            self._putcache(value, ret)
+            return ret
+
+        mapper = _containers.lookup(cls)
+        if mapper is not None:
+            ret = mapper(self._brine, value)
+            self._putcache(value, ret)
+            return ret
 
         return value
 
 
+class BarrelGroup(object):
+    """
+    Mapping of names to Barrels, which are pickled together so that
+    they share one uniqueness domain. A function, method, or partial
+    referred to by more than one of the Barrels is only written once,
+    as is code shared by their functions, and after loading each of
+    the Barrels refers to the same object.
+
+    The values of all the Barrels are held in one shared Barrel, keyed
+    by ``(name, key)``. When the group is pickled, only those which
+    were set or deleted since it was last pickled are brined again.
+    A loaded group only unbrines the values of a Barrel once it is
+    gotten from the group.
+    """
+
+    def __init__(self, *pairs, **barrels):
+        """
+        Accepts a single optional positional argument, which must be a
+        `dict` or an iterable of name,Barrel pairs. Also accepts an
+        arbitrary number of named Barrels.
+        """
+
+        self._shared = Barrel()
+        self._barrels = dict()
+        self._lock = RLock()
+
+        for name, barrel in dict(*pairs, **barrels).iteritems():
+            self[name] = barrel
+
+
+    def __setitem__(self, name, barrel):
+        if not isinstance(barrel, Barrel):
+            raise TypeError("expected Barrel, not %s" %
+                            type(barrel).__name__)
+
+        with self._lock:
+            self._barrels[name] = barrel
+
+
+    def __getitem__(self, name):
+        with self._lock:
+            barrel = self._barrels[name]
+            if barrel is None:
+                barrel = self._unpack(name)
+                self._barrels[name] = barrel
+            return barrel
+
+
+    def __delitem__(self, name):
+        with self._lock:
+            del self._barrels[name]
+
+
+    def __iter__(self):
+        return iter(self._barrels)
+
+
+    def keys(self):
+        return self._barrels.keys()
+
+
+    def use_globals(self, glbls=None):
+        """
+        Provide a different set of globals when rebuilding functions
+        for the Barrels of a loaded group, as per `Barrel.use_globals`
+        """
+
+        self._shared.use_globals(glbls)
+
+
+    def use_proxies(self, proxies=True):
+        """
+        Unbrine functions as `LazyFunction` proxies, as per
+        `Barrel.use_proxies`
+        """
+
+        self._shared.use_proxies(proxies)
+
+
+    def use_function_cache(self, functions=None):
+        """
+        Look up unbrined functions by content in `functions`, as per
+        `Barrel.use_function_cache`
+        """
+
+        self._shared.use_function_cache(functions)
+
+
+    def __getstate__(self):
+        with self._lock:
+            self._pack()
+            return (tuple(self._barrels), self._shared)
+
+
+    def __setstate__(self, state):
+        names, shared = state
+
+        # the Barrels are only recreated from the shared Barrel when
+        # they are gotten
+        self._shared = shared
+        self._barrels = dict.fromkeys(names)
+        self._lock = RLock()
+
+
+    def _pack(self):
+        # update the shared Barrel with the values of every Barrel
+        # in the group. Values which are still the same object are
+        # left alone, so that their keys aren't marked as dirty.
+        shared = self._shared
+
+        found = set()
+        for name, barrel in self._barrels.iteritems():
+            if barrel is None:
+                # unchanged since the group was loaded
+                continue
+
+            for key, value in barrel.iteritems():
+                shared_key = (name, key)
+                found.add(shared_key)
+                if shared.get(shared_key, _REMOVED) is not value:
+                    shared[shared_key] = value
+
+        barrels = self._barrels
+        for shared_key in shared.keys():
+            if shared_key in found:
+                continue
+            name = shared_key[0]
+            if name not in barrels or barrels[name] is not None:
+                del shared[shared_key]
+
+
+    def _unpack(self, name):
+        # a new Barrel of the values for name in the shared Barrel.
+        # Those are gotten from its lazy cache, so references between
+        # them and the other Barrels are kept.
+        shared = self._shared
+        return Barrel((key, shared[(shared_name, key)])
+                      for shared_name, key in shared if shared_name == name)
+
+
+def _sealed_barrel(data):
+    return Barrel.from_bytes(data)
+
+
+def _barrel_lazy(barrel, proxy):
+    return BarreledFunction(barrel, proxy.resolve())
+
+
+def _memo_state(function, cells=True):
+    # the parts of function which its wrapper copies. The contents of
+    # its cells are left out unless cells is True, as the cells of an
+    # unbrined function are only filled later in its pass, and only
+    # the barrel can set them.
+    closure = function.func_closure
+    if closure is not None:
+        closure = cells_get_values(closure) if cells else None
+
+    return (function.func_code, function.func_name,
+            function.func_defaults, closure)
+
+
+def _same_state(known, state):
+    # compared by identity, as equality may be expensive or undefined
+    # for the contents of cells and defaults
+    for was, now in izip(known, state):
+        if was is now:
+            continue
+        elif type(was) is tuple and type(now) is tuple:
+            if len(was) == len(now) and all(a is b for a, b in izip(was, now)):
+                continue
+        return False
+    return True
+
+
+def _is_current(known, function):
+    # true if function is as it was when known was taken from it
+    state, fdict = known
+    if not _same_state(state, _memo_state(function, state[3] is not None)):
+        return False
+    return _same_fdict(fdict, function.__dict__)
+
+
+# the kinds of wrapper in the table of a barrel's pickled state, and
+# the version of that state
+_FUNCTION, _METHOD, _PARTIAL = range(3)
+_table_types = (BarreledFunction, BarreledMethod, BarreledPartial)
+_table_kinds = dict((cls, kind) for kind, cls in enumerate(_table_types))
+_BARREL_FORMAT = 1
+
+
+# the least a barrel's dirty passes may brine before it is brined again
+# as a whole, so that small barrels aren't rebuilt on every change
+_MIN_GROWTH = 64
+
+
+# marks a key which was deleted, while brining dirty keys, or one
+# which is missing from the shared Barrel of a BarrelGroup
+_REMOVED = object()
+
+
+_barrel_wrappers = TypeDispatch({
+    partial: BarreledPartial,
+    MethodType: BarreledMethod,
+    FunctionType: BarreledFunction,
+    LazyFunction: _barrel_lazy,
+})
+
+
 #
 # The end.
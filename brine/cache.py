@@ -0,0 +1,184 @@
+# This library is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""
+A small bounded mapping with least-recently-used eviction, used to
+share reconstructed objects across many unbrinings, and a mapping by
+object identity which keeps its keys alive, used as the cache of a
+single brining or unbrining pass.
+
+:author: Christopher O'Brien  <obriencj@gmail.com>
+:license: LGPL v.3
+"""
+
+
+from ._cellwork import IdentityMap
+from collections import namedtuple
+from threading import Lock
+
+
+__all__ = ("CacheInfo", "IdentityMap", "LRUCache", )
+
+
+CacheInfo = namedtuple("CacheInfo", "hits misses maxsize currsize")
+
+
+# indexes into the entries of the linked list
+_PREV, _NEXT, _KEY, _VALUE = 0, 1, 2, 3
+
+
+class LRUCache(object):
+    """
+    Mapping of at most `maxsize` entries. When full, adding a new
+    entry discards the entry which was least recently used. A
+    `maxsize` of `None` is unbounded, and a `maxsize` of 0 stores
+    nothing at all.
+
+    Lookups via `get` are counted as hits or misses, and are reported
+    along with the current size by `info`.
+    """
+
+    def __init__(self, maxsize=128):
+        self._lock = Lock()
+        self._maxsize = maxsize
+        self._entries = dict()
+
+        # the root of a circular doubly-linked list, with the most
+        # recently used entry in its _NEXT and the least recently
+        # used in its _PREV
+        self._root = root = []
+        root[:] = [root, root, None, None]
+
+        self._hits = 0
+        self._misses = 0
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def __contains__(self, key):
+        return key in self._entries
+
+
+    @property
+    def maxsize(self):
+        return self._maxsize
+
+
+    def get(self, key, default=None):
+        """
+        The value associated with `key` if present, else `default`.
+        Marks the entry as the most recently used.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return default
+
+            self._hits += 1
+            self._unlink(entry)
+            self._link(entry)
+            return entry[_VALUE]
+
+
+    def put(self, key, value):
+        """
+        Associate `value` with `key`, evicting the least recently used
+        entry if the cache is full.
+        """
+
+        maxsize = self._maxsize
+        if maxsize == 0:
+            return
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry[_VALUE] = value
+                self._unlink(entry)
+                self._link(entry)
+                return
+
+            if maxsize is not None and len(self._entries) >= maxsize:
+                oldest = self._root[_PREV]
+                self._unlink(oldest)
+                del self._entries[oldest[_KEY]]
+
+            entry = [None, None, key, value]
+            self._link(entry)
+            self._entries[key] = entry
+
+
+    def resize(self, maxsize):
+        """
+        Change the maximum number of entries, evicting the least
+        recently used entries if there are now too many.
+        """
+
+        with self._lock:
+            self._maxsize = maxsize
+            if maxsize is None:
+                return
+
+            while len(self._entries) > maxsize:
+                oldest = self._root[_PREV]
+                self._unlink(oldest)
+                del self._entries[oldest[_KEY]]
+
+
+    def clear(self):
+        """
+        Remove all entries and reset the hit and miss counts.
+        """
+
+        with self._lock:
+            self._entries.clear()
+            root = self._root
+            root[:] = [root, root, None, None]
+            self._hits = 0
+            self._misses = 0
+
+
+    def info(self):
+        """
+        A `CacheInfo` of the hits, misses, maxsize, and current size
+        of this cache.
+        """
+
+        with self._lock:
+            return CacheInfo(self._hits, self._misses,
+                             self._maxsize, len(self._entries))
+
+
+    def _link(self, entry):
+        root = self._root
+        first = root[_NEXT]
+        entry[_PREV] = root
+        entry[_NEXT] = first
+        first[_PREV] = entry
+        root[_NEXT] = entry
+
+
+    def _unlink(self, entry):
+        prev, following = entry[_PREV], entry[_NEXT]
+        prev[_NEXT] = following
+        following[_PREV] = prev
+
+
+#
+# The end.
@@ -19,6 +19,10 @@
   This is just to permit me to change the values of cells conveniently,
   which is absolutely necessary in order to pickle recursive function
   definitions.
+
+  It also provides the walk function, which is the native version of
+  the container traversal used by brine, unbrine, and Barrel, and the
+  IdentityMap type which it may use as its cache.
 */
 
 
@@ -62,6 +66,839 @@ static PyObject *cell_from_value(PyObject *self, PyObject *args) {
 }
 
 
+/* == bulk cells, code, and functions ==
+
+   These are the same operations as the single-cell functions above,
+   but without the per-item interpreter overhead, along with the
+   code_unnew, function_unnew, and function_new functions which the
+   brine module exports.
+*/
+
+
+static PyObject *cells_get_values(PyObject *self, PyObject *args) {
+  PyObject *cells = NULL;
+  PyObject *result;
+  Py_ssize_t index, count;
+
+  if (! PyArg_ParseTuple(args, "O!", &PyTuple_Type, &cells))
+    return NULL;
+
+  count = PyTuple_GET_SIZE(cells);
+  result = PyTuple_New(count);
+  if (! result)
+    return NULL;
+
+  for (index = 0; index < count; index++) {
+    PyObject *cell = PyTuple_GET_ITEM(cells, index);
+    PyObject *val;
+
+    if (! PyCell_Check(cell)) {
+      PyErr_SetString(PyExc_TypeError, "expected a tuple of cells");
+      Py_DECREF(result);
+      return NULL;
+    }
+
+    val = PyCell_GET(cell);
+    if (! val) {
+      PyErr_SetString(PyExc_ValueError, "cell is empty");
+      Py_DECREF(result);
+      return NULL;
+    }
+
+    Py_INCREF(val);
+    PyTuple_SET_ITEM(result, index, val);
+  }
+
+  return result;
+}
+
+
+static PyObject *cells_set_values(PyObject *self, PyObject *args) {
+  PyObject *cells = NULL;
+  PyObject *vals = NULL;
+  PyObject *seq;
+  Py_ssize_t index, count;
+
+  if (! PyArg_ParseTuple(args, "O!O", &PyTuple_Type, &cells, &vals))
+    return NULL;
+
+  seq = PySequence_Fast(vals, "values must be a sequence");
+  if (! seq)
+    return NULL;
+
+  count = PyTuple_GET_SIZE(cells);
+  if (PySequence_Fast_GET_SIZE(seq) != count) {
+    PyErr_SetString(PyExc_ValueError,
+                    "number of values must match number of cells");
+    Py_DECREF(seq);
+    return NULL;
+  }
+
+  for (index = 0; index < count; index++) {
+    if (! PyCell_Check(PyTuple_GET_ITEM(cells, index))) {
+      PyErr_SetString(PyExc_TypeError, "expected a tuple of cells");
+      Py_DECREF(seq);
+      return NULL;
+    }
+  }
+
+  for (index = 0; index < count; index++) {
+    PyCell_Set(PyTuple_GET_ITEM(cells, index),
+               PySequence_Fast_GET_ITEM(seq, index));
+  }
+
+  Py_DECREF(seq);
+  Py_RETURN_NONE;
+}
+
+
+static PyObject *cells_from_values(PyObject *self, PyObject *args) {
+  PyObject *vals = NULL;
+  PyObject *seq, *result;
+  Py_ssize_t index, count;
+
+  if (! PyArg_ParseTuple(args, "O", &vals))
+    return NULL;
+
+  seq = PySequence_Fast(vals, "values must be a sequence");
+  if (! seq)
+    return NULL;
+
+  count = PySequence_Fast_GET_SIZE(seq);
+  result = PyTuple_New(count);
+
+  for (index = 0; result && index < count; index++) {
+    PyObject *cell = PyCell_New(PySequence_Fast_GET_ITEM(seq, index));
+    if (! cell) {
+      Py_CLEAR(result);
+      break;
+    }
+    PyTuple_SET_ITEM(result, index, cell);
+  }
+
+  Py_DECREF(seq);
+  return result;
+}
+
+
+static PyObject *code_unnew(PyObject *self, PyObject *args) {
+  PyCodeObject *code = NULL;
+
+  if (! PyArg_ParseTuple(args, "O!", &PyCode_Type, &code))
+    return NULL;
+
+  return Py_BuildValue("[iiiiOOOOOOiOOO]",
+                       code->co_argcount,
+                       code->co_nlocals,
+                       code->co_stacksize,
+                       code->co_flags,
+                       code->co_code,
+                       code->co_consts,
+                       code->co_names,
+                       code->co_varnames,
+                       code->co_filename,
+                       code->co_name,
+                       code->co_firstlineno,
+                       code->co_lnotab,
+                       code->co_freevars,
+                       code->co_cellvars);
+}
+
+
+static PyObject *function_unnew(PyObject *self, PyObject *args) {
+  PyFunctionObject *func = NULL;
+
+  if (! PyArg_ParseTuple(args, "O!", &PyFunction_Type, &func))
+    return NULL;
+
+  return Py_BuildValue("[OOOOO]",
+                       func->func_code,
+                       func->func_globals,
+                       func->func_name,
+                       func->func_defaults? func->func_defaults: Py_None,
+                       func->func_closure? func->func_closure: Py_None);
+}
+
+
+static PyObject *function_new(PyObject *self, PyObject *args) {
+  PyCodeObject *code = NULL;
+  PyObject *glbls = NULL;
+  PyObject *name = Py_None;
+  PyObject *defaults = Py_None;
+  PyObject *closure = Py_None;
+  PyObject *func;
+  Py_ssize_t nfree, nclosure, index;
+
+  if (! PyArg_ParseTuple(args, "O!O!|OOO",
+                         &PyCode_Type, &code, &PyDict_Type, &glbls,
+                         &name, &defaults, &closure))
+    return NULL;
+
+  if (name != Py_None && ! PyString_Check(name)) {
+    PyErr_SetString(PyExc_TypeError, "arg 3 (name) must be None or string");
+    return NULL;
+  }
+
+  if (defaults != Py_None && ! PyTuple_Check(defaults)) {
+    PyErr_SetString(PyExc_TypeError, "arg 4 (defaults) must be None or tuple");
+    return NULL;
+  }
+
+  nfree = PyTuple_GET_SIZE(code->co_freevars);
+  if (! PyTuple_Check(closure)) {
+    if (nfree && closure == Py_None) {
+      PyErr_SetString(PyExc_TypeError, "arg 5 (closure) must be tuple");
+      return NULL;
+    } else if (closure != Py_None) {
+      PyErr_SetString(PyExc_TypeError,
+                      "arg 5 (closure) must be None or tuple");
+      return NULL;
+    }
+  }
+
+  nclosure = (closure == Py_None)? 0: PyTuple_GET_SIZE(closure);
+  if (nfree != nclosure) {
+    return PyErr_Format(PyExc_ValueError,
+                        "%s requires closure of length %zd, not %zd",
+                        PyString_AS_STRING(code->co_name), nfree, nclosure);
+  }
+
+  for (index = 0; index < nclosure; index++) {
+    if (! PyCell_Check(PyTuple_GET_ITEM(closure, index))) {
+      return PyErr_Format(PyExc_TypeError,
+                          "arg 5 (closure) expected cell, found %s",
+                          Py_TYPE(PyTuple_GET_ITEM(closure, index))->tp_name);
+    }
+  }
+
+  func = PyFunction_New((PyObject *) code, glbls);
+  if (! func)
+    return NULL;
+
+  if (name != Py_None) {
+    PyFunctionObject *fobj = (PyFunctionObject *) func;
+    Py_INCREF(name);
+    Py_DECREF(fobj->func_name);
+    fobj->func_name = name;
+  }
+
+  if (defaults != Py_None && PyFunction_SetDefaults(func, defaults))
+    goto error;
+
+  if (nclosure && PyFunction_SetClosure(func, closure))
+    goto error;
+
+  return func;
+
+ error:
+  Py_DECREF(func);
+  return NULL;
+}
+
+
+/* == IdentityMap ==
+
+   Associates values with objects by their identity. Each object given
+   a value is also kept alive by the map, so that its id cannot be
+   reused by some other object while the map is in use. The walk
+   function accepts an IdentityMap as its cache.
+*/
+
+
+typedef struct {
+  PyObject_HEAD
+  PyObject *table;    /* dict of id(original) to value */
+  PyObject *pins;     /* list of originals, in the order they were put */
+} IdentityMap;
+
+
+static PyTypeObject IdentityMapType;
+
+
+#define IdentityMap_Check(obj) (Py_TYPE(obj) == &IdentityMapType)
+
+
+/* Associates val with the object obj, whose id is ident, in table. If
+   pins is not NULL and obj wasn't already in the table, obj is
+   appended to pins. Returns 0 on success, -1 on error */
+static int pinned_put(PyObject *table, PyObject *pins,
+                      PyObject *ident, PyObject *obj, PyObject *val) {
+
+  if (pins && ! PyDict_GetItem(table, ident)) {
+    if (PyList_Append(pins, obj))
+      return -1;
+  }
+  return PyDict_SetItem(table, ident, val);
+}
+
+
+static PyObject *idmap_new(PyTypeObject *type,
+                           PyObject *args, PyObject *kwds) {
+  IdentityMap *self;
+
+  if (! PyArg_ParseTuple(args, ":IdentityMap"))
+    return NULL;
+
+  self = (IdentityMap *) type->tp_alloc(type, 0);
+  if (! self)
+    return NULL;
+
+  self->table = PyDict_New();
+  self->pins = PyList_New(0);
+  if (! (self->table && self->pins)) {
+    Py_DECREF(self);
+    return NULL;
+  }
+
+  return (PyObject *) self;
+}
+
+
+static int idmap_traverse(IdentityMap *self, visitproc visit, void *arg) {
+  Py_VISIT(self->table);
+  Py_VISIT(self->pins);
+  return 0;
+}
+
+
+static int idmap_clear(IdentityMap *self) {
+  Py_CLEAR(self->table);
+  Py_CLEAR(self->pins);
+  return 0;
+}
+
+
+static void idmap_dealloc(IdentityMap *self) {
+  PyObject_GC_UnTrack(self);
+  idmap_clear(self);
+  Py_TYPE(self)->tp_free((PyObject *) self);
+}
+
+
+static PyObject *idmap_get(IdentityMap *self, PyObject *args) {
+  PyObject *obj = NULL;
+  PyObject *dflt = Py_None;
+  PyObject *ident;
+  PyObject *found;
+
+  if (! PyArg_ParseTuple(args, "O|O:get", &obj, &dflt))
+    return NULL;
+
+  ident = PyLong_FromVoidPtr(obj);
+  if (! ident)
+    return NULL;
+
+  found = PyDict_GetItem(self->table, ident);
+  Py_DECREF(ident);
+
+  found = found? found: dflt;
+  Py_INCREF(found);
+  return found;
+}
+
+
+static PyObject *idmap_put(IdentityMap *self, PyObject *args) {
+  PyObject *obj = NULL;
+  PyObject *val = NULL;
+  PyObject *ident;
+  int rc;
+
+  if (! PyArg_ParseTuple(args, "OO:put", &obj, &val))
+    return NULL;
+
+  ident = PyLong_FromVoidPtr(obj);
+  if (! ident)
+    return NULL;
+
+  rc = pinned_put(self->table, self->pins, ident, obj, val);
+  Py_DECREF(ident);
+
+  if (rc)
+    return NULL;
+
+  Py_RETURN_NONE;
+}
+
+
+static PyObject *idmap_clear_all(IdentityMap *self, PyObject *unused) {
+  PyObject *pins = PyList_New(0);
+  PyObject *old;
+
+  if (! pins)
+    return NULL;
+
+  PyDict_Clear(self->table);
+
+  /* the originals are released last, once the map is consistent,
+     as their destructors may do just about anything */
+  old = self->pins;
+  self->pins = pins;
+  Py_DECREF(old);
+
+  Py_RETURN_NONE;
+}
+
+
+static Py_ssize_t idmap_length(IdentityMap *self) {
+  return PyDict_Size(self->table);
+}
+
+
+static PyObject *idmap_iter(IdentityMap *self) {
+  /* the originals, in the order they were first put */
+  return PyObject_GetIter(self->pins);
+}
+
+
+static int idmap_contains(IdentityMap *self, PyObject *obj) {
+  PyObject *ident = PyLong_FromVoidPtr(obj);
+  int rc;
+
+  if (! ident)
+    return -1;
+
+  rc = PyDict_Contains(self->table, ident);
+  Py_DECREF(ident);
+  return rc;
+}
+
+
+static PySequenceMethods idmap_as_sequence = {
+  .sq_length = (lenfunc) idmap_length,
+  .sq_contains = (objobjproc) idmap_contains,
+};
+
+
+static PyMethodDef idmap_methods[] = {
+  { "get", (PyCFunction) idmap_get, METH_VARARGS,
+    "get(obj, default=None)\n"
+    "the value put for obj, or default if there is none" },
+
+  { "put", (PyCFunction) idmap_put, METH_VARARGS,
+    "put(obj, value)\n"
+    "associate value with obj, keeping obj alive" },
+
+  { "clear", (PyCFunction) idmap_clear_all, METH_NOARGS,
+    "clear()\n"
+    "remove every value, and release every object" },
+
+  { NULL, NULL, 0, NULL },
+};
+
+
+static PyTypeObject IdentityMapType = {
+  PyVarObject_HEAD_INIT(NULL, 0)
+  .tp_name = "brine._cellwork.IdentityMap",
+  .tp_basicsize = sizeof(IdentityMap),
+  .tp_dealloc = (destructor) idmap_dealloc,
+  .tp_as_sequence = &idmap_as_sequence,
+  .tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_GC,
+  .tp_doc = ("IdentityMap()\n"
+             "mapping of objects by identity to values, which keeps\n"
+             "each of those objects alive while it is in the map"),
+  .tp_traverse = (traverseproc) idmap_traverse,
+  .tp_clear = (inquiry) idmap_clear,
+  .tp_iter = (getiterfunc) idmap_iter,
+  .tp_methods = idmap_methods,
+  .tp_new = idmap_new,
+};
+
+
+/* == walk ==
+
+   An iterative walk over nested lists, tuples, and dicts. This is the
+   hot loop of brining and unbrining, so rather than recursing through
+   python for every member we keep an explicit stack of frames, and
+   only call back into python for members which are neither
+   containers nor simple leaf values.
+
+   Containers are only duplicated when one of their members was
+   changed by the callback, otherwise the original is the result.
+*/
+
+
+typedef struct {
+  PyObject *orig;     /* the container being walked */
+  PyObject *result;   /* list or dict copy, NULL until the first change */
+  Py_ssize_t pos;     /* the next index, or the PyDict_Next position */
+  PyObject *key;      /* dict only, the current key */
+  PyObject *val;      /* the current member, or the current dict value */
+  PyObject *mkey;     /* dict only, the mapped current key */
+} walk_frame;
+
+
+typedef struct {
+  PyObject *func;     /* callback for non-container members */
+  PyObject *cache;    /* dict of id(original) to result, or NULL */
+  PyObject *idmap;    /* the IdentityMap owning cache, or NULL */
+  PyObject *active;   /* dict of id(container) for frames on the stack */
+  walk_frame *frames;
+  Py_ssize_t depth;
+  Py_ssize_t allocated;
+} walker;
+
+
+static int is_leaf(PyObject *obj) {
+  return (obj == Py_None ||
+          PyBool_Check(obj) ||
+          PyInt_CheckExact(obj) ||
+          PyLong_CheckExact(obj) ||
+          PyFloat_CheckExact(obj) ||
+          PyComplex_CheckExact(obj) ||
+          PyString_CheckExact(obj) ||
+          PyUnicode_CheckExact(obj) ||
+          PyType_CheckExact(obj) ||
+          PyCFunction_Check(obj));
+}
+
+
+static void frame_clear(walk_frame *frame) {
+  Py_CLEAR(frame->orig);
+  Py_CLEAR(frame->result);
+  Py_CLEAR(frame->key);
+  Py_CLEAR(frame->val);
+  Py_CLEAR(frame->mkey);
+}
+
+
+static int walker_push(walker *w, PyObject *container) {
+  walk_frame *frame;
+  PyObject *ident;
+  int found;
+
+  ident = PyLong_FromVoidPtr(container);
+  if (! ident)
+    return -1;
+
+  found = PyDict_Contains(w->active, ident);
+  if (found) {
+    if (found > 0)
+      PyErr_SetString(PyExc_ValueError,
+                      "cannot walk a container which contains itself");
+    Py_DECREF(ident);
+    return -1;
+  }
+
+  if (PyDict_SetItem(w->active, ident, Py_None)) {
+    Py_DECREF(ident);
+    return -1;
+  }
+  Py_DECREF(ident);
+
+  if (w->depth == w->allocated) {
+    Py_ssize_t size = w->allocated ? (w->allocated * 2) : 16;
+    walk_frame *frames = PyMem_Realloc(w->frames, size * sizeof(walk_frame));
+    if (! frames) {
+      PyErr_NoMemory();
+      return -1;
+    }
+    w->frames = frames;
+    w->allocated = size;
+  }
+
+  frame = w->frames + w->depth++;
+  memset(frame, 0, sizeof(walk_frame));
+
+  Py_INCREF(container);
+  frame->orig = container;
+
+  return 0;
+}
+
+
+/* Resolves a member. Returns 0 and sets *out to a new reference if
+   the member could be resolved immediately, 1 if a new frame was
+   pushed to walk the member, or -1 on error */
+static int walker_resolve(walker *w, PyObject *member, PyObject **out) {
+  if (is_leaf(member)) {
+    Py_INCREF(member);
+    *out = member;
+    return 0;
+  }
+
+  if (w->cache) {
+    PyObject *ident = PyLong_FromVoidPtr(member);
+    PyObject *found;
+
+    if (! ident)
+      return -1;
+
+    found = PyDict_GetItem(w->cache, ident);
+    Py_DECREF(ident);
+
+    if (found) {
+      Py_INCREF(found);
+      *out = found;
+      return 0;
+    }
+  }
+
+  if (PyList_CheckExact(member) ||
+      PyTuple_CheckExact(member) ||
+      PyDict_CheckExact(member)) {
+
+    return walker_push(w, member)? -1: 1;
+  }
+
+  *out = PyObject_CallFunctionObjArgs(w->func, member, NULL);
+  return (*out)? 0: -1;
+}
+
+
+/* Fetches a new reference to the next member of the frame into
+   *member. Returns 1 if there was a member, 0 if the frame is
+   complete, or -1 on error */
+static int frame_next(walk_frame *frame, PyObject **member) {
+  PyObject *orig = frame->orig;
+
+  if (PyDict_CheckExact(orig)) {
+    PyObject *key, *val;
+
+    if (frame->key) {
+      /* the key has been mapped, now for its value */
+      Py_INCREF(frame->val);
+      *member = frame->val;
+      return 1;
+    }
+
+    if (! PyDict_Next(orig, &frame->pos, &key, &val))
+      return 0;
+
+    Py_INCREF(key);
+    Py_INCREF(val);
+    frame->key = key;
+    frame->val = val;
+
+    Py_INCREF(key);
+    *member = key;
+    return 1;
+
+  } else {
+    PyObject *item;
+
+    if (frame->pos >= PySequence_Fast_GET_SIZE(orig))
+      return 0;
+
+    item = PySequence_Fast_GET_ITEM(orig, frame->pos);
+    Py_INCREF(item);
+    Py_XDECREF(frame->val);
+    frame->val = item;
+
+    Py_INCREF(item);
+    *member = item;
+    return 1;
+  }
+}
+
+
+/* Accepts the mapped result of the current member of the frame.
+   Steals the reference to mapped. Returns 0 on success, -1 on
+   error */
+static int frame_accept(walk_frame *frame, PyObject *mapped) {
+  PyObject *orig = frame->orig;
+  int rc = 0;
+
+  if (PyDict_CheckExact(orig)) {
+    PyObject *key = frame->key;
+    PyObject *val = frame->val;
+    PyObject *mkey = frame->mkey;
+
+    if (! mkey) {
+      /* this was the key, hang onto it until the value is done */
+      frame->mkey = mapped;
+      return 0;
+    }
+
+    if (mkey != key || mapped != val) {
+      if (! frame->result) {
+        frame->result = PyDict_Copy(orig);
+        if (! frame->result)
+          rc = -1;
+      }
+      if (! rc && mkey != key)
+        rc = PyDict_DelItem(frame->result, key);
+      if (! rc)
+        rc = PyDict_SetItem(frame->result, mkey, mapped);
+    }
+
+    Py_DECREF(mapped);
+    Py_CLEAR(frame->key);
+    Py_CLEAR(frame->val);
+    Py_CLEAR(frame->mkey);
+
+  } else {
+    Py_ssize_t index = frame->pos++;
+
+    if (frame->result) {
+      rc = PyList_Append(frame->result, mapped);
+
+    } else if (mapped != frame->val) {
+      if (PyList_CheckExact(orig)) {
+        frame->result = PyList_GetSlice(orig, 0, index);
+      } else {
+        PyObject *head = PyTuple_GetSlice(orig, 0, index);
+        frame->result = head? PySequence_List(head): NULL;
+        Py_XDECREF(head);
+      }
+      rc = frame->result? PyList_Append(frame->result, mapped): -1;
+    }
+
+    Py_DECREF(mapped);
+  }
+
+  return rc;
+}
+
+
+/* Pops the top frame, and produces a new reference to its final
+   result, or NULL on error */
+static PyObject *walker_pop(walker *w) {
+  walk_frame *frame = w->frames + (--w->depth);
+  PyObject *orig = frame->orig;
+  PyObject *result = frame->result;
+  PyObject *ident;
+
+  if (! result) {
+    Py_INCREF(orig);
+    result = orig;
+
+  } else if (PyTuple_CheckExact(orig)) {
+    result = PyList_AsTuple(frame->result);
+    if (! result)
+      goto error;
+
+  } else {
+    frame->result = NULL;
+  }
+
+  ident = PyLong_FromVoidPtr(orig);
+  if (! ident || PyDict_DelItem(w->active, ident)) {
+    Py_XDECREF(ident);
+    goto error_result;
+  }
+
+  /* the pins are looked up for each put, as the callback may have
+     cleared the IdentityMap and so replaced them */
+  if (w->cache &&
+      pinned_put(w->cache,
+                 w->idmap? ((IdentityMap *) w->idmap)->pins: NULL,
+                 ident, orig, result)) {
+    Py_DECREF(ident);
+    goto error_result;
+  }
+
+  Py_DECREF(ident);
+  frame_clear(frame);
+  return result;
+
+ error_result:
+  Py_DECREF(result);
+ error:
+  frame_clear(frame);
+  return NULL;
+}
+
+
+static PyObject *walk(PyObject *self, PyObject *args) {
+  PyObject *func = NULL;
+  PyObject *value = NULL;
+  PyObject *cache = Py_None;
+  PyObject *mapped = NULL;
+  PyObject *member;
+  walker w;
+  int rc;
+
+  if (! PyArg_ParseTuple(args, "OO|O", &func, &value, &cache))
+    return NULL;
+
+  memset(&w, 0, sizeof(walker));
+  w.func = func;
+
+  /* the cache is held for the whole walk, as the callback may drop
+     every other reference to it */
+  if (IdentityMap_Check(cache)) {
+    w.idmap = cache;
+    w.cache = ((IdentityMap *) cache)->table;
+    Py_INCREF(w.idmap);
+    Py_INCREF(w.cache);
+
+  } else if (PyDict_Check(cache)) {
+    w.cache = cache;
+    Py_INCREF(w.cache);
+
+  } else if (cache != Py_None) {
+    PyErr_SetString(PyExc_TypeError,
+                    "cache must be an IdentityMap, a dict, or None");
+    return NULL;
+  }
+
+  w.active = PyDict_New();
+  if (! w.active) {
+    Py_XDECREF(w.cache);
+    Py_XDECREF(w.idmap);
+    return NULL;
+  }
+
+  rc = walker_resolve(&w, value, &mapped);
+
+  while (rc > 0) {
+    walk_frame *frame = w.frames + (w.depth - 1);
+
+    rc = frame_next(frame, &member);
+    if (rc < 0)
+      break;
+
+    if (rc == 0) {
+      /* this frame is complete, hand its result to its parent */
+      mapped = walker_pop(&w);
+      if (! mapped) {
+        rc = -1;
+        break;
+      }
+
+      if (! w.depth) {
+        rc = 0;
+        break;
+      }
+
+      rc = frame_accept(w.frames + (w.depth - 1), mapped);
+      mapped = NULL;
+      if (rc < 0)
+        break;
+
+      rc = 1;
+      continue;
+    }
+
+    rc = walker_resolve(&w, member, &mapped);
+    Py_DECREF(member);
+
+    if (rc == 0) {
+      rc = frame_accept(frame, mapped);
+      mapped = NULL;
+      if (rc < 0)
+        break;
+    }
+
+    rc = (rc < 0)? -1: 1;
+  }
+
+  if (rc < 0) {
+    Py_CLEAR(mapped);
+  }
+
+  while (w.depth)
+    frame_clear(w.frames + (--w.depth));
+
+  PyMem_Free(w.frames);
+  Py_DECREF(w.active);
+  Py_XDECREF(w.cache);
+  Py_XDECREF(w.idmap);
+
+  return mapped;
+}
+
+
 static PyMethodDef methods[] = {
   { "cell_get_value", cell_get_value, METH_VARARGS,
     "get a cell's value" },
@@ -72,6 +909,38 @@ static PyMethodDef methods[] = {
   { "cell_from_value", cell_from_value, METH_VARARGS,
     "create a new cell from a value" },
 
+  { "cells_get_values", cells_get_values, METH_VARARGS,
+    "cells_get_values(cells)\n"
+    "a tuple of the values of a tuple of cells" },
+
+  { "cells_set_values", cells_set_values, METH_VARARGS,
+    "cells_set_values(cells, values)\n"
+    "set the value of each cell in a tuple from a sequence of values" },
+
+  { "cells_from_values", cells_from_values, METH_VARARGS,
+    "cells_from_values(values)\n"
+    "a tuple of new cells from a sequence of values" },
+
+  { "code_unnew", code_unnew, METH_VARARGS,
+    "code_unnew(code)\n"
+    "list of the member values of a code object, in the order\n"
+    "expected by new.code" },
+
+  { "function_unnew", function_unnew, METH_VARARGS,
+    "function_unnew(func)\n"
+    "list of the code, globals, name, defaults, and closure of a\n"
+    "function" },
+
+  { "function_new", function_new, METH_VARARGS,
+    "function_new(code, globals, name, defaults, closure)\n"
+    "create a new function. Identical to new.function" },
+
+  { "walk", walk, METH_VARARGS,
+    "walk(func, value, cache=None)\n"
+    "map func over the non-container members of nested lists,\n"
+    "tuples, and dicts in value, copying only changed containers.\n"
+    "cache may be an IdentityMap or a dict of id(original) to result" },
+
   { NULL, NULL, 0, NULL },
 };
 
@@ -80,7 +949,15 @@ PyMODINIT_FUNC init_cellwork() {
   PyObject *mod;
   PyObject *celltype;
 
+  if (PyType_Ready(&IdentityMapType) < 0)
+    return;
+
   mod = Py_InitModule("brine._cellwork", methods);
+  if (! mod)
+    return;
+
+  Py_INCREF(&IdentityMapType);
+  PyModule_AddObject(mod, "IdentityMap", (PyObject *) &IdentityMapType);
 
   // may as well make a convenient spot to get a reference to the
   // CellType type while we're at it
@@ -30,10 +30,26 @@ executing arbitrary code on the host.
 """
 
 
-from . import brine, unbrine
+from . import brine, unbrine, unbrine_many
+from . import _batch_briner, _code_key
 from .barrel import Barrel
+from Queue import Empty, Full, Queue as LocalQueue
 from abc import ABCMeta
+from cStringIO import StringIO
+from collections import deque
+from functools import partial
+from hashlib import sha1
+from multiprocessing import Array
 from multiprocessing.queues import JoinableQueue, Queue, SimpleQueue
+from multiprocessing.util import Finalize, is_exiting
+from os import getpid, urandom
+from pickle import UnpicklingError
+from sys import exc_info
+from threading import Event, Lock, Thread, current_thread
+from time import time
+from weakref import WeakValueDictionary
+
+import cPickle
 
 
 __all__ = (
@@ -47,20 +63,125 @@ __all__ = (
 class BrinedQueueMix(object):
     """
     Mixin that overrides the `put`, `get` methods to automatically
-    `brine`, `unbrine` the passed value.
+    `brine`, `unbrine` the passed value, and adds `put_many`,
+    `get_many` methods which do the same for several values at once.
+
+    Setting `brine_memo` to a `brine.BrineMemo` allows functions which
+    are put repeatedly to be brined only once.
+
+    Setting `code_table` to True sends the code of each function only
+    the first time it is put, and after that just a digest of it,
+    which the getting process looks up in the code it has already
+    received. Only a single process may then get from the queue. The
+    first process to get from it claims it, and getting in any other
+    process raises ValueError before anything is taken off the queue.
+
+    Values are brined by the queue's feeder thread as it sends them,
+    so `put` returns without waiting for that. As with the pickling
+    done by a plain `Queue`, changes made to a value after it is put
+    may be sent along, and errors brining it are reported by the
+    feeder thread rather than raised by `put`. Setting `snapshot` to
+    True brines each value during `put` instead.
+
+    Setting `prefetch` to a positive number, before the first `get`,
+    has each getting process start a thread which gets and unbrines
+    up to that many messages ahead of time, so that a value is ready
+    as soon as it's wanted. Messages prefetched by one process are
+    not available to any other until it calls `stop_prefetch`, which
+    puts back those which haven't been gotten. That happens as the
+    process exits, and as the queue is closed. With `code_table` set
+    no other process may get them, and there may be no room left on a
+    queue with a `maxsize`, so their values are then kept for the
+    later gets of this one instead.
+
+    Setting `function_cache` to a `brine.cache.LRUCache` has each
+    getting process look up the functions it gets in that cache by
+    their content, so that a function which is put repeatedly is
+    only recreated the first time. The same function object is then
+    returned each time, as per the `functions` parameter of
+    `brine.unbrine`, and the cache's `info` reports its hits and
+    misses.
     """
 
     __metaclass__ = ABCMeta
 
+    brine_memo = None
+    code_table = False
+    snapshot = False
+    prefetch = 0
+    function_cache = None
+
+
+    def __init__(self, *args, **kwds):
+        super(BrinedQueueMix, self).__init__(*args, **kwds)
+        _init_code_state(self)
+
+
+    def __getstate__(self):
+        state = super(BrinedQueueMix, self).__getstate__()
+        return (state, self._code_token, self._code_state)
+
+
+    def __setstate__(self, state):
+        state, self._code_token, self._code_state = state
+        super(BrinedQueueMix, self).__setstate__(state)
+
 
     def put(self, value, **opts):
-        value = brine(value)
-        super(BrinedQueueMix, self).put(value, **opts)
+        _put = partial(super(BrinedQueueMix, self).put, **opts)
+        _put(_snapshot(self, _brine_message, value))
+
+
+    def put_many(self, values, **opts):
+        """
+        Put each of `values` on the queue as a single message, brined
+        together via `brine_many`. The values are still gotten one at
+        a time by `get`, and in a `JoinableQueue` each one is a task
+        of its own for `task_done`. The whole batch is gotten by a
+        single process.
+        """
+
+        _put_many(self, partial(self.put, **opts), values)
 
 
     def get(self, **opts):
-        value = super(BrinedQueueMix, self).get(**opts)
-        return unbrine(value)
+        _get = super(BrinedQueueMix, self).get
+        get, unpack = _prefetched(self, _get, _get_brined)
+        return _get_one(self, partial(get, **opts), unpack)
+
+
+    def get_many(self, max_items, timeout=None):
+        """
+        A list of up to `max_items` values from the queue. Blocks for
+        at most `timeout` seconds until at least one value is
+        available, raising `Queue.Empty` if none is, and then gathers
+        whatever further values are available without blocking.
+        """
+
+        _get = super(BrinedQueueMix, self).get
+        get, unpack = _prefetched(self, _get, _get_brined)
+        return _get_many(self, get, unpack, max_items, timeout)
+
+
+    def stop_prefetch(self):
+        """
+        Stop the prefetching thread of the current process, if there
+        is one, putting the messages it got which haven't been gotten
+        back on the queue for another process to get. A later `get`
+        starts prefetching again.
+        """
+
+        _stop_prefetch(self)
+
+
+    def close(self):
+        _stop_prefetch(self)
+        super(BrinedQueueMix, self).close()
+
+
+    def _start_thread(self):
+        _start = super(BrinedQueueMix, self)._start_thread
+        _start_feeder(self, _start, _brine_message, _send_brined)
 
 
 class BrinedQueue(BrinedQueueMix, Queue):
@@ -85,8 +206,44 @@ class BrinedSimpleQueue(SimpleQueue):
     """
     A `SimpleQueue` that takes the additional step of calling `brine`
     on its `put` argumens, and `unbrine` on its `get` results.
+
+    Setting `brine_memo` to a `brine.BrineMemo` allows functions which
+    are put repeatedly to be brined only once, and setting
+    `code_table` to True sends the code of each function only once, as
+    per `BrinedQueueMix`. The `put_many`, `get_many` methods and the
+    `prefetch`, `function_cache` settings and the `stop_prefetch`
+    method also work as per `BrinedQueueMix`.
     """
 
+    brine_memo = None
+    code_table = False
+    prefetch = 0
+    function_cache = None
+
+
+    def __init__(self):
+        _init_code_state(self)
+        super(BrinedSimpleQueue, self).__init__()
+
+
+    def __getstate__(self):
+        state = super(BrinedSimpleQueue, self).__getstate__()
+        return (state, self._code_token, self._code_state)
+
+
+    def __setstate__(self, state):
+        state, self._code_token, self._code_state = state
+        super(BrinedSimpleQueue, self).__setstate__(state)
+
+
+    def stop_prefetch(self):
+        """
+        As per `BrinedQueueMix.stop_prefetch`
+        """
+
+        _stop_prefetch(self)
+
+
     def _make_methods(self):
         # SimpleQueue doesn't have get/put methods, it has fields by
         # those names that just happen to be functions or bound
@@ -100,33 +257,111 @@ class BrinedSimpleQueue(SimpleQueue):
         _get = self.get
 
         def put(value):
-            _put(brine(value))
+            _send_brined(self, _put, _brine_message(self, value))
+
+        def put_many(values):
+            _put_many(self, put, values)
 
         def get():
-            return unbrine(_get())
+            get, unpack = _prefetched(self, _get_block, _get_brined)
+            return _get_one(self, get, unpack)
+
+        def get_many(max_items, timeout=None):
+            get, unpack = _prefetched(self, _get_block, _get_brined)
+            return _get_many(self, get, unpack, max_items, timeout)
+
+        _get_block = _simple_get(self, _get)
 
         self.put = put
+        self.put_many = put_many
         self.get = get
+        self.get_many = get_many
 
 
 class BarreledQueueMix(object):
     """
     Mixin that overrides the `put`, `get` methods to automatically
-    pack into or unpack from a `Barrel`
+    pack into or unpack from a `Barrel`, and adds `put_many`,
+    `get_many` methods which pack several values into a single
+    `Barrel`, so that they share its tables.
+
+    Setting `code_table` to True sends the code of each function only
+    once, as per `BrinedQueueMix`. Values are packed by the queue's
+    feeder thread unless `snapshot` is set to True, and are unpacked
+    ahead of time if `prefetch` is set, also as per `BrinedQueueMix`.
+    Setting `function_cache` has each Barrel gotten use that cache,
+    as per `Barrel.use_function_cache`.
     """
 
     __metaclass__ = ABCMeta
 
+    code_table = False
+    snapshot = False
+    prefetch = 0
+    function_cache = None
+
+
+    def __init__(self, *args, **kwds):
+        super(BarreledQueueMix, self).__init__(*args, **kwds)
+        _init_code_state(self)
+
+
+    def __getstate__(self):
+        state = super(BarreledQueueMix, self).__getstate__()
+        return (state, self._code_token, self._code_state)
+
+
+    def __setstate__(self, state):
+        state, self._code_token, self._code_state = state
+        super(BarreledQueueMix, self).__setstate__(state)
+
 
     def put(self, value, **opts):
-        bar = Barrel()
-        bar[0] = value
-        super(BarreledQueueMix, self).put(bar, **opts)
+        _put = partial(super(BarreledQueueMix, self).put, **opts)
+        _put(_snapshot(self, _barrel_message, value))
+
+
+    def put_many(self, values, **opts):
+        """
+        Put each of `values` on the queue packed into a single
+        `Barrel`. Otherwise as per `BrinedQueueMix.put_many`.
+        """
+
+        _put_many(self, partial(self.put, **opts), values)
 
 
     def get(self, **opts):
-        bar = super(BarreledQueueMix, self).get(**opts)
-        return bar[0]
+        _get = super(BarreledQueueMix, self).get
+        get, unpack = _prefetched(self, _get, _get_barreled)
+        return _get_one(self, partial(get, **opts), unpack)
+
+
+    def get_many(self, max_items, timeout=None):
+        """
+        As per `BrinedQueueMix.get_many`
+        """
+
+        _get = super(BarreledQueueMix, self).get
+        get, unpack = _prefetched(self, _get, _get_barreled)
+        return _get_many(self, get, unpack, max_items, timeout)
+
+
+    def stop_prefetch(self):
+        """
+        As per `BrinedQueueMix.stop_prefetch`
+        """
+
+        _stop_prefetch(self)
+
+
+    def close(self):
+        _stop_prefetch(self)
+        super(BarreledQueueMix, self).close()
+
+
+    def _start_thread(self):
+        _start = super(BarreledQueueMix, self)._start_thread
+        _start_feeder(self, _start, _barrel_message, _send_barrel)
 
 
 class BarreledQueue(BarreledQueueMix, Queue):
@@ -154,8 +389,41 @@ class BarreledSimpleQueue(SimpleQueue):
     A `SimpleQueue` that packs data into a `Barrel` before sending
     with the `put` method, and unpacks data from a `Barrel` before
     returning from the `get` method.
+
+    Setting `code_table` to True sends the code of each function only
+    once, as per `BrinedQueueMix`. The `put_many`, `get_many` methods
+    and the `prefetch`, `function_cache` settings and the
+    `stop_prefetch` method work as per `BarreledQueueMix`.
     """
 
+    code_table = False
+    prefetch = 0
+    function_cache = None
+
+
+    def __init__(self):
+        _init_code_state(self)
+        super(BarreledSimpleQueue, self).__init__()
+
+
+    def __getstate__(self):
+        state = super(BarreledSimpleQueue, self).__getstate__()
+        return (state, self._code_token, self._code_state)
+
+
+    def __setstate__(self, state):
+        state, self._code_token, self._code_state = state
+        super(BarreledSimpleQueue, self).__setstate__(state)
+
+
+    def stop_prefetch(self):
+        """
+        As per `BrinedQueueMix.stop_prefetch`
+        """
+
+        _stop_prefetch(self)
+
+
     def _make_methods(self):
         # SimpleQueue doesn't have get/put methods, it has fields by
         # those names that just happen to be functions or bound
@@ -169,16 +437,825 @@ class BarreledSimpleQueue(SimpleQueue):
         _get = self.get
 
         def put(value):
-            bar = Barrel()
-            bar[0] = value
-            _put(bar)
+            _send_barrel(self, _put, _barrel_message(self, value))
+
+        def put_many(values):
+            _put_many(self, put, values)
 
         def get():
-            bar = _get()
-            return bar[0]
+            get, unpack = _prefetched(self, _get_block, _get_barreled)
+            return _get_one(self, get, unpack)
+
+        def get_many(max_items, timeout=None):
+            get, unpack = _prefetched(self, _get_block, _get_barreled)
+            return _get_many(self, get, unpack, max_items, timeout)
+
+        _get_block = _simple_get(self, _get)
 
         self.put = put
+        self.put_many = put_many
+        self.get = get
+        self.get_many = get_many
+
+
+class _Batch(object):
+    """
+    Several values put on a queue together, as a single message
+    """
+
+    __slots__ = ("values", )
+
+
+    def __init__(self, values):
+        self.values = values
+
+
+    def __reduce__(self):
+        return (_Batch, (self.values, ))
+
+
+class _Returned(object):
+    """
+    A message put back on a queue by a process which got it, and
+    which is sent on again just as it was received
+    """
+
+    __slots__ = ("message", )
+
+
+    def __init__(self, message):
+        self.message = message
+
+
+class _Snapshot(object):
+    """
+    A value which was packed by put, rather than being left for the
+    feeder thread
+    """
+
+    __slots__ = ("message", )
+
+
+    def __init__(self, message):
+        self.message = message
+
+
+def _snapshot(queue, pack, value):
+    # value as it is to be put on the underlying queue. Unless
+    # snapshot is set, the feeder thread packs it as it sends it.
+    if queue.snapshot:
+        return _Snapshot(pack(queue, value))
+    return value
+
+
+def _start_feeder(queue, start, pack, send_message):
+    # starts the feeder thread of a Queue via start, having it pack
+    # each value that wasn't already by calling pack(queue, value),
+    # and then send the result via send_message(queue, send, message)
+
+    send = queue._send
+
+    def feed(value):
+        try:
+            if type(value) is _Returned:
+                send(value.message)
+                return
+            elif type(value) is _Snapshot:
+                message = value.message
+            else:
+                message = pack(queue, value)
+            send_message(queue, send, message)
+        except BaseException:
+            _discard(queue, value)
+            raise
+
+    queue._send = feed
+    try:
+        start()
+    finally:
+        queue._send = send
+
+
+def _discard(queue, value):
+    # undoes the accounting done by put for a value which the feeder
+    # thread couldn't pack or pickle, and so was never sent. That is
+    # its slot in the queue, and in a JoinableQueue its tasks, which
+    # could otherwise never be marked done.
+
+    unfinished = getattr(queue, "_unfinished_tasks", None)
+    if unfinished is not None:
+        count = len(value.values) if type(value) is _Batch else 1
+        with queue._cond:
+            for _i in xrange(count):
+                unfinished.acquire(False)
+            if unfinished._semlock._is_zero():
+                queue._cond.notify_all()
+
+    queue._sem.release()
+
+
+def _brine_message(queue, value):
+    # the brined form of value, or of a _Batch of values, along with
+    # the code it contains if code_table is set
+
+    memo = queue.brine_memo
+    if queue.code_table:
+        codes = dict()
+        return _brine_batch(value, memo, codes), codes
+    elif type(value) is _Batch:
+        return _brine_batch(value, memo, dict()), None
+    else:
+        return brine(value, memo), None
+
+
+def _brine_batch(value, memo, codes):
+    # brines value, or each value in a _Batch, with a single cache so
+    # that what they share stays shared
+    briner = _batch_briner(memo, codes)
+    if type(value) is _Batch:
+        return _Batch(briner(value.values))
+    return briner(value)
+
+
+def _send_brined(queue, send, message):
+    brined, codes = message
+    if codes is None:
+        send(brined)
+    else:
+        _code_channel(queue).put(send, brined, codes)
+
+
+def _get_brined(queue, data):
+    functions = queue.function_cache
+    if queue.code_table:
+        value = _code_channel(queue).loads_brined(data, functions)
+    elif type(data) is _Batch:
+        value = _Batch(unbrine_many(data.values, functions=functions))
+    else:
+        return [unbrine(data, functions=functions)]
+
+    return value.values if type(value) is _Batch else [value]
+
+
+def _barrel_message(queue, value):
+    # a batch is packed keyed by the order of its values, and a
+    # single value is just a batch of one
+
+    if type(value) is _Batch:
+        bar = Barrel(enumerate(value.values))
+    else:
+        bar = Barrel()
+        bar[0] = value
+
+    # the values are brined now rather than when the barrel is
+    # pickled, which then reuses this state
+    bar.__getstate__()
+    return bar
+
+
+def _send_barrel(queue, send, bar):
+    if queue.code_table:
+        _code_channel(queue).put_barrel(send, bar)
+    else:
+        send(bar)
+
+
+def _get_barreled(queue, bar):
+    if queue.code_table:
+        bar = _code_channel(queue).loads(bar)
+    if queue.function_cache is not None:
+        bar.use_function_cache(queue.function_cache)
+    return [bar[index] for index in xrange(len(bar.keys()))]
+
+
+def _put_many(queue, put, values):
+    # put values on queue as a single _Batch via put
+
+    values = list(values)
+    if len(values) > 1:
+        put = _counted_put(queue, put, len(values))
+        put(_Batch(values))
+    elif values:
+        put(values[0])
+
+
+def _counted_put(queue, put, count):
+    # A JoinableQueue expects a task_done call for each value gotten,
+    # but only counts a single task for each put. The rest of the
+    # tasks in a batch are counted before it is put, so that they're
+    # already there by the time anything gets the batch.
+
+    unfinished = getattr(queue, "_unfinished_tasks", None)
+    if unfinished is None:
+        return put
+
+    def put_counted(data):
+        for _i in xrange(count - 1):
+            unfinished.release()
+        try:
+            put(data)
+        except BaseException:
+            for _i in xrange(count - 1):
+                unfinished.acquire(False)
+            raise
+
+    return put_counted
+
+
+def _get_one(queue, get, unpack):
+    # the next value from queue. get returns the next message from the
+    # underlying queue, and unpack(queue, message) the list of values
+    # in it. Any values past the first are kept for later gets.
+
+    received = _received(queue)
+    try:
+        return received.popleft()
+    except IndexError:
+        pass
+
+    values = unpack(queue, get())
+    received.extend(values[1:])
+    return values[0]
+
+
+def _get_many(queue, get, unpack, max_items, timeout):
+    # up to max_items values from queue. get(block, timeout) returns
+    # the next message from the underlying queue, and unpack is as
+    # per _get_one. Values beyond max_items are kept for later gets.
+
+    if max_items < 1:
+        raise ValueError("max_items must be at least 1")
+
+    received = _received(queue)
+    values = []
+    try:
+        while len(values) < max_items:
+            values.append(received.popleft())
+    except IndexError:
+        pass
+
+    block = not values
+    try:
+        while len(values) < max_items:
+            try:
+                message = get(block, timeout)
+            except Empty:
+                if block:
+                    raise
+                break
+            block = False
+            values.extend(unpack(queue, message))
+
+    except BaseException:
+        received.extendleft(reversed(values))
+        raise
+
+    received.extendleft(reversed(values[max_items:]))
+    return values[:max_items]
+
+
+def _simple_get(queue, get):
+    # adapts the get of a SimpleQueue, which always blocks, to accept
+    # the block and timeout arguments of a Queue's get. As with a
+    # Queue, the read lock is then held for at most timeout, rather
+    # than until a message arrives.
+
+    rlock = queue._rlock
+    poll = queue._reader.poll
+    recv = queue._reader.recv
+
+    def get_block(block=True, timeout=None):
+        if block and timeout is None:
+            return get()
+
+        if block:
+            deadline = time() + timeout
+        if not rlock.acquire(block, timeout):
+            raise Empty
+        try:
+            if block:
+                timeout = deadline - time()
+                if timeout < 0 or not poll(timeout):
+                    raise Empty
+            elif not poll():
+                raise Empty
+            return recv()
+        finally:
+            rlock.release()
+
+    return get_block
+
+
+def _received(queue):
+    # values which the current process has gotten from queue as part
+    # of a batch, but which haven't been returned yet
+    return _local(queue, "_received", deque)
+
+
+def _prefetched(queue, get, unpack):
+    # the get and unpack functions to use in place of get and unpack,
+    # which are those of a prefetching thread if prefetch is set. A
+    # queue with code_table set is claimed for this process first, so
+    # that another process is refused before it gets anything.
+
+    if queue.code_table:
+        _code_channel(queue).listen()
+
+    size = queue.prefetch
+    if not size:
+        return get, unpack
+
+    start = partial(_Prefetcher, queue, get, unpack, size)
+    prefetcher = _local(queue, "_prefetched", start)
+    return prefetcher.ready.get, _ready_values
+
+
+def _stop_prefetch(queue):
+    # stops the prefetching thread of the current process, if any, so
+    # that a later get starts a new one
+    found = queue.__dict__.get("_prefetched")
+    if found is not None and found[0] == getpid():
+        found[1].stop()
+        with _local_lock:
+            if queue.__dict__.get("_prefetched") is found:
+                del queue._prefetched
+
+
+# how long the prefetching thread waits for a message at a time,
+# before checking whether it has been stopped
+_PREFETCH_POLL = 0.1
+
+
+class _Prefetcher(object):
+    """
+    A thread which gets messages from a queue and unpacks them,
+    keeping the results of up to `size` of them in `ready`.
+
+    The thread waits for a message without holding the read lock of
+    the queue, and then only takes it with a get limited to the same
+    short time, so that it never blocks other processes for longer
+    than that. When stopped, which happens as the process exits, the
+    messages it got but which haven't been returned by a get are put
+    back on the queue, as they were received, for another process to
+    get.
+    """
+
+    def __init__(self, queue, get, unpack, size):
+        self.queue = queue
         self.get = get
+        self.unpack = unpack
+        self.ready = LocalQueue(size)
+        self.held = None
+        self.stopped = Event()
+
+        self.thread = Thread(target=self.run, name="QueuePrefetchThread")
+        self.thread.daemon = True
+        self.thread.start()
+
+        # run before the feeder thread of the queue is joined, so that
+        # messages put back are still sent
+        self.finalizer = Finalize(None, self.stop, exitpriority=10)
+
+
+    def run(self):
+        # Errors are passed along to be raised by whichever thread
+        # gets them. The thread carries on past errors with a single
+        # message, but stops getting once the underlying queue has
+        # been closed, and then offers that error to every later get.
+        # As with the feeder thread of a Queue, errors once the process
+        # is exiting are ignored, and so the functions needed are bound
+        # here, as module globals may be gone by then.
+
+        queue = self.queue
+        get = self.get
+        unpack = self.unpack
+        offer = self.offer
+        reader = queue._reader
+        poll = reader.poll
+        stopped = self.stopped.is_set
+        error = exc_info
+        exiting = is_exiting
+        empty = Empty
+        interval = _PREFETCH_POLL
+
+        while not stopped():
+            try:
+                if poll(interval):
+                    message = get(True, interval)
+                elif reader.closed:
+                    # polling a closed reader finds nothing, but
+                    # getting from it raises the error
+                    message = get()
+                else:
+                    continue
+            except empty:
+                continue
+            except (EOFError, EnvironmentError):
+                closed = (False, error(), None)
+                while not (stopped() or exiting()):
+                    offer(closed)
+                return
+            except Exception:
+                if exiting():
+                    return
+                offer((False, error(), None))
+                continue
+
+            try:
+                offer((True, unpack(queue, message), message))
+            except Exception:
+                if exiting():
+                    self.held = (False, None, message)
+                    return
+                offer((False, error(), message))
+
+
+    def offer(self, result):
+        # waits for room in ready for result, but keeps it to be put
+        # back if stopped first
+        interval = _PREFETCH_POLL
+        while not self.stopped.is_set():
+            try:
+                self.ready.put(result, True, interval)
+                return
+            except Full:
+                pass
+        self.held = result
+
+
+    def stop(self):
+        """
+        Stop the thread and put back the messages which it got but
+        which haven't been returned by a get. With a code table, or
+        once the queue is full, their values are instead kept for the
+        later gets of this process.
+        Any thread of this process waiting in a get at the time waits
+        on.
+        """
+
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        self.finalizer.cancel()
+        if self.thread is not current_thread():
+            self.thread.join()
+
+        results = []
+        try:
+            while True:
+                results.append(self.ready.get_nowait())
+        except Empty:
+            pass
+        if self.held is not None:
+            results.append(self.held)
+            self.held = None
+
+        queue = self.queue
+        received = _received(queue)
+        for success, values, message in results:
+            if message is None:
+                continue
+            if queue.code_table or not _put_back(queue, message):
+                # no other process may get from the queue, or there's
+                # no room left on it, so the values are kept for the
+                # later gets of this one
+                if success:
+                    received.extend(values)
+
+
+def _ready_values(queue, result):
+    # unpacks the results of the prefetching thread, which are either
+    # the values of a message or the exc_info of the error raised in
+    # getting it, which is raised again with its traceback
+    success, values, _message = result
+    if success:
+        return values
+    _reraise(*values)
+
+
+def _define_reraise():
+    # the three-argument raise is compiled from a string, so that the
+    # module still parses for tools which read it as Python 3
+    namespace = dict()
+    exec("def reraise(etype, value, tb):\n"
+         "    raise etype, value, tb\n", namespace)
+    return namespace["reraise"]
+
+
+_reraise = _define_reraise()
+
+
+def _put_back(queue, message):
+    # puts message, which this process got from queue, back on it as
+    # it was received, returning False if there was no room for it.
+    # This doesn't wait, as the stopped process won't be getting
+    # anything to make room. In a JoinableQueue its tasks were counted
+    # when it was first put, and so they aren't counted again.
+
+    if isinstance(queue, SimpleQueue):
+        wlock = queue._wlock
+        if wlock is None:
+            queue._writer.send(message)
+        else:
+            with wlock:
+                queue._writer.send(message)
+    else:
+        try:
+            Queue.put(queue, _Returned(message), False)
+        except Full:
+            return False
+    return True
+
+
+def _local(queue, name, create):
+    # the state of queue for the current process stored under name,
+    # created via create() the first time. A forked process starts
+    # anew, rather than assuming what it inherited still applies.
+    # All of the threads of a process must agree on the same state.
+
+    found = queue.__dict__.get(name)
+    if found is None or found[0] != getpid():
+        with _local_lock:
+            found = queue.__dict__.get(name)
+            if found is None or found[0] != getpid():
+                found = (getpid(), create())
+                setattr(queue, name, found)
+    return found[1]
+
+
+_local_lock = Lock()
+
+
+# how much code the getting process keeps in each generation, and the
+# indexes of the state shared by a queue's code channels
+_CODE_TABLE_SIZE = 1024
+_GETTER, _GENERATION = range(2)
+
+
+class _CodeChannel(object):
+    """
+    The code sent and received on a queue by the current process.
+
+    Code is identified by a digest of its content. The first time
+    this process puts a value with code of a given digest, the code
+    is written along with its digest, and after that just the digest
+    is. Code which this process gets from the queue is kept by its
+    digest.
+
+    Only a single process may get from the queue, as the code is only
+    written once. The first process to get claims the queue, and any
+    other process is refused before it gets anything.
+
+    The getting process keeps at most `size` of the code it received
+    before it starts a new generation, and putting processes then
+    write all code anew. The code of the previous generation is kept
+    for the values which were put before the putting processes saw
+    the new one.
+    """
+
+    def __init__(self, token, state, size=_CODE_TABLE_SIZE):
+        self.token = token
+        self.state = state
+        self.size = size
+        self.lock = Lock()
+        self.pid = getpid()
+
+        # the digests of the code written by this process, and the
+        # generation they were written in
+        self.sent = set()
+        self.sent_gen = 0
+
+        # the code received by this process, in the current and the
+        # previous generation
+        self.gen = 0
+        self.received = dict()
+        self.previous = dict()
+        self.listening = False
+
+
+    def listen(self):
+        """
+        Claim the queue for getting by the current process, raising
+        ValueError if another process already has.
+        """
+
+        if self.listening:
+            return
+
+        state = self.state
+        with state.get_lock():
+            getter = state[_GETTER]
+            if getter == 0:
+                state[_GETTER] = getpid()
+            elif getter != getpid():
+                raise ValueError("only one process may get from a"
+                                 " queue with code_table set")
+            self.gen = state[_GENERATION]
+
+        _receivers[self.token] = self
+        self.listening = True
+
+
+    def loads_brined(self, received, functions=None):
+        value = self.loads(received)
+        if type(value) is _Batch:
+            return _Batch(unbrine_many(value.values, functions=functions))
+        return unbrine_many((value, ), functions=functions)[0]
+
+
+    def put_barrel(self, put, barrel):
+        codes = dict()
+        for code in barrel.__getstate__()[1]:
+            key = _code_key(code)
+            if key is not None:
+                codes[key] = code
+        self.put(put, barrel, codes)
+
+
+    def put(self, put, value, codes):
+        # pass value to put, to be pickled by the queue as it is sent.
+        # Code is unmarked again if its value couldn't be put.
+
+        message = _CodedMessage(self, value, codes)
+        try:
+            put(message)
+        except BaseException:
+            with self.lock:
+                self.sent.difference_update(message.defined)
+            raise
+
+
+    def dumps(self, value, codes):
+        # pickle value, writing the code in codes by digest. codes is
+        # a dict of the _code_key of each code to the code object which
+        # appears in value. Returns the generation of the code table,
+        # the code which is to be written in full and the digests of
+        # all of the code in value, the pickled value, and the digests
+        # newly marked as sent.
+
+        digests = dict()
+        for key, code in codes.iteritems():
+            digests[id(code)] = sha1(key).digest()
+
+        with self.lock:
+            gen = self.state[_GENERATION]
+            if gen != self.sent_gen:
+                # the getter has started a new generation
+                self.sent = set()
+                self.sent_gen = gen
+
+            sent = self.sent
+            size = self.size
+            defined = []
+            refs = set()
+
+            def persistent_id(obj):
+                digest = digests.get(id(obj))
+                if digest is None:
+                    return None
+
+                if digest not in sent:
+                    if len(sent) >= size:
+                        # the getter won't keep any more code in this
+                        # generation, so it is pickled along with the
+                        # value instead
+                        del digests[id(obj)]
+                        return None
+                    sent.add(digest)
+                    defined.append((digest, obj))
+
+                refs.add(digest)
+                return digest
+
+            buffer = StringIO()
+            pickler = cPickle.Pickler(buffer, cPickle.HIGHEST_PROTOCOL)
+            pickler.persistent_id = persistent_id
+            try:
+                pickler.dump(value)
+            except BaseException:
+                sent.difference_update(digest for digest, _c in defined)
+                raise
+
+        marked = [digest for digest, _code in defined]
+        return gen, defined, list(refs), buffer.getvalue(), marked
+
+
+    def receive(self, gen, defined, refs, data):
+        # keeps the code defined by a message of generation gen, and
+        # looks up the code for each of the digests in refs. Called
+        # while the queue is read, so messages are received in the
+        # order they were written.
+
+        with self.lock:
+            if gen == self.gen:
+                table = self.received
+            elif gen == self.gen - 1:
+                table = self.previous
+            else:
+                table = dict()
+
+            table.update(defined)
+            codes = dict((digest, table[digest])
+                         for digest in refs if digest in table)
+
+            if table is self.received and len(table) >= self.size:
+                self.previous = table
+                self.received = dict()
+                self.gen = gen + 1
+                self.state[_GENERATION] = self.gen
+
+        return _Received(codes, data)
+
+
+    def loads(self, received):
+        if type(received) is not _Received:
+            # a value put without code_table set
+            return received
+
+        codes = received.codes
+
+        def persistent_load(pid):
+            code = None if codes is None else codes.get(pid)
+            if code is None:
+                raise UnpicklingError("code with digest %s was never"
+                                      " received by this process" %
+                                      pid.encode("hex"))
+            return code
+
+        unpickler = cPickle.Unpickler(StringIO(received.data))
+        unpickler.persistent_load = persistent_load
+        return unpickler.load()
+
+
+class _CodedMessage(object):
+    """
+    A value put via a code channel. It is pickled by the channel as
+    the queue pickles it to be written, while the queue holds its
+    write lock, so that values are written in the same order as their
+    code was marked as sent, and in the generation they were marked.
+    """
+
+    __slots__ = ("channel", "value", "codes", "defined", )
+
+
+    def __init__(self, channel, value, codes):
+        self.channel = channel
+        self.value = value
+        self.codes = codes
+        self.defined = ()
+
+
+    def __reduce__(self):
+        channel = self.channel
+        gen, defined, refs, data, marked = channel.dumps(self.value,
+                                                         self.codes)
+        self.defined = marked
+        return (_receive_coded, (channel.token, gen, defined, refs, data))
+
+
+class _Received(object):
+    """
+    A value received via a code channel, along with the code it needs
+    """
+
+    __slots__ = ("codes", "data", )
+
+
+    def __init__(self, codes, data):
+        self.codes = codes
+        self.data = data
+
+
+def _receive_coded(token, gen, defined, refs, data):
+    # called as a _CodedMessage is unpickled by the queue. This must
+    # not raise, as the queue would then lose track of its size, so
+    # a process which isn't listening gets none of the code.
+
+    channel = _receivers.get(token)
+    if channel is None or channel.pid != getpid():
+        return _Received(None, data)
+    return channel.receive(gen, defined, refs, data)
+
+
+# the channels listening in this process, by the token of their queue
+_receivers = WeakValueDictionary()
+
+
+def _init_code_state(queue):
+    # the state of queue which its code channels share between
+    # processes: a token identifying it, and the pid of the process
+    # getting from it along with the generation of that process's
+    # code table
+    queue._code_token = urandom(8)
+    queue._code_state = Array("l", 2)
+
+
+def _code_channel(queue):
+    # the code channel of queue for the current process. A forked
+    # process starts a new channel, rather than assuming that what it
+    # inherited was sent to the same place.
+    create = partial(_CodeChannel, queue._code_token, queue._code_state)
+    return _local(queue, "_code_channel", create)
 
 
 #
@@ -21,14 +21,27 @@ Unit tests for brine
 """
 
 
-from brine import brine, unbrine
+from brine import brine, unbrine, dumps, loads, reg_container, BrineMemo
+from brine import LazyFunction, brine_many, unbrine_many
 from brine import code_unnew, code_new
 from brine import function_unnew, function_new
+from brine import reg_code_pickler
+from brine._cellwork import cells_get_values, cells_set_values
+from brine._cellwork import cells_from_values
+from brine.cache import IdentityMap, LRUCache
+from collections import OrderedDict, defaultdict, deque
 from cStringIO import StringIO
 from functools import partial
-from pickle import Pickler, Unpickler
-
+from pickle import Pickler, Unpickler, UnpicklingError
+from pickletools import genops
+from threading import Event, Thread
+
+import brine as brine_module
+import cPickle
+import gc
+import new
 import unittest
+import weakref
 
 
 class Obj(object):
@@ -49,6 +62,20 @@ def pickle_unpickle(value):
     return Unpickler(buffer).load()
 
 
+class Box(object):
+    # a sample custom container, registered with reg_container
+    def __init__(self, item):
+        self.item = item
+
+
+def map_box(func, box):
+    item = func(box.item)
+    return box if item is box.item else Box(item)
+
+
+reg_container(Box, map_box)
+
+
 def make_pair(value):
     shared = [value]
     def get_value():
@@ -61,6 +88,25 @@ def make_pair(value):
 make_adder = lambda by_x=0: lambda by_y=0: by_x+by_y
 
 
+# functions whose code is equal field by field, as 1 == 1.0 == True
+# and "a" == u"a", but which return different values
+make_equal_consts = lambda: [lambda: 1, lambda: 1.0, lambda: True,
+                             lambda: "a", lambda: u"a"]
+
+EQUAL_CONSTS = [1, 1.0, True, "a", u"a"]
+
+
+def make_const(value):
+    # a function returning value as a const of its code, even where
+    # the compiler wouldn't put such a value in consts
+    code = (lambda: None).func_code
+    code = new.code(code.co_argcount, code.co_nlocals, code.co_stacksize,
+                    code.co_flags, code.co_code, (value, ), code.co_names,
+                    code.co_varnames, code.co_filename, code.co_name,
+                    code.co_firstlineno, code.co_lnotab)
+    return new.function(code, globals())
+
+
 class TestUnnew(unittest.TestCase):
 
     def test_adder_duplication(self):
@@ -88,8 +134,74 @@ class TestUnnew(unittest.TestCase):
         self.assertEqual(func_a(5), func_b(5))
 
 
+    def test_function_new_checks(self):
+        func_a = make_adder(8)
+        code, glbls, name, defaults, closure = function_unnew(func_a)
+
+        self.assertRaises(TypeError, function_new,
+                          code, glbls, name, defaults, None)
+        self.assertRaises(ValueError, function_new,
+                          code, glbls, name, defaults, closure * 2)
+        self.assertRaises(TypeError, function_new,
+                          code, glbls, name, defaults, (None, ))
+        self.assertRaises(TypeError, function_new,
+                          code, glbls, 5, defaults, closure)
+
+        func_b = function_new(code, glbls, "func_b", None, closure)
+        self.assertEqual(func_b.__name__, "func_b")
+        self.assertEqual(func_b(2), 10)
+
+
+class TestCells(unittest.TestCase):
+
+    def test_cells_values(self):
+        cells = cells_from_values([1, "two", None])
+
+        self.assertEqual(len(cells), 3)
+        self.assertEqual(cells_get_values(cells), (1, "two", None))
+
+        cells_set_values(cells, ("one", 2, 3))
+        self.assertEqual(cells_get_values(cells), ("one", 2, 3))
+
+        self.assertRaises(ValueError, cells_set_values, cells, (1, 2))
+        self.assertRaises(TypeError, cells_get_values, (1, 2))
+
+
+    def test_cells_closure(self):
+        getter, setter = make_pair("A")
+        cells = getter.func_closure
+
+        self.assertEqual(cells_get_values(cells), (["A"], ))
+        cells_set_values(cells, (["B"], ))
+        self.assertEqual(getter(), "B")
+
+
 class TestBrine(unittest.TestCase):
 
+    def test_brine_slots(self):
+        getter, setter = make_pair("A")
+        brined = brine([getter, Obj(5).get_value, partial(setter, "B")])
+
+        for wrapper in brined:
+            self.assertFalse(hasattr(wrapper, "__dict__"))
+
+        for protocol in (0, 1, 2):
+            data = cPickle.dumps(brined, protocol)
+            ngetter, nmethod, nsetter = unbrine(cPickle.loads(data))
+            self.assertEqual(ngetter(), "A")
+            self.assertEqual(nmethod(), 5)
+
+        # protocol 2 creates the wrappers with NEWOBJ, and the earlier
+        # protocols with a constructor from brine rather than
+        # copy_reg._reconstructor
+        ops = [op.name for op, _arg, _pos in genops(cPickle.dumps(brined, 2))]
+        self.assertTrue("NEWOBJ" in ops)
+
+        data = cPickle.dumps(brine(getter), 0)
+        self.assertTrue("_brined_new" in data)
+        self.assertFalse("_reconstructor" in data)
+
+
     def test_brine_other(self):
         # test that brine doesn't break normal pickling of non-function
         # types (builtins, types, simple values)
@@ -110,6 +222,95 @@ class TestBrine(unittest.TestCase):
         self.assertEqual(data_stuff, ndata_stuff)
 
 
+    def test_brine_copy_free(self):
+        # function-free data is not duplicated
+        data = {"a": [1, 2, (3, 4)], "b": ("Hello", {"c": 5.0})}
+        self.assertTrue(brine(data) is data)
+        self.assertTrue(unbrine(data) is data)
+
+        # only the containers along the path to a function are
+        add_8 = make_adder(8)
+        data = {"a": [1, 2, (3, 4)], "b": ("Hello", [add_8])}
+        bdata = brine(data)
+
+        self.assertFalse(bdata is data)
+        self.assertTrue(bdata["a"] is data["a"])
+        self.assertFalse(bdata["b"] is data["b"])
+        self.assertTrue(bdata["b"][0] is data["b"][0])
+        self.assertEqual(type(bdata["b"]), tuple)
+
+        udata = unbrine(bdata)
+        self.assertTrue(udata["a"] is data["a"])
+        self.assertEqual(udata["b"][1][0](2), 10)
+
+
+    def test_brine_containers(self):
+        add_8 = make_adder(8)
+
+        data = [set([add_8]), frozenset([add_8]), deque([add_8], 4),
+                OrderedDict([("b", 1), ("a", add_8)]),
+                defaultdict(list, a=add_8), Box(add_8)]
+
+        ndata = unbrine(pickle_unpickle(brine(data)))
+
+        self.assertEqual([type(d) for d in ndata],
+                         [type(d) for d in data])
+
+        nset, nfrozen, ndeque, nordered, ndefault, nbox = ndata
+        self.assertEqual(list(nset)[0](2), 10)
+        self.assertEqual(list(nfrozen)[0](2), 10)
+        self.assertEqual(ndeque.maxlen, 4)
+        self.assertEqual(ndeque[0](2), 10)
+        self.assertEqual(nordered.keys(), ["b", "a"])
+        self.assertEqual(nordered["a"](2), 10)
+        self.assertEqual(ndefault["a"](2), 10)
+        self.assertEqual(ndefault["missing"], [])
+        self.assertEqual(nbox.item(2), 10)
+
+
+    def test_brine_ordered(self):
+        add_8 = make_adder(8)
+
+        # brined keys keep their place
+        data = OrderedDict([(add_8, "a"), ("b", 1), ("c", add_8)])
+        ndata = unbrine(pickle_unpickle(brine(data)))
+
+        self.assertEqual(type(ndata), OrderedDict)
+        self.assertEqual(ndata.values(), ["a", 1, ndata["c"]])
+        self.assertEqual(ndata.keys()[0](2), 10)
+        self.assertEqual(ndata["c"](2), 10)
+
+        data = OrderedDict([("b", 1), ("a", 2)])
+        self.assertTrue(brine(data) is data)
+
+
+    def test_brine_defaultdict(self):
+        add_8 = make_adder(8)
+
+        # the factory itself needs brining, whether or not the
+        # entries do
+        for data in (defaultdict(lambda: 0, a=1),
+                     defaultdict(lambda: 0, a=add_8)):
+            ndata = unbrine(pickle_unpickle(brine(data)))
+
+            self.assertEqual(type(ndata), defaultdict)
+            self.assertEqual(ndata.keys(), ["a"])
+            self.assertEqual(ndata["missing"], 0)
+
+        data = defaultdict(None, a=add_8)
+        ndata = unbrine(pickle_unpickle(brine(data)))
+        self.assertEqual(type(ndata), defaultdict)
+        self.assertEqual(ndata.default_factory, None)
+        self.assertEqual(ndata["a"](2), 10)
+
+
+    def test_brine_function_key(self):
+        add_8 = make_adder(8)
+
+        data = unbrine(pickle_unpickle(brine({add_8: "add_8"})))
+        self.assertEqual(data.keys()[0](2), 10)
+
+
     def test_brine_function(self):
         # this is the function we'll be duplicating.
         func_a = make_adder(8)
@@ -287,5 +488,624 @@ class TestBrine(unittest.TestCase):
         self.assertEqual(add_8(2), 10)
 
 
+class TestWalk(unittest.TestCase):
+
+    walk = staticmethod(brine_module.walk)
+
+
+    def test_walk_unchanged(self):
+        obj = Obj(1)
+        data = {"a": [1, 2, (3, 4.0)], "b": (u"Hello", None, {"c": obj}),
+                "d": [map, int]}
+        calls = []
+
+        def func(value):
+            calls.append(value)
+            return value
+
+        self.assertTrue(self.walk(func, data) is data)
+
+        # only the non-leaf, non-container member was visited
+        self.assertEqual(calls, [obj])
+
+
+    def test_walk_changed(self):
+        inner = [1, 2]
+        data = {"a": inner, "b": (3, [Obj(4)]), Obj("key"): 5}
+
+        def func(value):
+            return value.value
+
+        result = self.walk(func, data)
+
+        self.assertTrue(result["a"] is inner)
+        self.assertEqual(result["b"], (3, [4]))
+        self.assertEqual(result["key"], 5)
+        self.assertEqual(type(result["b"]), tuple)
+        self.assertEqual(len(data), 3)
+
+
+    def test_walk_large_dict(self):
+        data = dict((index, [index]) for index in xrange(10000))
+        data[Obj("key")] = Obj("value")
+        data[5000] = Obj("five")
+
+        result = self.walk(lambda value: value.value, data)
+
+        self.assertEqual(len(result), 10001)
+        self.assertEqual(result["key"], "value")
+        self.assertEqual(result[5000], "five")
+        self.assertTrue(result[4999] is data[4999])
+        self.assertEqual(type(data[5000]), Obj)
+
+
+    def test_walk_cache(self):
+        obj = Obj(1)
+        inner = [obj]
+        cache = {}
+
+        def func(value):
+            # the callback is responsible for caching its own results
+            ret = Obj(value.value + 1)
+            cache[id(value)] = ret
+            return ret
+
+        result = self.walk(func, [inner, obj, inner], cache)
+
+        self.assertTrue(result[0] is result[2])
+        self.assertTrue(result[0][0] is result[1])
+        self.assertTrue(cache[id(inner)] is result[0])
+
+
+    def test_walk_deep(self):
+        data = [1]
+        for _i in xrange(100000):
+            data = ({"a": [data]}, )
+
+        self.assertTrue(self.walk(id, data) is data)
+
+        result = self.walk(lambda value: value.value, [data, Obj(5)])
+        self.assertTrue(result[0] is data)
+        self.assertEqual(result[1], 5)
+
+
+    def test_walk_self_reference(self):
+        data = [1, 2]
+        data.append({"data": data})
+        self.assertRaises(ValueError, self.walk, id, data)
+
+
+    def test_walk_identity_cache(self):
+        cache = IdentityMap()
+
+        inner = [Obj(1)]
+        result = self.walk(lambda value: value.value, [inner, inner], cache)
+        self.assertEqual(result, [[1], [1]])
+        self.assertTrue(result[0] is result[1])
+        self.assertTrue(cache.get(inner) is result[0])
+
+        # a transient container is kept alive by the cache, so another
+        # container cannot reuse its id and be mistaken for it
+        for index in xrange(100):
+            result = self.walk(lambda value: value.value, [Obj(index)], cache)
+            self.assertEqual(result, [index])
+        self.assertEqual(len(cache), 102)
+
+
+    def test_walk_cache_cleared(self):
+        cache = IdentityMap()
+
+        def func(value):
+            # the callback may clear the cache while it is in use
+            cache.clear()
+            [[index] for index in xrange(100)]
+            return value.value
+
+        data = [[Obj(index)] for index in xrange(100)]
+        result = self.walk(func, data, cache)
+        self.assertEqual(result, [[index] for index in xrange(100)])
+
+        # only what was cached since the last clear remains
+        self.assertEqual(len(cache), 2)
+        self.assertTrue(cache.get(data) is result)
+        self.assertTrue(cache.get(data[-1]) is result[-1])
+        self.assertFalse(data[0] in cache)
+
+
+    def test_walk_subclass(self):
+        # subclasses of the plain containers go to the callback
+        class Sub(list):
+            pass
+
+        data = Sub([1])
+        self.assertEqual(self.walk(lambda value: "visited", [data]),
+                         ["visited"])
+
+
+class TestBrineMemo(unittest.TestCase):
+
+    def test_memo_reuse(self):
+        memo = BrineMemo()
+        add_8 = make_adder(8)
+
+        first = brine(add_8, memo)
+        self.assertTrue(brine(add_8, memo) is first)
+        self.assertTrue(brine([add_8], memo)[0] is first)
+        self.assertTrue(add_8 in memo)
+
+        # without the memo, a new wrapper every time
+        self.assertFalse(brine(add_8) is first)
+
+        new_add_8 = unbrine(pickle_unpickle(first))
+        self.assertEqual(new_add_8(2), 10)
+
+
+    def test_memo_invalidate(self):
+        memo = BrineMemo()
+        getter, setter = make_pair("A")
+        add_8 = make_adder(8)
+
+        first = brine(getter, memo)
+        self.assertTrue(brine(getter, memo) is first)
+
+        # changing the contents of a closure cell
+        cells_set_values(getter.func_closure, (["B"], ))
+        second = brine(getter, memo)
+        self.assertFalse(second is first)
+        self.assertEqual(unbrine(pickle_unpickle(second))(), "B")
+
+        # changing the function's __dict__
+        getter.note = "hello"
+        third = brine(getter, memo)
+        self.assertFalse(third is second)
+        self.assertTrue(brine(getter, memo) is third)
+        self.assertEqual(unbrine(third).note, "hello")
+
+        # changing the function's defaults
+        first = brine(add_8, memo)
+        add_8.func_defaults = (5, )
+        second = brine(add_8, memo)
+        self.assertFalse(second is first)
+        self.assertEqual(unbrine(pickle_unpickle(second))(), 13)
+
+
+    def test_memo_weak(self):
+        memo = BrineMemo()
+        add_8 = make_adder(8)
+
+        brine(add_8, memo)
+        self.assertEqual(len(memo), 1)
+
+        del add_8
+        self.assertEqual(len(memo), 0)
+
+        add_9 = make_adder(9)
+        brine(add_9, memo)
+        memo.discard(add_9)
+        self.assertFalse(add_9 in memo)
+
+
+    def test_memo_recursive(self):
+        def make_fact():
+            def fact(x):
+                return 1 if x <= 1 else x * fact(x - 1)
+            return fact
+
+        memo = BrineMemo()
+        fact = make_fact()
+        ref = weakref.ref(fact)
+
+        # a function in its own closure is memoized, but the memo
+        # doesn't keep it alive
+        first = brine(fact, memo)
+        self.assertTrue(fact in memo)
+        self.assertTrue(brine(fact, memo) is first)
+
+        del fact, first
+        gc.collect()
+        self.assertTrue(ref() is None)
+        self.assertEqual(len(memo), 0)
+
+
+    def test_memo_owner(self):
+        class Owner(object):
+            def __init__(self, n):
+                self.n = n
+                self.callback = lambda: self.n
+
+        memo = BrineMemo()
+        owners = [Owner(n) for n in xrange(100)]
+        refs = map(weakref.ref, owners)
+
+        brined = [brine(owner.callback, memo) for owner in owners]
+        self.assertTrue(brine(owners[5].callback, memo) is brined[5])
+        self.assertEqual(len(memo), 100)
+
+        # functions referring to themselves via the contents of their
+        # cells are still collected along with their owners
+        del owners, owner, brined
+        gc.collect()
+        self.assertEqual([r() for r in refs], [None] * 100)
+        self.assertEqual(len(memo), 0)
+
+
+    def test_memo_rewrap(self):
+        memo = BrineMemo()
+        add_8 = make_adder(8)
+
+        # once the wrapper is gone, the next shares its brined code
+        first = brine(add_8, memo)
+        ucode = first._unfunc[0]
+        del first
+
+        second = brine(add_8, memo)
+        self.assertTrue(second._unfunc[0] is ucode)
+        self.assertTrue(brine(add_8, memo) is second)
+        self.assertEqual(unbrine(pickle_unpickle(second))(2), 10)
+
+
+class TestLazyFunction(unittest.TestCase):
+
+    def test_unbrine_lazy(self):
+        getter, setter = make_pair("A")
+        getter.note = "hello"
+
+        brined = pickle_unpickle(brine([getter, make_adder]))
+        ngetter, nmake_adder = unbrine(brined, lazy=True)
+
+        self.assertEqual(type(ngetter), LazyFunction)
+        self.assertFalse(ngetter.is_resolved())
+        self.assertFalse(nmake_adder.is_resolved())
+
+        self.assertEqual(ngetter.note, "hello")
+        self.assertTrue(ngetter.is_resolved())
+        self.assertEqual(ngetter(), "A")
+        self.assertEqual(nmake_adder(8)(2), 10)
+
+        ngetter.note = "goodbye"
+        self.assertEqual(ngetter.resolve().note, "goodbye")
+
+
+    def test_brine_lazy(self):
+        add_8 = unbrine(brine(make_adder(8)), lazy=True)
+
+        self.assertEqual(unbrine(pickle_unpickle(brine(add_8)))(2), 10)
+        self.assertEqual(loads(dumps([add_8, add_8]))[1](2), 10)
+
+
+    def test_resolve_race(self):
+        started, finish = Event(), Event()
+        built = list()
+
+        def build():
+            func = make_adder(len(built))
+            built.append(func)
+            if len(built) == 1:
+                # the first build finishes after the second
+                started.set()
+                finish.wait()
+            return func
+
+        proxy = LazyFunction(build)
+        first = list()
+        thread = Thread(target=lambda: first.append(proxy.resolve()))
+        thread.start()
+        started.wait()
+
+        second = proxy.resolve()
+        finish.set()
+        thread.join()
+
+        # both threads get the function which was finished first
+        self.assertEqual(len(built), 2)
+        self.assertTrue(second is built[1])
+        self.assertTrue(first[0] is second)
+        self.assertTrue(proxy.resolve() is second)
+
+
+class TestBrineMany(unittest.TestCase):
+
+    def test_many_shared(self):
+        getter, setter = make_pair("A")
+        add_5 = make_adder(5)
+
+        values = [getter, (getter, setter), {"add": add_5},
+                  partial(add_5, 1), make_adder(6)]
+        brined = brine_many(values)
+        self.assertEqual(len(brined), 5)
+
+        # each function is only brined once, and the functions with
+        # the same code share it
+        self.assertTrue(brined[0] is brined[1][0])
+        self.assertTrue(brined[3]._func is brined[2]["add"])
+        self.assertTrue(brined[4]._unfunc[0] is brined[2]["add"]._unfunc[0])
+
+        self.assertTrue(len(cPickle.dumps(brined, 2)) <
+                        len(cPickle.dumps(map(brine, values), 2)))
+
+        ngetter, (ngetter_b, nsetter), nadd, npart, nadd_6 = \
+            unbrine_many(pickle_unpickle(brined))
+        self.assertTrue(ngetter is ngetter_b)
+        self.assertTrue(npart.func is nadd["add"])
+        self.assertEqual(npart(), 6)
+        self.assertEqual(nadd_6(1), 7)
+
+        nsetter("B")
+        self.assertEqual(ngetter(), "B")
+        self.assertEqual(getter(), "A")
+
+
+    def test_many_equal_code(self):
+        # code which is equal but not identical isn't shared
+        brined = brine_many(make_equal_consts())
+        got = [func() for func in unbrine_many(pickle_unpickle(brined))]
+        self.assertEqual(map(type, got), map(type, EQUAL_CONSTS))
+        self.assertEqual(got, EQUAL_CONSTS)
+
+        obj = Obj(5)
+        first, second = unbrine_many(brine_many([make_const(obj),
+                                                 make_const(obj)]))
+        self.assertTrue(first() is obj)
+        self.assertTrue(second() is obj)
+
+
+    def test_many_unchanged(self):
+        values = [1, "two", [3.0], {"four": (4, )}]
+        brined = brine_many(iter(values))
+        self.assertEqual(brined, values)
+        self.assertTrue(brined[2] is values[2])
+        self.assertEqual(unbrine_many(brined), values)
+        self.assertEqual(brine_many([]), [])
+
+
+    def test_many_memo(self):
+        memo = BrineMemo()
+        add_5 = make_adder(5)
+
+        first = brine_many([add_5], memo)
+        second = brine_many([add_5, [add_5]], memo)
+        self.assertTrue(first[0] is second[0])
+        self.assertTrue(second[1][0] is second[0])
+
+
+    def test_many_lazy(self):
+        add_5 = make_adder(5)
+        brined = pickle_unpickle(brine_many([add_5, [add_5]]))
+
+        nadd, (nadd_b, ) = unbrine_many(brined, lazy=True)
+        self.assertEqual(type(nadd), LazyFunction)
+        self.assertTrue(nadd is nadd_b)
+        self.assertEqual(nadd(1), 6)
+
+
+class TestFunctionCache(unittest.TestCase):
+
+    def test_cached(self):
+        functions = LRUCache(8)
+
+        add_5 = unbrine(pickle_unpickle(brine(make_adder(5))),
+                        functions=functions)
+        again = unbrine_many(pickle_unpickle(brine_many([make_adder(5)])),
+                             functions=functions)[0]
+        add_6 = unbrine(pickle_unpickle(brine(make_adder(6))),
+                        functions=functions)
+
+        self.assertTrue(again is add_5)
+        self.assertEqual(add_5(1), 6)
+        self.assertEqual(add_6(1), 7)
+        self.assertEqual(functions.info().hits, 1)
+        self.assertEqual(functions.info().misses, 2)
+
+        # different globals are different functions
+        other = unbrine(brine(make_adder(5)), with_globals=dict(),
+                        functions=functions)
+        self.assertFalse(other is add_5)
+        self.assertTrue(other.func_globals is not add_5.func_globals)
+
+
+    def test_cached_lazy(self):
+        functions = LRUCache(8)
+        add_5 = unbrine(brine(make_adder(5)), functions=functions)
+        lazy = unbrine(brine(make_adder(5)), lazy=True, functions=functions)
+
+        self.assertEqual(type(lazy), LazyFunction)
+        self.assertEqual(lazy(1), 6)
+        self.assertTrue(lazy.resolve() is add_5)
+
+
+    def test_not_cached(self):
+        functions = LRUCache(8)
+
+        # functions holding mutable or unmarshalable values, or with
+        # a __dict__, are always recreated
+        getter, _setter = make_pair([])
+        tagged = make_adder(5)
+        tagged.tag = "tagged"
+        nested = make_adder(make_adder)
+
+        for func in (getter, tagged, nested):
+            first = unbrine(brine(func), functions=functions)
+            second = unbrine(brine(func), functions=functions)
+            self.assertFalse(first is second)
+
+        self.assertEqual(len(functions), 0)
+        self.assertEqual(unbrine(brine(tagged)).tag, "tagged")
+
+
+class TestMarshalCode(unittest.TestCase):
+
+    def setUp(self):
+        reg_code_pickler(use_marshal=True)
+
+
+    def tearDown(self):
+        reg_code_pickler()
+
+
+    def test_marshal_make_adder(self):
+        my_adder = unbrine(pickle_unpickle(brine(make_adder)))
+
+        add_8 = my_adder(8)
+        self.assertEqual(add_8(2), 10)
+
+
+    def test_marshal_code(self):
+        code = make_adder.func_code
+        ncode = pickle_unpickle(code)
+
+        self.assertEqual(code_unnew(code), code_unnew(ncode))
+
+
+    def test_marshal_mismatch(self):
+        buffer = StringIO()
+        Pickler(buffer).dump(make_adder.func_code)
+        buffer = StringIO(buffer.getvalue())
+
+        # pretend the blob came from some other interpreter
+        tag = brine_module._MARSHAL_TAG
+        brine_module._MARSHAL_TAG = ("BAD!", 0)
+        try:
+            self.assertRaises(UnpicklingError, Unpickler(buffer).load)
+        finally:
+            brine_module._MARSHAL_TAG = tag
+
+
+class TestBrinePickler(unittest.TestCase):
+
+    def test_pickler_other(self):
+        data_built = ( map, zip, globals )
+        data_types = ( type, tuple, int )
+        data_stuff = (501, 5.01, "Hello", set([1, 3, 5, 7]))
+        data = [data_built, data_types, data_stuff]
+
+        for proto in (0, 1, 2):
+            ndata = loads(dumps(data, proto))
+            self.assertEqual(data, ndata)
+
+
+    def test_pickler_function(self):
+        func_a = make_adder(8)
+
+        for proto in (0, 1, 2):
+            func_b = loads(dumps(func_a, proto))
+
+            self.assertEqual(func_a(), func_b())
+            self.assertEqual(func_a(5), func_b(5))
+
+
+    def test_pickler_importable(self):
+        # functions which can be found by name are saved by reference
+        self.assertTrue(loads(dumps(make_pair)) is make_pair)
+        self.assertTrue(loads(dumps(pickle_unpickle, 2)) is pickle_unpickle)
+
+
+    def test_pickler_make_adder(self):
+        my_adder = loads(dumps(make_adder))
+
+        add_8 = my_adder(8)
+        self.assertEqual(add_8(2), 10)
+
+
+    def test_pickler_pair(self):
+        getter, setter = make_pair("Tacos")
+
+        for proto in (0, 1, 2):
+            bgetter, bsetter = loads(dumps([getter, setter], proto))
+
+            # the duplicates share their own new closure cell
+            self.assertEqual(bgetter(), "Tacos")
+            bsetter("Hello World")
+            self.assertEqual(bgetter(), "Hello World")
+
+            self.assertEqual(getter(), "Tacos")
+
+
+    def test_pickler_cells(self):
+        getter, setter = make_pair("Tacos")
+        cells = getter.func_closure
+
+        for proto in (0, 1, 2):
+            # cells saved before or after their function are the same
+            # cells as the function's closure
+            ncells, ngetter = loads(dumps((cells, getter), proto))
+            self.assertTrue(ncells[0] is ngetter.func_closure[0])
+
+            ngetter, ncells = loads(dumps((getter, cells), proto))
+            self.assertTrue(ncells[0] is ngetter.func_closure[0])
+            self.assertEqual(cells_get_values(ncells), (["Tacos"], ))
+
+
+    def test_pickler_protocol(self):
+        # streams are binary unless asked otherwise, and functions are
+        # written as persistent ids rather than via the pure python
+        # pickler
+        ops = [op.name for op, _arg, _pos in genops(dumps(make_adder(8)))]
+        self.assertTrue("PROTO" in ops)
+        self.assertTrue("BINPERSID" in ops)
+
+
+    def test_pickler_recursive(self):
+        def make_fact():
+            def fact(x):
+                return 1 if x <= 1 else x * fact(x - 1)
+            return fact
+
+        fact = make_fact()
+        fact.tag = "fact"
+
+        for proto in (0, 1, 2):
+            nfact = loads(dumps(fact, proto))
+
+            self.assertEqual(nfact(5), 120)
+            self.assertEqual(nfact.tag, "fact")
+            self.assertNotEqual(fact, nfact)
+
+
+    def test_pickler_uniqueness(self):
+        add_8 = make_adder(8)
+        data = {"a": add_8, "b": [add_8]}
+
+        ndata = loads(dumps(data, 2))
+        self.assertTrue(ndata["a"] is ndata["b"][0])
+        self.assertEqual(ndata["a"](2), 10)
+
+
+    def test_pickler_method(self):
+        o = Obj("Tacos")
+
+        getter, setter = loads(dumps((o.get_value, o.set_value)))
+
+        self.assertEqual(getter(), "Tacos")
+        setter("Hello World")
+        self.assertEqual(getter(), "Hello World")
+        self.assertEqual(o.get_value(), "Tacos")
+
+
+    def test_pickler_partial(self):
+        add_x_y = lambda x, y=0: (x + y)
+        add_8 = partial(add_x_y, 8)
+        add_y_9 = partial(add_x_y, y=9)
+
+        for proto in (0, 1, 2):
+            new_add_8, new_add_y_9 = loads(dumps((add_8, add_y_9), proto))
+
+            self.assertEqual(type(new_add_8), partial)
+            self.assertEqual(new_add_8(10), 18)
+            self.assertEqual(new_add_y_9(1), 10)
+
+
+    def test_pickler_globals(self):
+        add_8_all = lambda l: map(lambda x: x + 8, l)
+
+        data = dumps(add_8_all)
+
+        new_add_8_all = loads(data)
+        self.assertEqual(new_add_8_all([1, 2]), [9, 10])
+
+        # with empty globals the map builtin isn't found
+        new_add_8_all = loads(data, {})
+        self.assertRaises(NameError, lambda: new_add_8_all([1, 2]))
+
+
 #
 # The end.
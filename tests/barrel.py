@@ -21,15 +21,22 @@ Unit tests for brine.barrel
 """
 
 
-from brine.barrel import Barrel
+from brine import LazyFunction, reg_container
+from brine.barrel import Barrel, BarrelGroup
+from brine.cache import LRUCache
+from collections import OrderedDict, defaultdict, deque
 from cStringIO import StringIO
 from functools import partial
 from pickle import Pickler, Unpickler
+from threading import Event, Thread
 
+import cPickle
+import sys
 import unittest
 
 
-from . import make_adder, make_pair, pickle_unpickle, Obj
+from . import make_adder, make_pair, pickle_unpickle, Obj, Box
+from . import make_equal_consts, make_const, EQUAL_CONSTS
 
 
 def make_incrementor(start=0, by=5):
@@ -50,6 +57,73 @@ def make_recursive_adder(by_i=0):
     return add_i
 
 
+class Bag(object):
+    # a sample custom container, whose mapper walks a transient copy
+    # of its items
+    def __init__(self, items):
+        self.items = items
+
+
+def map_bag(func, bag):
+    items = func(bag.items[:])
+    return Bag(items)
+
+
+reg_container(Bag, map_bag)
+
+
+class Gate(object):
+    # a sample custom container, whose mapper waits while its gate is
+    # closed, so that tests can pause a thread part way into a pass
+    def __init__(self, name, item):
+        self.name = name
+        self.item = item
+
+
+# the entered and opened events of each closed gate, by name
+gate_events = dict()
+
+
+def map_gate(func, gate):
+    events = gate_events.get(gate.name)
+    if events is not None:
+        entered, opened = events
+        entered.set()
+        opened.wait()
+    return Gate(gate.name, func(gate.item))
+
+
+reg_container(Gate, map_gate)
+
+
+def run_threads(count, work):
+    # call work(index) from count threads at once, switching between
+    # them as often as possible, and raise the first error any of
+    # them had
+    errors = []
+
+    def run(index):
+        try:
+            work(index)
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [Thread(target=run, args=(index,)) for index in xrange(count)]
+
+    interval = sys.getcheckinterval()
+    sys.setcheckinterval(1)
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setcheckinterval(interval)
+
+    if errors:
+        raise errors[0]
+
+
 class TestBarrel(unittest.TestCase):
 
     def test_anon_inner(self):
@@ -459,5 +533,678 @@ class TestBarrel(unittest.TestCase):
         self.assertNotEqual(new_ba["add_9"], new_ba["a8"])
 
 
+    def test_barrel_containers(self):
+        getter, setter = make_pair("A")
+
+        ba = Barrel()
+        ba["set"] = set([getter])
+        ba["deque"] = deque([getter, setter])
+        ba["ordered"] = OrderedDict([("getter", getter)])
+        ba["box"] = Box(setter)
+
+        new_ba = pickle_unpickle(ba)
+
+        ngetter = list(new_ba["set"])[0]
+        self.assertEqual(type(new_ba["deque"]), deque)
+        self.assertEqual(type(new_ba["ordered"]), OrderedDict)
+        self.assertTrue(new_ba["deque"][0] is ngetter)
+        self.assertTrue(new_ba["ordered"]["getter"] is ngetter)
+        self.assertTrue(new_ba["box"].item is new_ba["deque"][1])
+
+        new_ba["box"].item("B")
+        self.assertEqual(ngetter(), "B")
+        self.assertEqual(getter(), "A")
+
+
+    def test_barrel_defaultdict(self):
+        getter, setter = make_pair("A")
+
+        ba = Barrel()
+        ba["counts"] = defaultdict(lambda: 0, a=1)
+        ba["default"] = defaultdict(lambda: getter, setter=setter)
+
+        new_ba = pickle_unpickle(ba)
+
+        counts = new_ba["counts"]
+        self.assertEqual(type(counts), defaultdict)
+        self.assertEqual(counts["a"], 1)
+        self.assertEqual(counts["b"], 0)
+
+        default = new_ba["default"]
+        self.assertEqual(type(default), defaultdict)
+        ngetter = default["getter"]
+        default["setter"]("B")
+        self.assertEqual(ngetter(), "B")
+        self.assertEqual(getter(), "A")
+
+
+    def test_barrel_get_error(self):
+        # a KeyError while unbrining a value is not a missing key
+
+        class BrokenCache(LRUCache):
+            def get(self, key, default=None):
+                raise KeyError(key)
+
+        add_8 = make_adder(8)
+        new_ba = pickle_unpickle(Barrel(add_8=add_8))
+        new_ba.use_function_cache(BrokenCache())
+
+        self.assertTrue("add_8" in new_ba)
+        self.assertFalse("missing" in new_ba)
+        self.assertEqual(new_ba.get("missing", 5), 5)
+        self.assertRaises(KeyError, new_ba.get, "add_8")
+        self.assertTrue(new_ba._unbrined is None)
+
+
+    def test_barrel_lazy(self):
+        getter, setter = make_pair("A")
+        handlers = dict(("add_%i" % i, make_adder(i)) for i in xrange(100))
+
+        ba = Barrel(handlers, getter=getter, setter=setter)
+        new_ba = pickle_unpickle(ba)
+
+        # only the requested value is unbrined
+        ngetter = new_ba["getter"]
+        self.assertTrue(new_ba._unbrined is None)
+        self.assertEqual(len(new_ba._lazy), 1)
+        self.assertTrue(new_ba.get("getter") is ngetter)
+        self.assertEqual(new_ba.get("missing", 5), 5)
+        self.assertEqual(len(new_ba.keys()), 102)
+        self.assertEqual(new_ba["add_7"](1), 8)
+        self.assertEqual(len(new_ba._lazy), 2)
+
+        # values unbrined at different times still share their cells
+        nsetter = new_ba["setter"]
+        nsetter("B")
+        self.assertEqual(ngetter(), "B")
+        self.assertEqual(getter(), "A")
+
+        # and are kept when everything is unbrined
+        values = dict(new_ba.items())
+        self.assertTrue(new_ba._lazy is None)
+        self.assertTrue(values["getter"] is ngetter)
+        self.assertTrue(values["setter"] is nsetter)
+
+        # unbrining left the brined functions intact, so the barrel
+        # can be pickled again. The shared list was never copied, as
+        # it held no functions
+        newer_ba = pickle_unpickle(new_ba)
+        self.assertEqual(newer_ba["getter"](), "B")
+
+
+    def test_barrel_lazy_keys(self):
+        getter, setter = make_pair("A")
+
+        ba = Barrel({getter: "getter", (1, setter): "setter"})
+        new_ba = pickle_unpickle(ba)
+
+        keys = list(new_ba)
+        self.assertEqual(len(keys), 2)
+        self.assertTrue(new_ba._unbrined is None)
+
+        for key in keys:
+            if callable(key):
+                ngetter = key
+            else:
+                nsetter = key[1]
+
+        self.assertEqual(new_ba[ngetter], "getter")
+        self.assertEqual(new_ba[(1, nsetter)], "setter")
+
+        nsetter("B")
+        self.assertEqual(ngetter(), "B")
+
+
+    def test_barrel_dirty(self):
+        getter, setter = make_pair("A")
+        handlers = dict(("add_%i" % i, make_adder(i)) for i in xrange(100))
+
+        ba = Barrel(handlers, getter=getter)
+        brined = ba.__getstate__()[3]
+        add_5 = brined["add_5"]
+        entries = len(ba.__getstate__()[2])
+
+        ba["setter"] = setter
+        ba["also"] = [getter]
+        del ba["add_6"]
+        ba.update({"add_7": make_adder(70)})
+
+        # only the changed keys were brined again, and added to the
+        # table of wrappers
+        state = ba.__getstate__()
+        brined = state[3]
+        self.assertTrue(brined["add_5"] is add_5)
+        self.assertEqual(brined["also"][0], brined["getter"])
+        self.assertFalse("add_6" in brined)
+        self.assertEqual(len(state[2]), entries + 2)
+
+        new_ba = pickle_unpickle(ba)
+        self.assertEqual(len(new_ba.keys()), 102)
+        self.assertEqual(new_ba["add_7"](1), 71)
+        self.assertTrue(new_ba["also"][0] is new_ba["getter"])
+
+        new_ba["setter"]("B")
+        self.assertEqual(new_ba["getter"](), "B")
+        self.assertEqual(getter(), "A")
+
+
+    def test_barrel_dirty_loaded(self):
+        getter, setter = make_pair("A")
+
+        ba = Barrel(getter=getter)
+        new_ba = pickle_unpickle(ba)
+
+        # values unbrined from the barrel keep their wrappers when
+        # set again under another key
+        ngetter = new_ba["getter"]
+        new_ba["again"] = (ngetter, )
+        state = new_ba.__getstate__()
+        self.assertEqual(len(state[2]), 1)
+        self.assertEqual(state[3]["again"][0], state[3]["getter"])
+
+        newer_ba = pickle_unpickle(new_ba)
+        self.assertTrue(newer_ba["again"][0] is newer_ba["getter"])
+
+
+    def test_barrel_dirty_shared(self):
+        shared = [make_adder(1)]
+
+        ba = Barrel(a=shared)
+        pickle_unpickle(ba)
+
+        # a container brined before is shared with the dirty keys
+        # which refer to it, as it would be by a full brining
+        ba["b"] = shared
+        ba["c"] = {"shared": shared}
+        new_ba = pickle_unpickle(ba)
+        self.assertTrue(new_ba["a"] is new_ba["b"])
+        self.assertTrue(new_ba["c"]["shared"] is new_ba["a"])
+        self.assertEqual(new_ba["b"][0](1), 2)
+
+        # and is brined as it is now when set again
+        shared.append(make_adder(2))
+        ba["b"] = shared
+        new_ba = pickle_unpickle(ba)
+        self.assertEqual(len(new_ba["b"]), 2)
+        self.assertTrue(new_ba["a"] is new_ba["b"])
+        self.assertEqual(new_ba["b"][1](1), 3)
+
+
+    def test_barrel_dirty_changed(self):
+        fives = make_incrementor(0, 5)
+        fives.tag = 1
+        ba = Barrel(a=fives, b=[fives])
+        pickle_unpickle(ba)
+
+        # a function changed since it was brined isn't given its old
+        # wrapper when set again
+        fives.tag = 2
+        ba["a"] = fives
+        new_ba = pickle_unpickle(ba)
+        self.assertEqual(new_ba["a"].tag, 2)
+        self.assertTrue(new_ba["b"][0] is new_ba["a"])
+
+        # nor is one unbrined from the barrel
+        nfives = new_ba["a"]
+        nfives.i = 10
+        new_ba["c"] = nfives
+        newer_ba = pickle_unpickle(new_ba)
+        self.assertEqual(newer_ba["c"](), 10)
+        self.assertTrue(newer_ba["a"] is newer_ba["c"])
+
+        # a container changed since it was brined is brined as it is
+        # now when set again
+        adders = [make_adder(1)]
+        ba = Barrel(a=adders)
+        pickle_unpickle(ba)
+        adders.append(make_adder(2))
+        ba["a"] = adders
+        new_ba = pickle_unpickle(ba)
+        self.assertEqual([add(1) for add in new_ba["a"]], [2, 3])
+
+
+    def test_barrel_dirty_growth(self):
+        handlers = dict(("add_%i" % i, make_adder(i)) for i in xrange(100))
+        ba = Barrel(handlers)
+        size = len(cPickle.dumps(ba, cPickle.HIGHEST_PROTOCOL))
+
+        # replacing a key over and over leaves unused table entries,
+        # until the barrel is brined again as a whole
+        for by_x in xrange(1000):
+            ba["add_0"] = make_adder(by_x)
+            state = ba.__getstate__()
+            self.assertTrue(len(state[2]) <= 300)
+
+        data = cPickle.dumps(ba, cPickle.HIGHEST_PROTOCOL)
+        self.assertTrue(len(data) < size * 3)
+
+        # as does a loaded barrel
+        new_ba = cPickle.loads(data)
+        for by_x in xrange(1000):
+            new_ba["add_1"] = make_adder(by_x)
+            self.assertTrue(len(new_ba.__getstate__()[2]) <= 300)
+
+        self.assertEqual(new_ba["add_0"](1), 1000)
+        self.assertEqual(new_ba["add_1"](1), 1000)
+        self.assertEqual(new_ba["add_2"](1), 3)
+
+
+    def test_barrel_proxies(self):
+        getter, setter = make_pair("A")
+        fives = make_incrementor(0, 5)
+        add_3 = make_recursive_adder(3)
+
+        ba = Barrel(getter=getter, setter=setter, fives=fives, add_3=add_3,
+                    both=[getter, setter])
+        new_ba = pickle_unpickle(ba)
+        new_ba.use_proxies()
+
+        ngetter = new_ba["getter"]
+        nsetter = new_ba["setter"]
+        self.assertEqual(type(ngetter), LazyFunction)
+        self.assertFalse(ngetter.is_resolved())
+        self.assertTrue(new_ba["both"][0] is ngetter)
+
+        nsetter("B")
+        self.assertTrue(nsetter.is_resolved())
+        self.assertFalse(ngetter.is_resolved())
+        self.assertEqual(ngetter(), "B")
+        self.assertEqual(getter(), "A")
+
+        # attributes are forwarded to the function
+        nfives = new_ba["fives"]
+        self.assertEqual(nfives.i, 0)
+        self.assertEqual(nfives(), 0)
+        self.assertEqual(nfives.i, 5)
+
+        self.assertEqual(new_ba["add_3"](4), 7)
+
+        # the values unbrined all at once are the same proxies
+        self.assertTrue(dict(new_ba.items())["getter"] is ngetter)
+
+        # proxies are brined as their original wrappers
+        new_ba["again"] = ngetter
+        newer_ba = pickle_unpickle(new_ba)
+        self.assertTrue(newer_ba["again"] is newer_ba["getter"])
+        self.assertEqual(newer_ba["getter"](), "B")
+
+
+    def test_barrel_function_cache(self):
+        functions = LRUCache(8)
+        getter, _setter = make_pair("A")
+
+        loaded = []
+        for proxies in (False, False, True):
+            ba = Barrel(add_5=make_adder(5), getter=getter)
+            new_ba = pickle_unpickle(ba)
+            new_ba.use_proxies(proxies)
+            new_ba.use_function_cache(functions)
+            loaded.append(new_ba)
+
+        first, second, lazy = loaded
+        self.assertTrue(second["add_5"] is first["add_5"])
+        self.assertEqual(lazy["add_5"](1), 6)
+        self.assertTrue(lazy["add_5"].resolve() is first["add_5"])
+
+        # the getter's closure refers to another function, so it is
+        # always recreated
+        self.assertFalse(second["getter"] is first["getter"])
+        self.assertEqual(second["getter"](), "A")
+        self.assertEqual(functions.info().hits, 2)
+
+
+    def test_barrel_transient(self):
+        # each bag's transient list is cached during the pass. If that
+        # list were freed, the next bag's list could reuse its id and
+        # be mistaken for it
+        ba = Barrel()
+        ba["bags"] = [Bag([make_adder(i), i]) for i in xrange(200)]
+
+        new_ba = pickle_unpickle(ba)
+        for index, bag in enumerate(new_ba["bags"]):
+            self.assertEqual(bag.items[1], index)
+            self.assertEqual(bag.items[0](1), index + 1)
+
+
+    def test_barrel_seal(self):
+        getter, setter = make_pair("A")
+
+        ba = Barrel()
+        ba["getter"] = getter
+        ba["setter"] = setter
+        ba["adders"] = [make_adder(index) for index in xrange(10)]
+
+        data = ba.seal()
+        self.assertTrue(ba.is_sealed())
+        self.assertTrue(ba.seal() is data)
+
+        # pickling a sealed barrel just writes its bytes
+        self.assertTrue(data in cPickle.dumps([ba, ba], 2))
+        self.assertEqual(cPickle.loads(cPickle.dumps(ba, 0)).seal(), data)
+
+        self.assertRaises(TypeError, ba.__setitem__, "getter", None)
+        self.assertRaises(TypeError, ba.__delitem__, "getter")
+        self.assertRaises(TypeError, ba.update, {"getter": None})
+        self.assertRaises(TypeError, ba.clear)
+        self.assertTrue(ba["getter"] is getter)
+
+        new_ba = Barrel.from_bytes(data)
+        self.assertTrue(new_ba.is_sealed())
+        self.assertTrue(new_ba.seal() is data)
+        self.assertEqual(new_ba["adders"][4](1), 5)
+        new_ba["setter"]("B")
+        self.assertEqual(new_ba["getter"](), "B")
+
+        new_bas = pickle_unpickle([ba, ba])
+        self.assertTrue(new_bas[0].is_sealed())
+        self.assertTrue(new_bas[0] is new_bas[1])
+        self.assertEqual(new_bas[1]["getter"](), "A")
+
+        self.assertRaises(TypeError, Barrel.from_bytes,
+                          cPickle.dumps(["not", "a", "barrel"]))
+
+
+    def test_barrel_unseal(self):
+        ba = Barrel()
+        ba["adder"] = make_adder(1)
+        data = ba.seal()
+
+        ba.unseal()
+        self.assertFalse(ba.is_sealed())
+        ba["adder"] = make_adder(2)
+
+        new_data = ba.seal()
+        self.assertNotEqual(new_data, data)
+        self.assertEqual(Barrel.from_bytes(data)["adder"](1), 2)
+        self.assertEqual(Barrel.from_bytes(new_data)["adder"](1), 3)
+
+        new_ba = Barrel.from_bytes(new_data)
+        new_ba.unseal()
+        new_ba["adder"] = make_adder(3)
+        self.assertEqual(pickle_unpickle(new_ba)["adder"](1), 4)
+
+
+    def test_barrel_threads_pickle(self):
+        ba = Barrel()
+        for index in xrange(50):
+            ba[index] = make_adder(index)
+        cPickle.dumps(ba, 2)
+
+        dumped = []
+
+        def work(index):
+            for count in xrange(10):
+                if index == 0:
+                    # one thread keeps modifying the barrel while the
+                    # others pickle it
+                    ba[50 + count] = make_adder(50 + count)
+                    del ba[count]
+                else:
+                    dumped.append(cPickle.dumps(ba, 2))
+
+        run_threads(4, work)
+        dumped.append(cPickle.dumps(ba, 2))
+
+        for data in dumped:
+            new_ba = cPickle.loads(data)
+            for key, func in new_ba.iteritems():
+                self.assertEqual(func(1), key + 1)
+
+        self.assertEqual(sorted(new_ba.keys()), range(10, 60))
+
+
+    def test_barrel_threads_overlap(self):
+        ba = Barrel()
+        ba["a"] = Gate("a", make_adder(1))
+        ba["b"] = Gate("b", make_adder(2))
+        new_ba = pickle_unpickle(ba)
+
+        found = dict()
+        errors = []
+        events = dict((name, (Event(), Event())) for name in "ab")
+
+        def get(name):
+            try:
+                found[name] = new_ba[name]
+            except Exception as exc:
+                errors.append(exc)
+
+        thread_a = Thread(target=get, args=("a",))
+        thread_b = Thread(target=get, args=("b",))
+
+        gate_events.update(events)
+        try:
+            # pause a pass for "a" part way through, and then start a
+            # pass for "b", which should wait until "a" is done rather
+            # than interleave with it
+            thread_a.start()
+            events["a"][0].wait()
+            thread_b.start()
+            events["b"][0].wait(0.1)
+
+            events["a"][1].set()
+            thread_a.join()
+            events["b"][1].set()
+            thread_b.join()
+
+        finally:
+            for name, (_entered, opened) in events.items():
+                gate_events.pop(name, None)
+                opened.set()
+
+        if errors:
+            raise errors[0]
+
+        self.assertEqual(found["a"].item(1), 2)
+        self.assertEqual(found["b"].item(1), 3)
+
+
+    def test_barrel_threads_lazy(self):
+        getter, setter = make_pair("A")
+
+        ba = Barrel()
+        for index in xrange(50):
+            ba[index] = (make_adder(index), getter, setter)
+
+        new_ba = pickle_unpickle(ba)
+        new_ba.use_proxies()
+
+        found = [None] * 50
+
+        def work(index):
+            for key in xrange(index, 50, 5):
+                adder, _getter, _setter = new_ba[key]
+                found[key] = (adder(1), _getter, _setter)
+
+        run_threads(5, work)
+
+        # every thread shares the same proxies, each of which was only
+        # resolved once
+        new_getter, new_setter = found[0][1:]
+        for key, (value, _getter, _setter) in enumerate(found):
+            self.assertEqual(value, key + 1)
+            self.assertTrue(_getter is new_getter)
+            self.assertTrue(_setter is new_setter)
+
+        run_threads(5, lambda index: new_getter.resolve())
+        new_setter("B")
+        self.assertEqual(new_getter(), "B")
+
+
+    def test_barrel_tables(self):
+        getter, setter = make_pair("A")
+        add_3 = make_adder(3)
+        handlers = dict(("add_%i" % i, make_adder(i)) for i in xrange(100))
+
+        ba = Barrel(handlers, getter=getter, setter=setter,
+                    partial=partial(add_3, 4), method=Obj(5).get_value)
+
+        _format, codes, entries, data = ba.__getstate__()
+
+        # the adders all share one code object, the method refers to
+        # its function by name, and every wrapper is in the table once
+        self.assertEqual(len(codes), 3)
+        self.assertEqual(len(entries), 105)
+
+        new_ba = pickle_unpickle(ba)
+
+        # wrappers are only recreated when needed
+        self.assertEqual(new_ba._wrappers, [None] * 105)
+        self.assertEqual(new_ba["add_7"](1), 8)
+        self.assertEqual(len(filter(None, new_ba._wrappers)), 1)
+
+        self.assertEqual(new_ba["partial"](), 7)
+        self.assertEqual(new_ba["method"](), 5)
+        new_ba["setter"]("B")
+        self.assertEqual(new_ba["getter"](), "B")
+
+        for wrapper in filter(None, new_ba._wrappers):
+            self.assertFalse(hasattr(wrapper, "__dict__"))
+
+        # an unchanged loaded barrel gives back the state it loaded
+        self.assertTrue(new_ba.__getstate__()[2] is new_ba._entries)
+
+
+    def test_barrel_equal_code(self):
+        # code which is equal but not identical isn't shared
+        ba = Barrel(enumerate(make_equal_consts()))
+        new_ba = pickle_unpickle(ba)
+        got = [new_ba[index]() for index in xrange(len(EQUAL_CONSTS))]
+        self.assertEqual(map(type, got), map(type, EQUAL_CONSTS))
+        self.assertEqual(got, EQUAL_CONSTS)
+
+        # code with unhashable or unmarshalable consts still works,
+        # and the latter is written without sharing
+        obj = Obj(5)
+        ba = Barrel(first=make_const(obj), second=make_const(obj),
+                    listed=make_const([1, 2]))
+        self.assertEqual(len(ba.__getstate__()[1]), 3)
+        new_ba = pickle_unpickle(ba)
+        self.assertEqual(new_ba["first"]().get_value(), 5)
+        self.assertEqual(new_ba["listed"](), [1, 2])
+
+        new_ba["third"] = make_const([3])
+        new_ba["fourth"] = make_const(obj)
+        newer_ba = pickle_unpickle(new_ba)
+        self.assertEqual(newer_ba["third"](), [3])
+        self.assertEqual(newer_ba["fourth"]().get_value(), 5)
+
+
+    def test_barrel_deep(self):
+        def chain_of(count):
+            func = lambda: 0
+            for _i in xrange(count):
+                func = (lambda inner: lambda: inner() + 1)(func)
+            return func
+
+        data = [chain_of(5)]
+        for _i in xrange(10000):
+            data = [data]
+
+        deep = chain_of(5000)
+
+        ba = Barrel()
+        ba["data"] = data
+        ba["deep"] = deep
+
+        ba.reset()
+
+        found = ba["data"]
+        for _i in xrange(10000):
+            found = found[0]
+        self.assertEqual(found[0](), 5)
+
+        # the deep chain is rebuilt without recursion, but calling it
+        # would not be, so just walk its closures
+        func = ba["deep"]
+        self.assertFalse(func is deep)
+        depth = 0
+        while func.func_closure:
+            func = func.func_closure[0].cell_contents
+            depth += 1
+        self.assertEqual(depth, 5000)
+
+
+class TestBarrelGroup(unittest.TestCase):
+
+    def test_group_shared(self):
+        getter, setter = make_pair("A")
+        adder = make_adder(5)
+
+        ba_a = Barrel(getter=getter, adder=adder)
+        ba_b = Barrel(setter=setter, adders=[adder, make_adder(6)])
+
+        group = BarrelGroup(a=ba_a, b=ba_b, empty=Barrel())
+        data = cPickle.dumps(group, 2)
+
+        # separately, the barrels each have their own copy of the
+        # shared function and code
+        self.assertTrue(len(data) < len(cPickle.dumps([ba_a, ba_b], 2)))
+
+        new_group = cPickle.loads(data)
+        self.assertEqual(sorted(new_group.keys()), ["a", "b", "empty"])
+        new_a, new_b = new_group["a"], new_group["b"]
+        self.assertTrue(new_group["a"] is new_a)
+        self.assertEqual(list(new_group["empty"]), [])
+
+        self.assertTrue(new_a["adder"] is new_b["adders"][0])
+        self.assertEqual(new_b["adders"][1](1), 7)
+        new_b["setter"]("B")
+        self.assertEqual(new_a["getter"](), "B")
+        self.assertEqual(getter(), "A")
+
+        state = new_group.__getstate__()
+        _format, codes, entries, brined = state[1].__getstate__()
+        self.assertEqual(len(codes), 3)
+        self.assertEqual(len(entries), 4)
+
+
+    def test_group_changes(self):
+        ba_a = Barrel(adder=make_adder(1))
+        ba_b = Barrel(adder=make_adder(2), other=make_adder(3))
+
+        group = BarrelGroup([("a", ba_a), ("b", ba_b)])
+        new_group = pickle_unpickle(group)
+        self.assertEqual(new_group["b"]["other"](1), 4)
+
+        # changes to the barrels are picked up when the group is
+        # pickled again
+        ba_a["adder"] = make_adder(10)
+        del ba_b["other"]
+        ba_c = Barrel(adder=ba_a["adder"])
+        group["c"] = ba_c
+
+        new_group = pickle_unpickle(group)
+        self.assertEqual(sorted(new_group.keys()), ["a", "b", "c"])
+        self.assertEqual(new_group["a"]["adder"](1), 11)
+        self.assertEqual(new_group["b"].keys(), ["adder"])
+        self.assertTrue(new_group["c"]["adder"] is new_group["a"]["adder"])
+
+        # a loaded group may be pickled again, whether or not its
+        # barrels have been gotten
+        del new_group["b"]
+        new_group["a"]["more"] = make_adder(20)
+        newer_group = pickle_unpickle(new_group)
+        self.assertEqual(sorted(newer_group.keys()), ["a", "c"])
+        self.assertEqual(newer_group["a"]["more"](1), 21)
+        self.assertEqual(newer_group["c"]["adder"](1), 11)
+
+        self.assertRaises(TypeError, group.__setitem__, "d", {})
+
+
+    def test_group_function_cache(self):
+        functions = LRUCache(8)
+        group = BarrelGroup(a=Barrel(adder=make_adder(1)))
+
+        loaded = []
+        for _i in xrange(2):
+            new_group = pickle_unpickle(group)
+            new_group.use_function_cache(functions)
+            loaded.append(new_group["a"]["adder"])
+
+        self.assertTrue(loaded[0] is loaded[1])
+        self.assertEqual(loaded[0](1), 2)
+
+
 #
 # The end.
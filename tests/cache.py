@@ -0,0 +1,216 @@
+# This library is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""
+Unit tests for brine.cache
+
+:author: Christopher O'Brien  <obriencj@gmail.com>
+:license: LGPL v.3
+"""
+
+
+from brine import brine, unbrine, code_interns
+from brine.cache import IdentityMap, LRUCache
+
+import gc
+import unittest
+import weakref
+
+from . import make_adder, pickle_unpickle, Obj
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_eviction(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+
+        # touching a makes b the least recently used
+        self.assertEqual(cache.get("a"), 1)
+        cache.put("c", 3)
+
+        self.assertEqual(len(cache), 2)
+        self.assertTrue("a" in cache)
+        self.assertFalse("b" in cache)
+        self.assertTrue("c" in cache)
+
+
+    def test_info(self):
+        cache = LRUCache(4)
+        cache.put("a", 1)
+
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("b", 100), 100)
+
+        info = cache.info()
+        self.assertEqual(info.hits, 1)
+        self.assertEqual(info.misses, 1)
+        self.assertEqual(info.maxsize, 4)
+        self.assertEqual(info.currsize, 1)
+
+        cache.clear()
+        self.assertEqual(tuple(cache.info()), (0, 0, 4, 0))
+
+
+    def test_resize(self):
+        cache = LRUCache(None)
+        for i in xrange(10):
+            cache.put(i, i)
+        self.assertEqual(len(cache), 10)
+
+        cache.resize(3)
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.get(9), 9)
+        self.assertEqual(cache.get(0), None)
+
+        cache.resize(0)
+        cache.put("a", 1)
+        self.assertEqual(len(cache), 0)
+
+
+class TestIdentityMap(unittest.TestCase):
+
+    def test_identity(self):
+        idmap = IdentityMap()
+
+        key_a = [1, 2]
+        key_b = [1, 2]
+        idmap.put(key_a, "a")
+        idmap.put(key_b, "b")
+
+        self.assertEqual(len(idmap), 2)
+        self.assertTrue(key_a in idmap)
+        self.assertFalse([1, 2] in idmap)
+        self.assertEqual(idmap.get(key_a), "a")
+        self.assertEqual(idmap.get(key_b), "b")
+        self.assertEqual(idmap.get([1, 2]), None)
+        self.assertEqual(idmap.get([1, 2], "c"), "c")
+
+        idmap.put(key_a, "c")
+        self.assertEqual(len(idmap), 2)
+        self.assertEqual(idmap.get(key_a), "c")
+
+
+    def test_iter(self):
+        idmap = IdentityMap()
+
+        keys = [[1], [1], (2, )]
+        for key in keys:
+            idmap.put(key, len(key))
+        idmap.put(keys[0], None)
+
+        # each object once, in the order it was first put
+        found = list(idmap)
+        self.assertEqual(len(found), 3)
+        self.assertTrue(all(a is b for a, b in zip(found, keys)))
+
+        idmap.clear()
+        self.assertEqual(list(idmap), [])
+
+
+    def test_pinned(self):
+        idmap = IdentityMap()
+
+        key = Obj(1)
+        ref = weakref.ref(key)
+        idmap.put(key, "a")
+        idmap.put(key, "b")
+
+        del key
+        self.assertTrue(ref() is not None)
+
+        idmap.clear()
+        self.assertEqual(len(idmap), 0)
+        self.assertTrue(ref() is None)
+
+
+    def test_cycle(self):
+        idmap = IdentityMap()
+
+        key = Obj(idmap)
+        ref = weakref.ref(key)
+        idmap.put(key, key)
+
+        del idmap, key
+        gc.collect()
+        self.assertTrue(ref() is None)
+
+
+class TestCodeInterns(unittest.TestCase):
+
+    def setUp(self):
+        code_interns.clear()
+
+
+    def test_intern_brined(self):
+        data = pickle_unpickle(brine(make_adder(8)))
+
+        func_a = unbrine(data)
+        func_b = unbrine(data)
+
+        self.assertFalse(func_a is func_b)
+        self.assertTrue(func_a.func_code is func_b.func_code)
+        self.assertEqual(func_b(2), 10)
+        self.assertEqual(code_interns.info().hits, 1)
+
+
+    def test_intern_unpickled(self):
+        code = make_adder.func_code
+
+        code_a = pickle_unpickle(code)
+        code_b = pickle_unpickle(code)
+
+        self.assertFalse(code is code_a)
+        self.assertTrue(code_a is code_b)
+
+
+    def test_intern_distinct(self):
+        # these compare as equal, but must not share code
+        code_a = pickle_unpickle(compile("1", "<test>", "eval"))
+        code_b = pickle_unpickle(compile("1.0", "<test>", "eval"))
+
+        self.assertFalse(code_a is code_b)
+        self.assertEqual(type(eval(code_b)), float)
+
+
+    def test_intern_unbounded(self):
+        code = make_adder.func_code
+
+        code_interns.resize(None)
+        try:
+            code_a = pickle_unpickle(code)
+            code_b = pickle_unpickle(code)
+        finally:
+            code_interns.resize(1024)
+
+        self.assertTrue(code_a is code_b)
+
+
+    def test_intern_disabled(self):
+        code = make_adder.func_code
+
+        code_interns.resize(0)
+        try:
+            code_a = pickle_unpickle(code)
+            code_b = pickle_unpickle(code)
+        finally:
+            code_interns.resize(1024)
+
+        self.assertFalse(code_a is code_b)
+
+
+#
+# The end.
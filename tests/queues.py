@@ -22,14 +22,28 @@ Unit tests for brine.queues
 
 
 from abc import ABCMeta, abstractmethod
+from brine import BrineMemo
+from brine.barrel import Barrel
+from brine.cache import LRUCache
 from brine.queues import *
+from brine.queues import _CodeChannel, _brine_batch
+from cStringIO import StringIO
 from functools import partial
-from multiprocessing import Process
-from pickle import Pickler, Unpickler
+from Queue import Empty
+from multiprocessing import Array, Process, Queue
+from os import urandom
+from threading import current_thread, Thread
+from time import sleep
+from traceback import extract_tb
+from pickle import Pickler, Unpickler, UnpicklingError
 
 from unittest import TestCase
 
+import cPickle
+import sys
+
 from . import make_adder, make_pair, pickle_unpickle, Obj
+from . import make_const, make_equal_consts, EQUAL_CONSTS
 from .barrel import make_incrementor, make_recursive_adder
 
 
@@ -99,12 +113,15 @@ class MultiprocessHarness(object):
     def tearDown(self):
         self.tasks.put(False)
 
+        # the sentinel must be flushed to the pipe by the feeder
+        # thread before the worker goes away
+        if hasattr(self.tasks, "close"):
+            self.tasks.close()
+            self.tasks.join_thread()
+
         self.process.terminate()
         self.process.join()
         self.process = None
-
-        if hasattr(self.tasks, "close"):
-            self.tasks.close()
         self.tasks = None
 
         if hasattr(self.results, "close"):
@@ -147,13 +164,106 @@ class CommonTests(object):
         self.assertEqual(col, 18)
 
 
+    def test_remote_many(self):
+        adders = [make_adder(by_x) for by_x in xrange(4)]
+        self.tasks.put_many((add, (1, ), {}) for add in adders)
+        self.tasks.put_many([(partial(adders[0], 5), (), {})])
+
+        results = [self.results.get() for _i in xrange(5)]
+        self.assertEqual(results, [(True, 1), (True, 2), (True, 3),
+                                   (True, 4), (True, 5)])
+
+
+    def test_put_many(self):
+        queue = self.create_queue()
+        add = make_adder(8)
+
+        queue.put_many([add, partial(add, 2), 3])
+        queue.put_many([])
+        queue.put(4)
+
+        got_add = queue.get()
+        got_part = queue.get()
+        self.assertEqual(got_add(1), 9)
+        self.assertTrue(got_part.func is got_add)
+        self.assertEqual(queue.get(), 3)
+        self.assertEqual(queue.get(), 4)
+
+
+    def test_get_many(self):
+        queue = self.create_queue()
+        queue.put_many(xrange(3))
+        queue.put(3)
+        queue.put_many(xrange(4, 7))
+
+        got = queue.get_many(2)
+        self.assertEqual(got, [0, 1])
+        while len(got) < 7:
+            got.extend(queue.get_many(3, 5))
+        self.assertEqual(got, range(7))
+
+        self.assertRaises(Empty, queue.get_many, 1, 0.01)
+        self.assertRaises(ValueError, queue.get_many, 0)
+
+
 class TestBrinedQueue(MultiprocessHarness, CommonTests, TestCase):
 
     def create_queue(self):
         return BrinedQueue()
 
 
-class TestBrinedJoinableQueue(TestBrinedQueue):
+class TestBrinedQueueMemo(TestBrinedQueue):
+
+    def create_queue(self):
+        queue = BrinedQueue()
+        queue.brine_memo = BrineMemo()
+        return queue
+
+
+    def test_memo_resend(self):
+        add_8 = make_adder(8)
+        for by_y in xrange(5):
+            self.assertEqual(self.remote(add_8, by_y), 8 + by_y)
+        self.assertTrue(add_8 in self.tasks.brine_memo)
+
+
+class TestBrinedQueueCodeTable(TestBrinedQueue):
+
+    def create_queue(self):
+        queue = BrinedQueue()
+        queue.code_table = True
+        return queue
+
+
+    def test_code_resend(self):
+        for by_x in xrange(5):
+            self.assertEqual(self.remote(make_adder(by_x), 1), by_x + 1)
+            self.assertEqual(self.remote(partial(make_adder(by_x), 2)),
+                             by_x + 2)
+
+
+class TestBrinedSimpleQueueCodeTable(TestBrinedQueueCodeTable):
+
+    def create_queue(self):
+        queue = BrinedSimpleQueue()
+        queue.code_table = True
+        return queue
+
+
+class JoinableTests(object):
+
+    def test_task_done_many(self):
+        queue = self.create_queue()
+        queue.put_many(xrange(3))
+
+        self.assertEqual(queue.get_many(3, 5), [0, 1, 2])
+        for _i in xrange(3):
+            queue.task_done()
+        self.assertRaises(ValueError, queue.task_done)
+        queue.join()
+
+
+class TestBrinedJoinableQueue(JoinableTests, TestBrinedQueue):
 
     def create_queue(self):
         return BrinedJoinableQueue()
@@ -197,7 +307,604 @@ class TestBarreledQueue(MultiprocessHarness, CommonTests, TestCase):
         self.assertEqual(col, 18)
 
 
-class TestBarreledJoinableQueue(TestBarreledQueue):
+class TestBarreledQueueCodeTable(TestBarreledQueue):
+
+    def create_queue(self):
+        queue = BarreledQueue()
+        queue.code_table = True
+        return queue
+
+
+    def test_code_resend(self):
+        for by_x in xrange(5):
+            self.assertEqual(self.remote(make_adder(by_x), 1), by_x + 1)
+
+
+class TestBarreledSimpleQueueCodeTable(TestBarreledQueueCodeTable):
+
+    def create_queue(self):
+        queue = BarreledSimpleQueue()
+        queue.code_table = True
+        return queue
+
+
+class ThreadMemo(BrineMemo):
+    """
+    A BrineMemo which records the threads which brine functions
+    """
+
+    def __init__(self):
+        super(ThreadMemo, self).__init__()
+        self.threads = []
+
+
+    def wrap(self, function):
+        self.threads.append(current_thread())
+        return super(ThreadMemo, self).wrap(function)
+
+
+def make_unbound():
+    # a function with an empty cell in its closure, which can't be
+    # brined
+    def unbound():
+        return value
+    return unbound
+    value = None
+
+
+class TestQueueFeeder(TestCase):
+
+    def check_brined_by(self, queue, by_feeder):
+        queue.brine_memo = ThreadMemo()
+        queue.put(make_adder(8))
+        queue.put_many([make_adder(1), make_adder(2)])
+
+        self.assertEqual(queue.get()(1), 9)
+        self.assertEqual([add(1) for add in queue.get_many(2, 5)], [2, 3])
+
+        threads = queue.brine_memo.threads
+        self.assertEqual(len(threads), 3)
+        for thread in threads:
+            self.assertEqual(thread is current_thread(), not by_feeder)
+
+
+    def test_brined_feeder(self):
+        self.check_brined_by(BrinedQueue(), True)
+        self.check_brined_by(BrinedJoinableQueue(), True)
+
+        queue = BrinedQueue()
+        queue.code_table = True
+        self.check_brined_by(queue, True)
+
+
+    def test_brined_snapshot(self):
+        queue = BrinedQueue()
+        queue.snapshot = True
+        self.check_brined_by(queue, False)
+
+        queue = BrinedQueue()
+        queue.snapshot = True
+        queue.code_table = True
+        self.check_brined_by(queue, False)
+
+
+    def test_barreled_snapshot(self):
+        for code_table in (False, True):
+            queue = BarreledQueue()
+            queue.snapshot = True
+            queue.code_table = code_table
+
+            data = [make_adder(8)]
+            queue.put(data)
+            queue.put_many([data, data])
+            data.append(None)
+
+            got = queue.get()
+            self.assertEqual(len(got), 1)
+            self.assertEqual(got[0](1), 9)
+
+            first, second = queue.get_many(2, 5)
+            self.assertEqual(len(first), 1)
+            self.assertTrue(first is second)
+
+
+    def test_feeder_failed(self):
+        # a value which the feeder thread can't brine is dropped, but
+        # doesn't hold its slot in the queue or leave its tasks undone
+        for queue in (BrinedJoinableQueue(1), BarreledJoinableQueue(1)):
+            stderr = sys.stderr
+            sys.stderr = StringIO()
+            try:
+                queue.put(make_unbound())
+                queue.put(1, timeout=5)
+                self.assertEqual(queue.get(timeout=5), 1)
+                queue.task_done()
+
+                queue.put_many([2, make_unbound()], timeout=5)
+                queue.put(3, timeout=5)
+                self.assertEqual(queue.get(timeout=5), 3)
+                queue.task_done()
+            finally:
+                sys.stderr = stderr
+
+            joiner = Thread(target=queue.join)
+            joiner.daemon = True
+            joiner.start()
+            joiner.join(5)
+            self.assertFalse(joiner.is_alive())
+
+
+    def test_feeder_after_snapshot(self):
+        # the feeder started while snapshot was set still packs values
+        # which were put after it was cleared
+        queue = BarreledQueue()
+        queue.snapshot = True
+        queue.put(make_adder(1))
+        queue.snapshot = False
+        queue.put(make_adder(2))
+
+        self.assertEqual(queue.get()(1), 2)
+        self.assertEqual(queue.get()(1), 3)
+
+
+def fail_unpickle(message):
+    raise ValueError(message)
+
+
+class Unpicklable(object):
+    """
+    Pickles fine, but raises ValueError when unpickled
+    """
+
+    def __reduce__(self):
+        return (fail_unpickle, ("unpicklable", ))
+
+
+class TestQueuePrefetch(TestCase):
+
+    def check_prefetch(self, queue):
+        queue.prefetch = 2
+
+        adders = [make_adder(by_x) for by_x in xrange(6)]
+        queue.put(adders[0])
+        queue.put_many(adders[1:4])
+        queue.put(Unpicklable())
+        queue.put_many(adders[4:])
+
+        self.assertEqual(queue.get()(1), 1)
+        got = queue.get_many(2)
+        self.assertEqual([add(1) for add in got], [2, 3])
+        self.assertEqual(queue.get()(1), 4)
+
+        # the failed message is raised, and those after it still come
+        self.assertRaises(ValueError, queue.get)
+        got = queue.get_many(5)
+        while len(got) < 2:
+            got.extend(queue.get_many(5))
+        self.assertEqual([add(1) for add in got], [5, 6])
+
+        self.assertEqual(queue.__dict__["_prefetched"][1].ready.maxsize, 2)
+        queue.stop_prefetch()
+
+
+    def test_brined_prefetch(self):
+        self.check_prefetch(BrinedQueue())
+        self.check_prefetch(BrinedJoinableQueue())
+        self.check_prefetch(BrinedSimpleQueue())
+
+        queue = BrinedQueue()
+        queue.code_table = True
+        self.check_prefetch(queue)
+
+
+    def test_barreled_prefetch(self):
+        self.check_prefetch(BarreledQueue())
+        self.check_prefetch(BarreledJoinableQueue())
+        self.check_prefetch(BarreledSimpleQueue())
+
+        queue = BarreledQueue()
+        queue.code_table = True
+        self.check_prefetch(queue)
+
+
+    def test_prefetch_timeout(self):
+        queue = BarreledQueue()
+        queue.prefetch = 1
+        self.assertRaises(Empty, queue.get, timeout=0.01)
+        self.assertRaises(Empty, queue.get_many, 1, 0.01)
+
+        queue.put(8)
+        self.assertEqual(queue.get(timeout=5), 8)
+        queue.close()
+
+
+    def test_prefetch_traceback(self):
+        queue = BrinedQueue()
+        queue.prefetch = 1
+        queue.put(Unpicklable())
+
+        # the error is raised with the traceback from where it failed
+        # in the prefetching thread
+        try:
+            queue.get(timeout=5)
+        except ValueError:
+            names = [frame[2] for frame in extract_tb(sys.exc_info()[2])]
+            self.assertTrue("fail_unpickle" in names)
+        else:
+            self.fail("expected ValueError")
+        queue.stop_prefetch()
+
+
+    def test_prefetch_closed(self):
+        queue = BarreledQueue()
+        queue.prefetch = 1
+        queue._reader.close()
+
+        # every get raises the error which stopped the prefetching
+        # thread, rather than waiting for values which won't come
+        for _i in xrange(3):
+            self.assertRaises(EnvironmentError, queue.get, timeout=5)
+        self.assertRaises(EnvironmentError, queue.get_many, 1, 5)
+        queue.stop_prefetch()
+
+
+    def check_stop(self, queue):
+        queue.prefetch = 4
+        for by_x in xrange(6):
+            queue.put(make_adder(by_x))
+        self.assertEqual(queue.get_many(1, 5)[0](1), 1)
+
+        # the messages prefetched but not gotten are put back, and
+        # getting starts prefetching anew
+        queue.stop_prefetch()
+        self.assertTrue("_prefetched" not in queue.__dict__)
+        got = []
+        while len(got) < 5:
+            got.extend(add(1) for add in queue.get_many(5, 5))
+        self.assertEqual(sorted(got), [2, 3, 4, 5, 6])
+        queue.stop_prefetch()
+
+
+    def test_prefetch_stop(self):
+        self.check_stop(BrinedQueue())
+        self.check_stop(BrinedSimpleQueue())
+        self.check_stop(BarreledQueue())
+        self.check_stop(BarreledSimpleQueue())
+
+
+    def check_stop_full(self, queue):
+        queue.prefetch = 2
+        for by_x in xrange(2):
+            queue.put(make_adder(by_x))
+        self.assertEqual(queue.get_many(1, 5)[0](1), 1)
+
+        # the prefetching thread holds the next three messages, and
+        # then the queue is filled again
+        for by_x in xrange(2, 4):
+            queue.put(make_adder(by_x))
+        while queue.qsize():
+            sleep(0.01)
+        for by_x in xrange(4, 6):
+            queue.put(make_adder(by_x))
+
+        # there's no room to put the prefetched messages back, so
+        # they're kept for the later gets of this process instead
+        stopper = Thread(target=queue.stop_prefetch)
+        stopper.daemon = True
+        stopper.start()
+        stopper.join(10)
+        self.assertFalse(stopper.is_alive())
+
+        got = []
+        while len(got) < 5:
+            got.extend(add(1) for add in queue.get_many(5, 5))
+        self.assertEqual(sorted(got), [2, 3, 4, 5, 6])
+        queue.stop_prefetch()
+
+
+    def test_prefetch_stop_full(self):
+        self.check_stop_full(BrinedQueue(2))
+        self.check_stop_full(BarreledJoinableQueue(2))
+
+
+    def test_prefetch_stop_code_table(self):
+        # no other process may get the prefetched values, so they are
+        # kept, in order, for the later gets of this one
+        for queue in (BrinedQueue(), BarreledQueue()):
+            queue.code_table = True
+            self.check_stop(queue)
+
+            queue.prefetch = 4
+            for by_x in xrange(4):
+                queue.put(make_adder(by_x))
+            self.assertEqual(queue.get_many(1, 5)[0](1), 1)
+            queue.stop_prefetch()
+            got = []
+            while len(got) < 3:
+                got.extend(add(1) for add in queue.get_many(3, 5))
+            self.assertEqual(got, [2, 3, 4])
+            queue.stop_prefetch()
+
+
+    def check_early_exit(self, queue):
+        results = Queue()
+        for by_x in xrange(3):
+            queue.put(make_adder(by_x))
+
+        # the other process exits while its prefetching thread has two
+        # messages and is waiting for more, which mustn't keep the
+        # queue locked, or lose those messages
+        process = Process(target=mp_get_prefetched,
+                          args=(queue, results, 1))
+        process.start()
+        self.assertEqual(results.get(timeout=10), [1])
+        process.join(10)
+
+        for by_x in xrange(3, 8):
+            queue.put(make_adder(by_x))
+        got = []
+        while len(got) < 7:
+            got.extend(add(1) for add in queue.get_many(7, 5))
+        self.assertEqual(sorted(got), range(2, 9))
+
+        if hasattr(queue, "task_done"):
+            for _i in xrange(7):
+                queue.task_done()
+            joiner = Thread(target=queue.join)
+            joiner.daemon = True
+            joiner.start()
+            joiner.join(10)
+            self.assertFalse(joiner.is_alive())
+
+
+    def test_prefetch_early_exit(self):
+        self.check_early_exit(BrinedQueue())
+        self.check_early_exit(BrinedJoinableQueue())
+        self.check_early_exit(BrinedSimpleQueue())
+        self.check_early_exit(BarreledJoinableQueue())
+        self.check_early_exit(BarreledSimpleQueue())
+
+
+def mp_get_prefetched(queue, results, count):
+    # gets count adders from queue with prefetch set, and puts the
+    # result of calling each with 1. The process then exits as soon as
+    # the rest of the queue has been prefetched.
+    queue.prefetch = 4
+    got = []
+    while len(got) < count:
+        got.extend(add(1) for add in queue.get_many(count - len(got), 5))
+        if hasattr(queue, "task_done"):
+            queue.task_done()
+    while not queue.empty():
+        sleep(0.01)
+    results.put(got)
+
+
+class TestQueueFunctionCache(TestCase):
+
+    def check_function_cache(self, queue):
+        queue.function_cache = LRUCache(4)
+
+        for by_x in (5, 5, 6, 5):
+            queue.put(make_adder(by_x))
+        queue.put_many([make_adder(5), make_adder(6)])
+
+        got = [queue.get() for _i in xrange(6)]
+        self.assertEqual([add(1) for add in got], [6, 6, 7, 6, 6, 7])
+        self.assertTrue(got[0] is got[1] is got[3] is got[4])
+        self.assertTrue(got[2] is got[5])
+
+        info = queue.function_cache.info()
+        self.assertEqual((info.hits, info.misses), (4, 2))
+
+
+    def test_brined_function_cache(self):
+        self.check_function_cache(BrinedQueue())
+        self.check_function_cache(BrinedSimpleQueue())
+
+        queue = BrinedQueue()
+        queue.code_table = True
+        self.check_function_cache(queue)
+
+
+    def test_barreled_function_cache(self):
+        self.check_function_cache(BarreledQueue())
+        self.check_function_cache(BarreledSimpleQueue())
+
+        queue = BarreledQueue()
+        queue.code_table = True
+        self.check_function_cache(queue)
+
+
+def make_channels(**opts):
+    # a channel putting to and a channel getting from the same queue
+    token, state = urandom(8), Array("l", 2)
+    sender = _CodeChannel(token, state, **opts)
+    receiver = _CodeChannel(token, state, **opts)
+    receiver.listen()
+    return sender, receiver
+
+
+def sent_to(sent):
+    # a put which pickles its message as a queue does
+    def put(message):
+        sent.append(cPickle.dumps(message, cPickle.HIGHEST_PROTOCOL))
+    return put
+
+
+def put_brined(channel, put, value):
+    # brines value as a single batch and puts it via channel, as a
+    # queue with code_table set does
+    codes = dict()
+    channel.put(put, _brine_batch(value, None, codes), codes)
+
+
+def receive_brined(receiver, data):
+    return receiver.loads_brined(cPickle.loads(data))
+
+
+class TestCodeChannel(TestCase):
+
+    def test_channel_brined(self):
+        sender, receiver = make_channels()
+
+        sent = []
+        for by_x in xrange(3):
+            add = make_adder(by_x)
+            put_brined(sender, sent_to(sent), [add, partial(add, 2)])
+
+        # only the first value carries the code
+        self.assertTrue(len(sent[1]) < len(sent[0]))
+        self.assertEqual(len(sent[1]), len(sent[2]))
+
+        for by_x, data in enumerate(sent):
+            add, part = receive_brined(receiver, data)
+            self.assertEqual(add(1), by_x + 1)
+            self.assertTrue(part.func is add)
+            self.assertEqual(part(), by_x + 2)
+
+        # a channel which missed the code can't recreate the function
+        missed = _CodeChannel(sender.token, sender.state)
+        missed.listen()
+        self.assertRaises(UnpicklingError, receive_brined, missed, sent[1])
+
+
+    def test_channel_barrel(self):
+        sender, receiver = make_channels()
+
+        sent = []
+        for by_x in xrange(3):
+            bar = Barrel()
+            bar[0] = make_adder(by_x)
+            sender.put_barrel(sent_to(sent), bar)
+
+        self.assertTrue(len(sent[1]) < len(sent[0]))
+        for by_x, data in enumerate(sent):
+            bar = receiver.loads(cPickle.loads(data))
+            self.assertEqual(bar[0](1), by_x + 1)
+
+
+    def test_channel_equal_code(self):
+        sender, receiver = make_channels()
+
+        # code which is equal but not identical has its own digest,
+        # whether in the same value or sent later
+        sent = []
+        funcs = make_equal_consts()
+        put_brined(sender, sent_to(sent), funcs[:2])
+        for func in funcs[2:]:
+            put_brined(sender, sent_to(sent), func)
+
+        got = receive_brined(receiver, sent[0])
+        got.extend(receive_brined(receiver, data) for data in sent[1:])
+        got = [func() for func in got]
+        self.assertEqual(map(type, got), map(type, EQUAL_CONSTS))
+        self.assertEqual(got, EQUAL_CONSTS)
+
+        # code which can't be digested is always sent in full
+        obj = Obj(5)
+        bar = Barrel(first=make_const(obj), listed=make_const([1, 2]))
+        sender.put_barrel(sent_to(sent), bar)
+        bar = receiver.loads(cPickle.loads(sent[-1]))
+        self.assertEqual(bar["first"]().get_value(), 5)
+        self.assertEqual(bar["listed"](), [1, 2])
+
+
+    def test_channel_failed_put(self):
+        sender, receiver = make_channels()
+
+        def fail(message):
+            cPickle.dumps(message, cPickle.HIGHEST_PROTOCOL)
+            raise ValueError("queue is full")
+
+        # code from a value which couldn't be put is sent again with
+        # the next value
+        self.assertRaises(ValueError, put_brined,
+                          sender, fail, make_adder(1))
+        self.assertEqual(len(sender.sent), 0)
+
+        sent = []
+        put_brined(sender, sent_to(sent), make_adder(2))
+        self.assertEqual(receive_brined(receiver, sent[0])(1), 3)
+
+
+    def test_channel_generations(self):
+        sender, receiver = make_channels(size=2)
+        adders = [eval("lambda x: x + %i" % by_x) for by_x in xrange(4)]
+
+        # code beyond the size of the table is sent in full
+        sent = []
+        for add in adders + adders:
+            put_brined(sender, sent_to(sent), add)
+        self.assertEqual(len(sender.sent), 2)
+        self.assertTrue(len(sent[4]) < len(sent[0]))
+        self.assertEqual(len(sent[6]), len(sent[2]))
+
+        # the getter then starts a new generation, keeping the code of
+        # the last one for values which were put before it started
+        got = [receive_brined(receiver, data)(1) for data in sent]
+        self.assertEqual(got, [1, 2, 3, 4] * 2)
+        self.assertEqual(receiver.gen, 1)
+        self.assertEqual(len(receiver.received), 0)
+        self.assertEqual(len(receiver.previous), 2)
+
+        # and the code is sent again in the new generation
+        sent = []
+        for add in adders:
+            put_brined(sender, sent_to(sent), add)
+        self.assertEqual(sender.sent_gen, 1)
+        self.assertEqual(len(sender.sent), 2)
+
+        got = [receive_brined(receiver, data)(1) for data in sent]
+        self.assertEqual(got, [1, 2, 3, 4])
+        self.assertEqual(receiver.gen, 2)
+
+
+def mp_get_added(queue, results, count):
+    # gets count adders from queue, and puts the result of calling
+    # each with 1, or the name of the error raised in getting them
+    try:
+        got = [queue.get(timeout=5)(1) for _i in xrange(count)]
+    except Exception as exc:
+        got = type(exc).__name__
+    results.put(got)
+
+
+class TestCodeTableGetters(TestCase):
+
+    def check_getters(self, queue):
+        queue.code_table = True
+        results = Queue()
+
+        for by_x in xrange(4):
+            queue.put(make_adder(by_x))
+
+        def run_getter(count):
+            process = Process(target=mp_get_added,
+                              args=(queue, results, count))
+            process.start()
+            got = results.get(timeout=10)
+            process.join()
+            return got
+
+        # the first process to get claims the queue, and any other
+        # process is refused without losing any values
+        self.assertEqual(run_getter(2), [1, 2])
+        self.assertEqual(run_getter(2), "ValueError")
+        self.assertRaises(ValueError, queue.get, timeout=5)
+        self.assertEqual(queue.qsize(), 2)
+
+
+    def test_brined_getters(self):
+        self.check_getters(BrinedQueue())
+        self.check_getters(BrinedJoinableQueue())
+
+
+    def test_barreled_getters(self):
+        self.check_getters(BarreledQueue())
+
+
+class TestBarreledJoinableQueue(JoinableTests, TestBarreledQueue):
 
     def create_queue(self):
         return BarreledJoinableQueue()